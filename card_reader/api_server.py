@@ -0,0 +1,322 @@
+"""Headless HTTP extraction API
+
+WSGI service exposing the card extraction pipeline without Streamlit:
+
+    POST {API_PREFIX}/extract        one image (multipart "file" or raw body)
+    POST {API_PREFIX}/extract/batch  several images (multipart "files")
+    GET  {API_PREFIX}/health         liveness probe
+    GET  {API_PREFIX}/ready          readiness probe (OCR readers warmed up)
+
+    POST {API_PREFIX}/jobs           queue one image, returns a job ID at once
+    GET  {API_PREFIX}/jobs/<id>      job status (?wait=<seconds> to long-poll)
+    GET  {API_PREFIX}/jobs/<id>/events  server-sent events on status changes
+
+    GET  {API_PREFIX}/export.<vcf|csv>  stored cards, streamed; filters
+                                        ?since=&until= (YYYY-MM-DD), ?company=
+
+Requests are served by a shared pool of warm EasyOCR readers. The number of
+requests in flight is capped; above the cap the API answers 503 with
+Retry-After instead of queueing without bound.
+
+Run with `python api_server.py` or any WSGI server (`gunicorn api_server:app`).
+"""
+
+import contextvars
+import json
+import queue
+import threading
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date, datetime
+
+import easyocr
+from werkzeug.exceptions import HTTPException, RequestEntityTooLarge
+from werkzeug.routing import Map, Rule
+from werkzeug.serving import run_simple
+from werkzeug.wrappers import Request, Response
+
+from ocr_processor import PreprocessedImage, process_ocr_to_json
+from utils.constants import (
+    ALLOWED_EXTENSIONS,
+    API_HOST,
+    API_MAX_BATCH,
+    API_MAX_INFLIGHT,
+    API_MAX_UPLOAD_MB,
+    API_OCR_WORKERS,
+    API_PORT,
+    API_PREFIX,
+    JOB_WORKERS,
+    SHARED_OCR_WEIGHTS,
+    gemini_key,
+)
+from utils.card_export import EXPORT_FORMATS, CardFilter, export_chunks
+from utils.job_queue import JobQueue, start_workers
+from utils.logger import logThis
+from utils.shared_weights import shared_ocr_reader
+from utils.tracing import span
+
+# Formats Pillow reports under another name than the file extension; phone
+# cameras save JPEGs with an MPO (multi-picture) container
+FORMAT_ALIASES = {"mpo": "jpeg"}
+
+
+class OcrWorkerPool:
+    """A fixed set of warm EasyOCR readers shared by all API requests."""
+
+    def __init__(self, size: int):
+        self.size = size
+        self.readers: queue.Queue = queue.Queue()
+        self.executor = ThreadPoolExecutor(max_workers=size, thread_name_prefix="ocr")
+        self.ready = threading.Event()
+        self.error = None
+
+    def warm_up(self):
+        """Load every reader; run in the background so probes answer at once."""
+        try:
+            for _ in range(self.size):
+                # With shared weights every reader maps the same pages
+                self.readers.put(
+                    shared_ocr_reader(["en"])
+                    if SHARED_OCR_WEIGHTS
+                    else easyocr.Reader(["en"], gpu=False)
+                )
+            self.ready.set()
+            logThis.info("OCR worker pool ready with %d readers ✅", self.size)
+        except Exception as e:
+            self.error = e
+            logThis.error("OCR worker pool failed to initialize: %s", e)
+
+    def _take_reader(self):
+        """Wait for a free reader; raise at once if warm-up failed."""
+        while True:
+            if self.error is not None:
+                raise RuntimeError(
+                    f"OCR worker pool failed to initialize: {self.error}"
+                )
+            try:
+                return self.readers.get(timeout=1)
+            except queue.Empty:
+                continue
+
+    def extract(self, image_bytes: bytes):
+        reader = self._take_reader()
+        try:
+            prepared = PreprocessedImage(image_bytes)
+            image_format = (prepared.header["format"] or "").lower()
+            image_format = FORMAT_ALIASES.get(image_format, image_format)
+            if image_format not in ALLOWED_EXTENSIONS:
+                raise ValueError(f"Unsupported image format: {image_format}")
+            return process_ocr_to_json(prepared, reader, gemini_key)
+        finally:
+            self.readers.put(reader)
+
+    def submit(self, image_bytes: bytes):
+        return self.executor.submit(
+            contextvars.copy_context().run, self.extract, image_bytes
+        )
+
+
+pool = OcrWorkerPool(API_OCR_WORKERS)
+inflight = threading.BoundedSemaphore(API_MAX_INFLIGHT)
+job_queue = JobQueue()
+
+
+class ExtractionRequest(Request):
+    max_content_length = API_MAX_UPLOAD_MB * 1024 * 1024
+    max_form_memory_size = API_MAX_UPLOAD_MB * 1024 * 1024
+
+
+def json_response(payload, status=200, headers=None):
+    return Response(
+        json.dumps(payload, indent=2),
+        status=status,
+        mimetype="application/json",
+        headers=headers,
+    )
+
+
+def _result_payload(future):
+    """Turn a pool result into (payload, status)."""
+    try:
+        json_result, extracted_text = future.result()
+    except Exception as e:
+        return {"error": str(e), "error_type": type(e).__name__}, 400
+
+    try:
+        result = json.loads(json_result)
+    except json.JSONDecodeError:
+        return {"error": "Invalid JSON format returned", "raw": json_result}, 502
+
+    status = 422 if result.get("error") else 200
+    return {"result": result, "extracted_text": extracted_text}, status
+
+
+def _request_images(request: Request, field: str):
+    """Collect image bytes from multipart files or the raw request body."""
+    if request.content_length and request.content_length > (
+        ExtractionRequest.max_content_length
+    ):
+        raise RequestEntityTooLarge()
+    if request.mimetype == "multipart/form-data":
+        return [f.read() for f in request.files.getlist(field) if f]
+    data = request.get_data(cache=False)
+    return [data] if data else []
+
+
+def extract(request: Request):
+    images = _request_images(request, "file")
+    if len(images) != 1:
+        return json_response({"error": "Send exactly one image"}, 400)
+
+    payload, status = _result_payload(pool.submit(images[0]))
+    return json_response(payload, status)
+
+
+def extract_batch(request: Request):
+    images = _request_images(request, "files")
+    if not images:
+        return json_response({"error": "No images provided"}, 400)
+    if len(images) > API_MAX_BATCH:
+        return json_response(
+            {"error": f"At most {API_MAX_BATCH} images per batch"}, 413
+        )
+
+    # At most one image per OCR worker is queued for a batch at any time, so
+    # a batch never holds more than pool.size queue slots and single-image
+    # requests are not stuck behind it
+    pending = iter(images)
+    futures = deque(
+        pool.submit(image_bytes) for _, image_bytes in zip(range(pool.size), pending)
+    )
+    results = []
+    while futures:
+        payload, status = _result_payload(futures.popleft())
+        payload["status"] = status
+        results.append(payload)
+        image_bytes = next(pending, None)
+        if image_bytes is not None:
+            futures.append(pool.submit(image_bytes))
+    return json_response({"results": results})
+
+
+def submit_job(request: Request):
+    images = _request_images(request, "file")
+    if len(images) != 1:
+        return json_response({"error": "Send exactly one image"}, 400)
+
+    filename = request.args.get("filename", "")
+    if request.mimetype == "multipart/form-data":
+        filename = request.files["file"].filename or filename
+    job_id, created = job_queue.submit(images[0], filename)
+    job = job_queue.get(job_id)
+    return json_response(
+        {"job_id": job_id, "status": job["status"], "deduplicated": not created},
+        202,
+        {"Location": f"{API_PREFIX}/jobs/{job_id}"},
+    )
+
+
+def get_job(request: Request, job_id: str):
+    wait = min(request.args.get("wait", 0, type=float), 60)
+    job = job_queue.wait(job_id, wait) if wait > 0 else job_queue.get(job_id)
+    if job is None:
+        return json_response({"error": "Job not found"}, 404)
+    return json_response(job)
+
+
+def job_events(request: Request, job_id: str):
+    if job_queue.get(job_id) is None:
+        return json_response({"error": "Job not found"}, 404)
+
+    def stream():
+        for job in job_queue.subscribe(job_id):
+            yield f"event: {job['status']}\ndata: {json.dumps(job)}\n\n"
+
+    return Response(stream(), mimetype="text/event-stream")
+
+
+def export_cards(request: Request, export_format: str):
+    if export_format not in EXPORT_FORMATS:
+        return json_response({"error": f"Unknown export format: {export_format}"}, 404)
+    try:
+        since, until = (
+            date.fromisoformat(request.args[name]) if request.args.get(name) else None
+            for name in ("since", "until")
+        )
+    except ValueError:
+        return json_response({"error": "Dates must be YYYY-MM-DD"}, 400)
+    card_filter = CardFilter(since, until, request.args.get("company"))
+
+    _, mimetype, extension = EXPORT_FORMATS[export_format]
+    filename = f"cards_{datetime.now().strftime('%Y%m%d_%H%M%S')}.{extension}"
+    return Response(
+        export_chunks(export_format, card_filter),
+        mimetype=mimetype,
+        headers={"Content-Disposition": f'attachment; filename="{filename}"'},
+    )
+
+
+def health(request: Request):
+    return json_response({"status": "ok"})
+
+
+def ready(request: Request):
+    if pool.ready.is_set():
+        return json_response({"status": "ready", "workers": pool.size})
+    status = "failed" if pool.error else "warming_up"
+    return json_response({"status": status}, 503)
+
+
+url_map = Map(
+    [
+        Rule(f"{API_PREFIX}/extract", endpoint=extract, methods=["POST"]),
+        Rule(f"{API_PREFIX}/extract/batch", endpoint=extract_batch, methods=["POST"]),
+        Rule(f"{API_PREFIX}/health", endpoint=health, methods=["GET"]),
+        Rule(f"{API_PREFIX}/ready", endpoint=ready, methods=["GET"]),
+        Rule(f"{API_PREFIX}/jobs", endpoint=submit_job, methods=["POST"]),
+        Rule(f"{API_PREFIX}/jobs/<job_id>", endpoint=get_job, methods=["GET"]),
+        Rule(
+            f"{API_PREFIX}/jobs/<job_id>/events", endpoint=job_events, methods=["GET"]
+        ),
+        Rule(
+            f"{API_PREFIX}/export.<export_format>",
+            endpoint=export_cards,
+            methods=["GET"],
+        ),
+    ]
+)
+# Probes, job and export endpoints never touch the OCR pool and never count
+# against the cap
+UNCAPPED_ENDPOINTS = {health, ready, submit_job, get_job, job_events, export_cards}
+
+
+@ExtractionRequest.application
+def app(request: Request):
+    try:
+        endpoint, values = url_map.bind_to_environ(request.environ).match()
+        if endpoint in UNCAPPED_ENDPOINTS:
+            return endpoint(request, **values)
+
+        if not pool.ready.is_set():
+            return json_response(
+                {"error": "OCR workers are warming up"}, 503, {"Retry-After": "5"}
+            )
+        if not inflight.acquire(blocking=False):
+            return json_response(
+                {"error": "Server busy, retry later"}, 503, {"Retry-After": "1"}
+            )
+        try:
+            with span(f"http {request.path}"):
+                return endpoint(request, **values)
+        finally:
+            inflight.release()
+    except HTTPException as e:
+        return json_response({"error": e.description}, e.code)
+
+
+threading.Thread(target=pool.warm_up, name="ocr-warm-up", daemon=True).start()
+job_workers = start_workers(job_queue, pool.extract, JOB_WORKERS)
+
+
+if __name__ == "__main__":
+    run_simple(API_HOST, API_PORT, app, threaded=True)
@@ -8,25 +8,27 @@ from pathlib import Path
 
 from utils.logger import logThis
 import streamlit as st
-from ocr_processor import (
-    preprocess_image,
-    resize_image,
-    load_ocr_reader,
-    process_ocr_to_json,
-    save_to_json,
+from extraction_tasks import (
+    CANCELLED,
+    DONE,
+    QUEUED,
+    ExtractionBatch,
+    link_image_when_stored,
+    submit_extraction,
 )
+from ocr_processor import PreprocessedImage, load_ocr_reader
 sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
-from PIL import Image
-from utils.aws_helper import upload_file_to_s3
+from utils.cache import LRUCache
 from utils.constants import (
     ALLOWED_EXTENSIONS,
     CARD_SAMPLES,
-    ENVIRONMENT,
     IMAGES_PER_ROW,
-    UPLOAD_FOLDER_CARD,
-    gemini_key,
+    PREPROCESS_CACHE_ITEMS,
+    UI_POLL_INTERVAL_S,
 )
+from utils.image_store import image_store
 from utils.messages import DESCRIPTION_OCR, TITLE_OCR
+from utils.thumbnails import thumbnail_service
 from werkzeug.utils import secure_filename
 
 
@@ -49,8 +51,11 @@ def display_images_with_buttons(image_paths, image_size=(200, 200)):
 
                 # wrap inside one container so image+button share same element
                 with cols[col].container(border=True):
-                    image = Image.open(sample_file)
-                    st.image(image, width="content")
+                    # Serve the cached WebP thumbnail, not the full-size sample
+                    st.image(
+                        str(thumbnail_service.thumbnail(sample_file)),
+                        width="content",
+                    )
 
                     # Compare by filename string because selected_sample stores the name
                     selected_name = st.session_state.get("selected_sample")
@@ -74,29 +79,58 @@ def display_images_with_buttons(image_paths, image_size=(200, 200)):
                         st.rerun()
 
 
+def get_preprocessed_image(image_bytes):
+    """Return the session's cached preprocessing pipeline for these bytes."""
+    if "preprocess_cache" not in st.session_state:
+        st.session_state.preprocess_cache = LRUCache(PREPROCESS_CACHE_ITEMS)
+    prepared = PreprocessedImage(image_bytes)
+    return st.session_state.preprocess_cache.get_or_create(
+        prepared.content_hash, lambda: prepared
+    )
+
+
 def handle_clear_output():
     """Clear search results and reset display."""
     st.session_state.extracted_text = ""
     st.session_state.final_json = ""
     # Clear selected sample from session state
     st.session_state.selected_sample = None
+    st.session_state.batch = None
+    # Stop following the extraction, or its result reappears on the next rerun
+    st.session_state.extraction = None
     st.rerun()
 
 
 def handle_image_upload_tab():
     """Handle the image upload tab functionality"""
-    user_uploaded_image = st.file_uploader("Upload a Card", type=ALLOWED_EXTENSIONS)
+    user_uploaded_images = st.file_uploader(
+        "Upload Cards", type=ALLOWED_EXTENSIONS, accept_multiple_files=True
+    )
 
     uploaded_image = None
     uploaded_image_name = None
     is_user_uploaded = False
+    batch_images = []
 
-    if user_uploaded_image:
-        uploaded_image = user_uploaded_image
-        uploaded_image_name = secure_filename(user_uploaded_image.name)
+    if len(user_uploaded_images) == 1:
+        uploaded_image = user_uploaded_images[0]
+        uploaded_image_name = secure_filename(uploaded_image.name)
         is_user_uploaded = True
+    elif user_uploaded_images:
+        # Several cards go through the background batch instead
+        batch_images = user_uploaded_images
 
-    return uploaded_image, uploaded_image_name, is_user_uploaded
+    return uploaded_image, uploaded_image_name, is_user_uploaded, batch_images
+
+
+@st.cache_data(show_spinner=False)
+def list_sample_images(sample_images_dir, dir_mtime_ns):
+    """List sample images; cached until the directory changes."""
+    return [
+        f.name
+        for f in Path(sample_images_dir).iterdir()
+        if f.is_file() and f.suffix.lower().lstrip(".") in ALLOWED_EXTENSIONS
+    ]
 
 
 def handle_sample_images_tab():
@@ -107,11 +141,9 @@ def handle_sample_images_tab():
     is_user_uploaded = False
 
     if sample_images_dir.exists():
-        sample_files = [
-            f.name
-            for f in sample_images_dir.iterdir()
-            if f.is_file() and f.suffix.lower().lstrip(".") in ALLOWED_EXTENSIONS
-        ]
+        sample_files = list_sample_images(
+            str(sample_images_dir), sample_images_dir.stat().st_mtime_ns
+        )
 
         if sample_files:
             sample_files = sample_files[:4]
@@ -175,87 +207,173 @@ def handle_image_display_and_save(
 
     if is_user_uploaded and save_btn:
         try:
-            if ENVIRONMENT == "production":
-                # --- Upload to S3 ---
-                s3_key = f"{UPLOAD_FOLDER_CARD}{uploaded_image_name}"
+            # Stored under its content hash, so a card saved before is neither
+            # written nor transferred again
+            stored = image_store.store(uploaded_image.getvalue(), uploaded_image_name)
+            # Extraction records of this card get the key once it is written
+            link_image_when_stored(stored)
+
+            if not stored.created:
+                st.toast("✅ Image already saved")
+            else:
+                # Re-encoded and saved in the background; the outcome is
+                # reported on a later rerun by report_finished_uploads()
+                st.session_state.pending_uploads.append(
+                    (uploaded_image_name, stored.pending)
+                )
+                st.toast("⏫ Saving image in the background")
 
-                # Reset file pointer
-                if hasattr(uploaded_image, "seek"):
-                    uploaded_image.seek(0)
+        except Exception as e:
+            st.error(f"❌ Error saving image: {str(e)}")
 
-                # Upload
-                upload_success = upload_file_to_s3(uploaded_image, s3_key)
 
-                if not upload_success:
-                    st.error("❌ Failed to upload image to S3. Please try again.")
-                    return None
-                else:
-                    st.toast("✅ Successfully uploaded image to S3 Bucket", icon="✅")
+def report_finished_uploads():
+    """Report background image saves that finished since the last run"""
+    pending = []
+    for image_name, future in st.session_state.pending_uploads:
+        if not future.done():
+            pending.append((image_name, future))
+        elif not future.exception() and future.result():
+            st.toast(f"✅ Successfully saved {image_name}", icon="✅")
+        else:
+            st.error(f"❌ Failed to save {image_name}. Please try again.")
+    st.session_state.pending_uploads = pending
 
-            else:
-                # --- Local Save ---
-                uploads_dir = Path(UPLOAD_FOLDER_CARD)
-                uploads_dir.mkdir(parents=True, exist_ok=True)
 
-                # Unique filename with timestamp
-                timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-                saved_filename = f"card_{timestamp}_{uploaded_image_name}"
-                save_path = uploads_dir / saved_filename
+def collect_extraction(task):
+    """Move a finished extraction into the results shown on the page"""
+    st.session_state.extraction = None
 
-                # Save locally
-                if hasattr(uploaded_image, "seek"):
-                    uploaded_image.seek(0)
-                image.save(save_path)
+    if task.status == CANCELLED:
+        st.toast("Extraction cancelled", icon="✖️")
+        return
 
-                st.toast("✅ Image saved")
+    st.session_state.final_json = task.json_result or ""
+    st.session_state.extracted_text = task.extracted_text
+    if task.status == DONE:
+        if task.saved:
+            st.toast(" Business card processed successfully!", icon="✅")
+        else:
+            st.warning("JSON created but failed to save to file")
+    elif task.json_result:
+        st.error(f"Processing error: {task.error}")
+    else:
+        st.error(f"Processing Error: {task.error}")
 
-        except Exception as e:
-            st.error(f"❌ Error saving image: {str(e)}")
+
+def render_extraction_status(task):
+    """Status of the running extraction, refreshed until it finishes"""
+    polling = not task.finished
+
+    @st.fragment(run_every=UI_POLL_INTERVAL_S if polling else None)
+    def extraction_status():
+        if task.finished:
+            if polling:
+                # Full rerun so the results section picks up the outcome
+                st.rerun()
+            return
+
+        waited, ran = task.timings()
+        if task.cancel_requested:
+            st.info("Cancelling, waiting for the current step to finish...")
+        elif task.status == QUEUED:
+            st.info(f"⏳ Waiting for a free worker ({waited:.0f}s)")
+        else:
+            st.info(f"🔍 Extracting text and processing with AI... ({ran:.0f}s)")
+
+        if st.button(
+            "✖️ Cancel", key="cancel_extraction", disabled=task.cancel_requested
+        ):
+            # A result already being saved is kept; keep showing it
+            if task.cancel() or task.finished or task.saving:
+                st.rerun(scope="fragment")
+            # Another session still waits for this card: only stop following it
+            st.session_state.extraction = None
+            st.toast("Extraction cancelled", icon="✖️")
+            st.rerun()
+
+    extraction_status()
+
+    if task.finished:
+        collect_extraction(task)
 
 
-def handle_processing_section(image, reader):
+def handle_processing_section(prepared, image_name, reader):
     """Handle the main processing section"""
     st.subheader("Processing")
 
-    # One-click OCR to JSON processing
+    # One-click OCR to JSON processing, run in the background so the page
+    # stays interactive and reruns do not throw the work away
     if st.button("🔍 Extract & Process to JSON", type="primary", width="stretch"):
-        with st.spinner("Extracting text and processing with AI..."):
-            try:
-                image=preprocess_image(image)
-                json_result, extracted_text = process_ocr_to_json(
-                    image, reader, gemini_key
-                )
-
-                # Store results in session state
-                st.session_state.final_json = json_result
-                st.session_state.extracted_text = extracted_text
+        if reader is None:
+            st.error("OCR reader is not available")
+        else:
+            # The same card already in flight is reused, not queued again
+            st.session_state.extraction = submit_extraction(
+                image_name, prepared, reader
+            )
 
-                # Parse JSON to check for errors and save if successful
-                try:
-                    json_data = json.loads(json_result)
-
-                    if "error" in json_data and json_data["error"]:
-                        st.error(f"Processing error: {json_data['error']}")
-                    else:
-                        # Save to JSON file
-                        if save_to_json(json_data):
-                            st.toast(
-                                " Business card processed successfully!",
-                                icon="✅",
-                            )
-                        else:
-                            st.warning("JSON created but failed to save to file")
-
-                except json.JSONDecodeError:
-                    st.error("Invalid JSON format returned")
-
-            except Exception as e:
-                st.error(f"Processing Error: {str(e)}")
+    task = st.session_state.extraction
+    if task is not None and task.content_hash == prepared.content_hash:
+        render_extraction_status(task)
 
     if st.button("🗑️ Clear Results", width="stretch"):
         handle_clear_output()
 
 
+def render_batch_progress():
+    """Live progress table of the current batch, refreshed while it runs"""
+    batch = st.session_state.batch
+    polling = not batch.finished
+
+    @st.fragment(run_every=UI_POLL_INTERVAL_S if polling else None)
+    def batch_progress():
+        total = len(batch.tasks)
+        finished = batch.finished_count
+        st.progress(finished / total, text=f"{finished} of {total} cards processed")
+        st.dataframe(batch.rows(), hide_index=True, width="stretch")
+
+        if polling and batch.finished:
+            # Full rerun so the finished batch stops polling
+            st.rerun()
+
+    batch_progress()
+
+    if batch.finished:
+        results = batch.results()
+        st.download_button(
+            f"📥 Download {len(results)} results",
+            data=json.dumps(results, indent=2),
+            file_name=f"cards_{datetime.now().strftime('%Y%m%d_%H%M%S')}.json",
+            mime="application/json",
+            width="stretch",
+        )
+
+
+def handle_batch_section(batch_images, reader):
+    """Queue several cards for background extraction"""
+    st.subheader("Batch Processing")
+
+    if st.button(
+        f"🔍 Extract All {len(batch_images)} Cards", type="primary", width="stretch"
+    ):
+        if reader is None:
+            st.error("OCR reader is not available")
+        else:
+            files = [
+                (secure_filename(image.name), image.getvalue())
+                for image in batch_images
+            ]
+            # Returns at once; the cards are processed in the background
+            st.session_state.batch = ExtractionBatch.submit(files, reader)
+
+    if st.session_state.batch is not None:
+        render_batch_progress()
+
+    if st.button("🗑️ Clear Results", key="clear_batch", width="stretch"):
+        handle_clear_output()
+
+
 def display_results():
     """Display extracted text and final JSON results"""
     # Display extracted text in an expander (optional view)
@@ -328,6 +446,13 @@ def main():
         st.session_state.final_json = ""
     if "selected_sample" not in st.session_state:
         st.session_state.selected_sample = None
+    if "batch" not in st.session_state:
+        st.session_state.batch = None
+    if "extraction" not in st.session_state:
+        st.session_state.extraction = None
+    if "pending_uploads" not in st.session_state:
+        st.session_state.pending_uploads = []
+    report_finished_uploads()
 
     # Load OCR reader
     with st.spinner("Please wait while warming up!"):
@@ -349,6 +474,7 @@ def main():
     uploaded_image = None
     uploaded_image_name = None
     is_user_uploaded = False
+    batch_images = []
 
     # Create tabs for upload and sample images
     upload_tab, _ = st.tabs(["📁 Upload Card", "🖼️ Sample Cards"])
@@ -358,17 +484,21 @@ def main():
             uploaded_image,
             uploaded_image_name,
             is_user_uploaded,
+            batch_images,
         ) = handle_image_upload_tab()
 
+    if batch_images:
+        handle_batch_section(batch_images, reader)
+
 
 
     # Main processing section - only show if an image is available
     if uploaded_image is not None:
         # Display the selected/uploaded image
         try:
-            if hasattr(uploaded_image, "seek"):
-                uploaded_image.seek(0)  # Reset file pointer for BytesIO objects
-            image = Image.open(uploaded_image)
+            # Decoded once per image and reused across reruns
+            prepared = get_preprocessed_image(uploaded_image.getvalue())
+            image = prepared.image
         except Exception as e:
             st.error(f"Error opening image: {str(e)}")
             return
@@ -381,7 +511,7 @@ def main():
             )
 
         with col2:
-            handle_processing_section(image, reader)
+            handle_processing_section(prepared, uploaded_image_name, reader)
 
         # Display results section
         display_results()
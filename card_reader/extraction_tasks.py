@@ -0,0 +1,314 @@
+"""Background Card Extraction
+
+Runs `process_ocr_to_json` off the Streamlit script thread. Work is submitted
+to one executor shared by every session in the process, so a rerun or a widget
+interaction never interrupts an extraction in progress; the page keeps a
+handle to its tasks in session state and polls them.
+
+    task = submit_extraction(name, image, reader)   # returns at once
+    task.status, task.result, task.cancel()
+
+    batch = ExtractionBatch.submit(files, reader)   # [(name, image_bytes), ...]
+    batch.rows()                                    # progress table rows
+
+A card already queued or running is not queued again: submitting the same
+image bytes returns the task in flight, whichever session started it. Every
+session that submitted it counts as a subscriber, and `cancel()` only stops
+the task when the last subscriber cancels.
+
+Lock order: `_in_flight_lock` is never taken while a task's `_lock` is held.
+
+Extraction records carry the `image_sha256` of their card. The image itself
+is only stored when the user saves it; records get their `image_key` once
+that object is written (`link_image_when_stored`).
+"""
+
+import contextvars
+import json
+import threading
+import time
+import uuid
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from ocr_processor import (
+    PreprocessedImage,
+    link_image,
+    process_ocr_to_json,
+    save_to_json,
+)
+from utils.constants import UI_EXTRACTION_WORKERS, gemini_key
+from utils.image_store import image_store
+from utils.logger import logThis
+from utils.tracing import span
+
+executor = ThreadPoolExecutor(
+    max_workers=UI_EXTRACTION_WORKERS, thread_name_prefix="extract"
+)
+
+QUEUED = "queued"
+RUNNING = "running"
+DONE = "done"
+FAILED = "failed"
+CANCELLED = "cancelled"
+FINISHED_STATUSES = {DONE, FAILED, CANCELLED}
+
+# Queued or running tasks by image content hash
+_in_flight: Dict[str, "ExtractionTask"] = {}
+_in_flight_lock = threading.Lock()
+
+
+def _display(value) -> Optional[str]:
+    """Flatten list fields of a result for a table cell."""
+    if isinstance(value, list):
+        return ", ".join(str(v) for v in value if v) or None
+    return value
+
+
+class ExtractionTask:
+    """One card extraction running in the background executor."""
+
+    def __init__(self, name: str, image, reader):
+        self.name = name
+        self.prepared = (
+            image if isinstance(image, PreprocessedImage) else PreprocessedImage(image)
+        )
+        self.content_hash = self.prepared.content_hash
+        self.reader = reader
+        self.status = QUEUED
+        self.submitted_at = time.time()
+        self.started_at: Optional[float] = None
+        self.finished_at: Optional[float] = None
+        self.json_result: Optional[str] = None
+        self.extracted_text = ""
+        self.result: Optional[dict] = None
+        self.error: Optional[str] = None
+        self.saved = False
+        self.cancel_requested = False
+        # Set once the result is being saved; too late to cancel
+        self.saving = False
+        self.subscribers = 1
+        self._lock = threading.Lock()
+        self.future: Future = executor.submit(contextvars.copy_context().run, self._run)
+
+    @property
+    def finished(self) -> bool:
+        return self.status in FINISHED_STATUSES
+
+    def subscribe(self) -> bool:
+        """Add a subscriber; False if the task is already finished or cancelled."""
+        with self._lock:
+            if self.finished or self.cancel_requested:
+                return False
+            self.subscribers += 1
+            return True
+
+    def cancel(self) -> bool:
+        """
+        Withdraw one subscriber; cancel the extraction when none is left.
+
+        Returns True if the task was cancelled, False if other subscribers still
+        wait for it (or it already finished).
+
+        A queued task never starts. A running one cannot be interrupted inside
+        OCR or the LLM call, so it runs to the end and its result is discarded
+        without being saved.
+        """
+        with self._lock:
+            if self.finished or self.cancel_requested or self.saving:
+                return False
+            self.subscribers -= 1
+            if self.subscribers > 0:
+                logThis.info(
+                    "Left extraction of %s, %d subscribers remain",
+                    self.name,
+                    self.subscribers,
+                )
+                return False
+            self.cancel_requested = True
+            cancelled = self.future.cancel()
+            if cancelled:
+                self._finish_cancelled()
+        if cancelled:
+            _forget(self)
+        logThis.info("Cancelled extraction of %s", self.name)
+        return True
+
+    def _finish_cancelled(self):
+        """Mark the task cancelled; the caller forgets it outside the lock."""
+        self.status = CANCELLED
+        self.finished_at = time.time()
+        self.prepared = None
+
+    def _run(self):
+        with self._lock:
+            cancelled = self.cancel_requested
+            if cancelled:
+                self._finish_cancelled()
+            else:
+                self.status = RUNNING
+                self.started_at = time.time()
+        if cancelled:
+            _forget(self)
+            return
+        try:
+            with span("extract_request", card=self.name):
+                json_result, extracted_text = process_ocr_to_json(
+                    self.prepared, self.reader, gemini_key
+                )
+            result = json.loads(json_result)
+            error = result.get("error")
+        except Exception as e:
+            logThis.error("Background extraction of %s failed: %s", self.name, e)
+            json_result, extracted_text, result = None, "", None
+            error = str(e)
+
+        # A cancel either comes first and the result is discarded, or finds
+        # the task saving and leaves it be
+        with self._lock:
+            cancelled = self.cancel_requested
+            if cancelled:
+                self._finish_cancelled()
+            else:
+                self.saving = True
+        if cancelled:
+            _forget(self)
+            return
+
+        # Saved outside the lock, so progress polling never waits on the file
+        saved = False
+        if not error:
+            result["image_sha256"] = self.content_hash
+            self._link_stored_image(result)
+            saved = save_to_json(result)
+
+        with self._lock:
+            status = FAILED if error else DONE
+            self.json_result = json_result
+            self.extracted_text = extracted_text
+            self.result = result
+            self.error = error
+            self.saved = saved
+            self.finished_at = time.time()
+            self.status = status
+            # Decoded pixels are not needed once the result is in
+            self.prepared = None
+        _forget(self)
+
+    def _link_stored_image(self, result: dict) -> None:
+        """
+        Point the record at the card image if the user saved it already, or
+        link it once a save in progress finishes. Never stores the image.
+        """
+        try:
+            image_key = image_store.lookup(self.content_hash)
+            if image_key:
+                result["image_key"] = image_key
+                return
+            stored = image_store.pending(self.content_hash)
+            if stored is not None:
+                link_image_when_stored(stored)
+        except Exception as e:
+            logThis.error("Could not look up the image of %s: %s", self.name, e)
+
+    def timings(self) -> Tuple[Optional[float], Optional[float]]:
+        """Seconds spent (waiting in the queue, extracting) so far."""
+        with self._lock:
+            now = time.time()
+            started = self.started_at or now
+            waited = started - self.submitted_at
+            ran = (self.finished_at or now) - started if self.started_at else None
+        return waited, ran
+
+    def row(self) -> dict:
+        """Progress table row for this task."""
+        waited, ran = self.timings()
+        result = self.result or {}
+        return {
+            "card": self.name,
+            "status": self.status,
+            "queued_s": round(waited, 1),
+            "extract_s": round(ran, 1) if ran is not None else None,
+            "name": _display(result.get("name")),
+            "company": _display(result.get("company")),
+            "email": _display(result.get("email")),
+            "error": self.error,
+        }
+
+
+def link_image_when_stored(stored) -> None:
+    """Point saved records at a `StoredImage` once it is written."""
+    if stored.pending is None:
+        link_image(stored.content_hash, stored.key)
+        return
+
+    def linked(future: Future) -> None:
+        if not future.exception() and future.result():
+            link_image(stored.content_hash, stored.key)
+
+    stored.pending.add_done_callback(linked)
+
+
+def _forget(task: ExtractionTask) -> None:
+    """Drop a finished task from the in-flight registry."""
+    with _in_flight_lock:
+        if _in_flight.get(task.content_hash) is task:
+            del _in_flight[task.content_hash]
+
+
+def submit_extraction(name: str, image, reader) -> ExtractionTask:
+    """
+    Queue one card (image bytes or a PreprocessedImage) for extraction.
+
+    Returns the task already in flight for the same image, if any.
+    """
+    prepared = (
+        image if isinstance(image, PreprocessedImage) else PreprocessedImage(image)
+    )
+    while True:
+        with _in_flight_lock:
+            task = _in_flight.get(prepared.content_hash)
+            if task is None:
+                task = ExtractionTask(name, prepared, reader)
+                if not task.finished:
+                    _in_flight[task.content_hash] = task
+                return task
+        # Subscribed outside _in_flight_lock: the task takes its own lock first
+        if task.subscribe():
+            logThis.info("%s is already being extracted, reusing its task", name)
+            return task
+        # Finishing or cancelled: stop offering it and queue a new task
+        _forget(task)
+
+
+class ExtractionBatch:
+    """A set of cards submitted together from one upload."""
+
+    def __init__(self, tasks: List[ExtractionTask]):
+        self.id = uuid.uuid4().hex
+        self.tasks = tasks
+        self.submitted_at = time.time()
+
+    @classmethod
+    def submit(cls, files: Iterable[Tuple[str, bytes]], reader) -> "ExtractionBatch":
+        """Queue every (name, image_bytes) pair and return the batch at once."""
+        batch = cls([submit_extraction(name, data, reader) for name, data in files])
+        logThis.info("Queued batch %s with %d cards", batch.id, len(batch.tasks))
+        return batch
+
+    @property
+    def finished_count(self) -> int:
+        return sum(task.finished for task in self.tasks)
+
+    @property
+    def finished(self) -> bool:
+        return self.finished_count == len(self.tasks)
+
+    def rows(self) -> List[dict]:
+        return [task.row() for task in self.tasks]
+
+    def results(self) -> List[dict]:
+        """Extracted records of the cards that completed successfully."""
+        return [
+            task.result for task in self.tasks if task.status == DONE and task.result
+        ]
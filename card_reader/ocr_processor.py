@@ -1,6 +1,11 @@
+import hashlib
+import io
 import json
 import os
+import tempfile
+import threading
 from datetime import datetime
+from functools import cached_property
 from pathlib import Path
 
 import cv2
@@ -9,8 +14,40 @@ import numpy as np
 import streamlit as st
 from google import genai
 from google.genai.types import GenerateContentConfig
+from PIL import Image
+
+from utils.constants import CARD_STORE_ENABLED, RESULTS_FILE, SHARED_OCR_WEIGHTS
+from utils.logger import logThis
+from utils.memory import (
+    guard_decode,
+    guard_dimensions,
+    guard_image,
+    measure_stage,
+    track_memory,
+)
+from utils.profiler import profile_slow_requests
+from utils.replay import (
+    is_replaying,
+    record,
+    record_slow_requests,
+    replayed_llm_response,
+)
+from utils.shared_weights import shared_ocr_reader
+from utils.tracing import current_span, span, traced
+
+_results_lock = threading.Lock()
 
-from utils.constants import RESULTS_FILE
+# Longest image side fed to the OCR model
+OCR_MAX_DIM = 1600
+# Pillow formats decoded by libjpeg; phone cameras write MPO (multi-picture)
+JPEG_FORMATS = {"JPEG", "MPO"}
+READTEXT_PARAMS = {
+    "detail": 1,
+    "paragraph": True,
+    "width_ths": 0.7,
+    "height_ths": 0.7,
+    "batch_size": 1,
+}
 
 
 @st.cache_resource(show_spinner=False)
@@ -18,6 +55,9 @@ def load_ocr_reader():
     """Load and cache EasyOCR reader safely for Streamlit Cloud"""
     try:
 
+        if SHARED_OCR_WEIGHTS:
+            # Weights mapped from one shared file instead of a private copy
+            return shared_ocr_reader(["en"], download_enabled=True)
         reader = easyocr.Reader(
             ["en"],
             gpu=False,
@@ -28,7 +68,7 @@ def load_ocr_reader():
         st.error(f"❌ Failed to initialize OCR Reader: {e}")
 
 
-def resize_image(img, max_dim=1600):
+def resize_image(img, max_dim=OCR_MAX_DIM):
     """Resize business card images for OCR without losing detail"""
     h, w = img.shape[:2]
     scale = max_dim / max(h, w)
@@ -39,50 +79,186 @@ def resize_image(img, max_dim=1600):
     return img
 
 
-def preprocess_image(image):
-    """Preprocess PIL image for better OCR performance"""
-    
-    # Convert PIL image to NumPy array (OpenCV format)
-    img_array = np.array(image)
-
+def to_grayscale(img_array):
+    """Convert an RGB/RGBA/grayscale array to a single grayscale channel"""
     # Handle different channel formats
     if img_array.ndim == 2:
         # Already grayscale
-        gray = img_array
+        return img_array
     elif img_array.shape[2] == 4:
         # RGBA → convert to BGR
         img_array = cv2.cvtColor(img_array, cv2.COLOR_RGBA2BGR)
-        gray = cv2.cvtColor(img_array, cv2.COLOR_BGR2GRAY)
+        return cv2.cvtColor(img_array, cv2.COLOR_BGR2GRAY)
     elif img_array.shape[2] == 3:
         # RGB → convert to BGR → grayscale
         img_array = cv2.cvtColor(img_array, cv2.COLOR_RGB2BGR)
-        gray = cv2.cvtColor(img_array, cv2.COLOR_BGR2GRAY)
+        return cv2.cvtColor(img_array, cv2.COLOR_BGR2GRAY)
     else:
         raise ValueError(f"Unsupported number of channels: {img_array.shape[2]}")
 
-    # Resize for OCR
-    gray = resize_image(gray)  # gray is single channel now
 
+def _jpeg_reduction(width, height, max_dim=OCR_MAX_DIM):
+    """Largest libjpeg DCT scale (1, 2, 4, 8) that keeps max_dim pixels"""
+    reduction = 1
+    while reduction < 8 and max(width, height) / (reduction * 2) >= max_dim:
+        reduction *= 2
+    return reduction
+
+
+class PreprocessedImage:
+    """
+    Preprocessing pipeline for one uploaded image.
+
+    Each stage runs at most once and its output is kept, so the same object
+    can be reused across Streamlit reruns and repeated extractions. Instances
+    are keyed by `content_hash`.
+
+    The OCR input never goes through a full-resolution colour decode: the
+    header is read first, JPEGs are decoded straight to grayscale at a reduced
+    DCT scale, other formats straight to grayscale, and a single exact resize
+    finishes the job. The colour PIL image is only decoded when it is needed
+    for display or saving.
+    """
+
+    def __init__(self, image_bytes: bytes):
+        self.image_bytes = image_bytes
+        self.content_hash = hashlib.sha256(image_bytes).hexdigest()
+
+    @cached_property
+    def header(self):
+        """Format, size and mode read from the header without decoding pixels"""
+        with Image.open(io.BytesIO(self.image_bytes)) as image:
+            return {
+                "format": image.format,
+                "width": image.width,
+                "height": image.height,
+                "mode": image.mode,
+            }
+
+    @cached_property
+    def image(self):
+        """Decoded PIL image (also used for display and local saves)"""
+        with span("decode") as decode_span, measure_stage("decode"):
+            image = Image.open(io.BytesIO(self.image_bytes))
+            image.load()
+            decode_span.set_attributes(
+                {"image.width": image.width, "image.height": image.height}
+            )
+        return image
+
+    def _decode_gray(self):
+        """Decode straight to grayscale, at a reduced scale for JPEG"""
+        width, height = self.header["width"], self.header["height"]
+        is_jpeg = self.header["format"] in JPEG_FORMATS
+        reduction = _jpeg_reduction(width, height) if is_jpeg else 1
+        # Check the header dimensions against the memory budget before decoding
+        reduction *= guard_dimensions(width // reduction, height // reduction, 1)
+        # libjpeg scales by at most 1/8 while decoding, other decoders not at
+        # all; the rest of the reduction is a resize after the decode
+        decode_reduction = min(reduction, 8) if is_jpeg else 1
+
+        flags = {
+            1: cv2.IMREAD_GRAYSCALE,
+            2: cv2.IMREAD_REDUCED_GRAYSCALE_2,
+            4: cv2.IMREAD_REDUCED_GRAYSCALE_4,
+            8: cv2.IMREAD_REDUCED_GRAYSCALE_8,
+        }[decode_reduction]
+        # Match the PIL path, which does not apply EXIF orientation
+        flags |= cv2.IMREAD_IGNORE_ORIENTATION
+
+        with span("decode") as decode_span, measure_stage("decode"):
+            guard_decode(width // decode_reduction, height // decode_reduction)
+            buffer = np.frombuffer(self.image_bytes, dtype=np.uint8)
+            gray = cv2.imdecode(buffer, flags)
+            if gray is None:
+                # Format OpenCV cannot read (e.g. AVIF without plugin): PIL
+                # decodes in colour, so check that buffer before the pixels
+                guard_decode(width, height, Image.getmodebands(self.header["mode"]))
+                with Image.open(io.BytesIO(self.image_bytes)) as image:
+                    gray = np.array(image.convert("L"))
+                decode_reduction = 1
+            if reduction > decode_reduction:
+                gray = cv2.resize(
+                    gray,
+                    (max(1, width // reduction), max(1, height // reduction)),
+                    interpolation=cv2.INTER_AREA,
+                )
+            decode_span.set_attributes(
+                {
+                    "image.width": width,
+                    "image.height": height,
+                    "image.format": self.header["format"],
+                    "decode.reduction": reduction,
+                }
+            )
+        return gray
+
+    @cached_property
+    def ocr_input(self):
+        """Grayscale image resized for OCR"""
+        gray = self._decode_gray()
+        with span("resize"):
+            return resize_image(gray)
+
+
+@traced("preprocess_image")
+@track_memory("preprocess_image")
+def preprocess_image(image):
+    """Preprocess PIL image for better OCR performance"""
+    if isinstance(image, PreprocessedImage):
+        gray = image.ocr_input
+    else:
+        # Check the header dimensions against the memory budget before decoding
+        image = guard_image(image)
+
+        # Convert PIL image to NumPy array (OpenCV format)
+        with span("decode") as decode_span, measure_stage("decode"):
+            img_array = np.array(image)
+            decode_span.set_attributes(
+                {
+                    "image.width": img_array.shape[1],
+                    "image.height": img_array.shape[0],
+                }
+            )
+
+        gray = to_grayscale(img_array)
+
+        # Resize for OCR
+        with span("resize"):
+            gray = resize_image(gray)  # gray is single channel now
+
+    current_span().set_attributes(
+        {"ocr.width": gray.shape[1], "ocr.height": gray.shape[0]}
+    )
     return gray
 
 
+@traced("extract_text_from_image")
+@track_memory("extract_text_from_image")
 def extract_text_from_image(image, reader):
     """Extract text using EasyOCR"""
     processed_img = preprocess_image(image)
-    results = reader.readtext(
-        processed_img,
-        detail=1,
-        paragraph=True,
-        width_ths=0.7,
-        height_ths=0.7,
-        batch_size=1,
-    )
+    with span("ocr.readtext") as ocr_span:
+        results = reader.readtext(processed_img, **READTEXT_PARAMS)
+        ocr_span.set_attribute("ocr.box_count", len(results))
     extracted_text = "\n".join(
     [r[1] if len(r) > 1 else str(r) for r in results]
 )
-    return extracted_text.strip() if extracted_text else ""
+    extracted_text = extracted_text.strip() if extracted_text else ""
+    record(
+        "preprocessing",
+        {
+            "max_dim": OCR_MAX_DIM,
+            "ocr_shape": list(processed_img.shape),
+            "readtext": READTEXT_PARAMS,
+        },
+    )
+    record("ocr_text", extracted_text)
+    return extracted_text
 
 
+@traced("clean_and_extract_info")
+@track_memory("clean_and_extract_info")
 def clean_and_extract_info(text, api_key):
     """Use Gemini to clean text and extract structured information with guaranteed JSON output"""
     try:
@@ -120,7 +296,6 @@ def clean_and_extract_info(text, api_key):
                 indent=2,
             )
 
-        client = genai.Client(api_key=api_key)
         prompt = f"""
 Analyze the following text extracted from a business card and extract the following information in JSON format:
 
@@ -147,31 +322,56 @@ Normalization rules:
 - Do not include any extra text, explanations, or markdown.
 """
 
-        config = GenerateContentConfig(
-            temperature=0.2,
-            max_output_tokens=500,
-            top_p=0.95,
-            top_k=40,
-            stop_sequences=["\n\n"],
-        )
-
-        response = client.models.generate_content(
-            model="gemini-2.0-flash-exp", contents=prompt, config=config
-        )
-
-        # Safe response text extraction
+        record("llm_prompt", prompt)
+        response = None
         response_text = None
 
-        # Try multiple methods to extract response text
-        if hasattr(response, "text") and response.text:
-            response_text = response.text
-        elif hasattr(response, "candidates") and response.candidates:
-            if len(response.candidates) > 0:
-                candidate = response.candidates[0]
-                if hasattr(candidate, "content") and candidate.content:
-                    if hasattr(candidate.content, "parts") and candidate.content.parts:
-                        if len(candidate.content.parts) > 0:
-                            response_text = candidate.content.parts[0].text
+        if is_replaying():
+            response_text = replayed_llm_response()
+        else:
+            client = genai.Client(api_key=api_key)
+            config = GenerateContentConfig(
+                temperature=0.2,
+                max_output_tokens=500,
+                top_p=0.95,
+                top_k=40,
+                stop_sequences=["\n\n"],
+            )
+
+            with span("llm.generate_content") as llm_span:
+                llm_span.set_attribute("llm.model", "gemini-2.0-flash-exp")
+                try:
+                    response = client.models.generate_content(
+                        model="gemini-2.0-flash-exp", contents=prompt, config=config
+                    )
+                except Exception as e:
+                    record("llm_error", f"{type(e).__name__}: {e}")
+                    raise
+                usage = getattr(response, "usage_metadata", None)
+                if usage is not None:
+                    llm_span.set_attributes(
+                        {
+                            "llm.prompt_tokens": usage.prompt_token_count,
+                            "llm.completion_tokens": usage.candidates_token_count,
+                            "llm.total_tokens": usage.total_token_count,
+                        }
+                    )
+
+            # Try multiple methods to extract response text
+            if hasattr(response, "text") and response.text:
+                response_text = response.text
+            elif hasattr(response, "candidates") and response.candidates:
+                if len(response.candidates) > 0:
+                    candidate = response.candidates[0]
+                    if hasattr(candidate, "content") and candidate.content:
+                        if (
+                            hasattr(candidate.content, "parts")
+                            and candidate.content.parts
+                        ):
+                            if len(candidate.content.parts) > 0:
+                                response_text = candidate.content.parts[0].text
+
+        record("llm_response", response_text)
 
         # Handle None response
         if response_text is None:
@@ -266,6 +466,10 @@ Normalization rules:
         )
 
 
+@traced("process_ocr_to_json")
+@profile_slow_requests
+@record_slow_requests
+@track_memory("process_ocr_to_json")
 def process_ocr_to_json(image, reader, api_key):
     """One-click function to extract text from image and convert to JSON"""
     try:
@@ -337,24 +541,79 @@ def process_ocr_to_json(image, reader, api_key):
         )
 
 
+def _write_results(cards: list) -> None:
+    """Replace RESULTS_FILE with `cards`; hold _results_lock."""
+    # Written through a temporary file: readers such as the export stream the
+    # file while it is being replaced, and must never see it truncated or
+    # half written
+    with tempfile.NamedTemporaryFile(
+        "w",
+        dir=Path(RESULTS_FILE).parent,
+        prefix=f".{Path(RESULTS_FILE).name}.",
+        suffix=".tmp",
+        delete=False,
+    ) as f:
+        json.dump(cards, f, indent=2)
+    os.replace(f.name, RESULTS_FILE)
+
+
+@traced("save_to_json")
 def save_to_json(data):
     """Save or append data to JSON file"""
     try:
-        # Try to load existing data
-        if os.path.exists(RESULTS_FILE):
-            with open(RESULTS_FILE, "r") as f:
-                existing_data = json.load(f)
-        else:
-            existing_data = []
+        # Background extractions finish concurrently; serialize read-modify-write
+        with _results_lock:
+            # Try to load existing data
+            if os.path.exists(RESULTS_FILE):
+                with open(RESULTS_FILE, "r") as f:
+                    existing_data = json.load(f)
+            else:
+                existing_data = []
+
+            # Append new data
+            existing_data.append(data)
+
+            # Save back
+            _write_results(existing_data)
+    except Exception as e:
+        logThis.error("Error saving to JSON file: %s", e)
+        st.error(f"Error saving to JSON file: {str(e)}")
+        return False
+
+    if CARD_STORE_ENABLED:
+        # The card is saved in the JSON results; `python -m utils.card_store
+        # import` adds it to the store later
+        try:
+            # Imported here so pyarrow is only loaded when the store is enabled
+            from utils.card_store import get_card_store
 
-        # Append new data
-        existing_data.append(data)
+            get_card_store().add(data)
+        except Exception as e:
+            logThis.error("Could not add the card to the card store: %s", e)
+    return True
 
-        # Save back to file
-        with open(RESULTS_FILE, "w") as f:
-            json.dump(existing_data, f, indent=2)
 
-        return True
+def link_image(image_sha256: str, image_key: str) -> int:
+    """
+    Set `image_key` on the saved records of the card image with this hash
+    that have none yet, once the image is stored. Returns how many changed.
+    """
+    try:
+        with _results_lock:
+            if not os.path.exists(RESULTS_FILE):
+                return 0
+            with open(RESULTS_FILE, "r") as f:
+                existing_data = json.load(f)
+            linked = 0
+            for card in existing_data:
+                if card.get("image_sha256") == image_sha256 and not card.get(
+                    "image_key"
+                ):
+                    card["image_key"] = image_key
+                    linked += 1
+            if linked:
+                _write_results(existing_data)
+        return linked
     except Exception as e:
-        st.error(f"Error saving to JSON file: {str(e)}")
-        return False
+        logThis.error("Could not link saved records to %s: %s", image_key, e)
+        return 0
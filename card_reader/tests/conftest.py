@@ -0,0 +1,5 @@
+import sys
+from pathlib import Path
+
+# Modules import each other as top-level `utils.*`, as when run from card_reader/
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
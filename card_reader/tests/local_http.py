@@ -0,0 +1,193 @@
+"""Local Release Server Stand-in
+
+Serves files from a local directory the way GitHub serves release assets, so
+model downloads can be exercised offline in the tests:
+
+    GET /release                  release JSON with one asset per file
+    GET /assets/<name>            302 to the storage URL of the asset, as the
+                                  asset API redirects to pre-signed storage
+    GET /storage/<link>/<name>    the asset bytes; a single `Range: bytes=a-b`
+                                  is answered with 206 and only those bytes.
+                                  `expire_links()` makes earlier links answer
+                                  403, like an expired pre-signed URL
+
+Faults can be switched on per server to exercise resume and verification:
+`fail_after_bytes` drops the connection once that many body bytes were sent,
+`ignore_range` answers every request with the whole file, `corrupt` flips a
+byte of every response, and `publish_digest` controls whether assets carry a
+`sha256:` digest.
+
+    with LocalReleaseServer(directory) as server:
+        MODELS["best.pt"]["api_url"] = server.release_url
+"""
+
+import hashlib
+import json
+import re
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+from typing import Optional
+
+_RANGE = re.compile(r"bytes=(\d+)-(\d+)$")
+
+
+class LocalReleaseServer:
+    """Threaded HTTP server publishing the files of `directory` as a release."""
+
+    def __init__(
+        self,
+        directory: Path,
+        publish_digest: bool = True,
+        ignore_range: bool = False,
+        fail_after_bytes: Optional[int] = None,
+        corrupt: bool = False,
+    ):
+        self.directory = Path(directory)
+        self.publish_digest = publish_digest
+        self.ignore_range = ignore_range
+        self.fail_after_bytes = fail_after_bytes
+        self.corrupt = corrupt
+        self.bytes_sent = 0
+        self.requests = 0
+        # Requests to the asset API URLs and storage requests carrying a token
+        self.asset_requests = 0
+        self.authorized_storage_requests = 0
+        self.link = 0
+        self._lock = threading.Lock()
+        self._httpd = ThreadingHTTPServer(("127.0.0.1", 0), self._handler())
+        self._httpd.daemon_threads = True
+        self._thread: Optional[threading.Thread] = None
+
+    @property
+    def url(self) -> str:
+        host, port = self._httpd.server_address[:2]
+        return f"http://{host}:{port}"
+
+    @property
+    def release_url(self) -> str:
+        return f"{self.url}/release"
+
+    def release(self) -> dict:
+        assets = []
+        for path in sorted(self.directory.iterdir()):
+            if not path.is_file():
+                continue
+            asset = {
+                "name": path.name,
+                "size": path.stat().st_size,
+                "url": f"{self.url}/assets/{path.name}",
+            }
+            if self.publish_digest:
+                digest = hashlib.sha256(path.read_bytes()).hexdigest()
+                asset["digest"] = f"sha256:{digest}"
+            assets.append(asset)
+        return {"tag_name": "local", "assets": assets}
+
+    def expire_links(self) -> None:
+        """Invalidate every storage URL handed out so far."""
+        with self._lock:
+            self.link += 1
+
+    def _send_budget(self, length: int) -> int:
+        """Bytes of a `length`-byte body that may go out before the fault."""
+        with self._lock:
+            if self.fail_after_bytes is None:
+                allowed = length
+            else:
+                allowed = max(0, min(length, self.fail_after_bytes - self.bytes_sent))
+            self.bytes_sent += allowed
+        return allowed
+
+    def _handler(self):
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def log_message(self, format, *args):
+                pass
+
+            def do_GET(self):
+                with server._lock:
+                    server.requests += 1
+                if self.path == "/release":
+                    body = json.dumps(server.release()).encode("utf-8")
+                    self.send_response(200)
+                    self.send_header("Content-Type", "application/json")
+                    self.send_header("Content-Length", str(len(body)))
+                    self.end_headers()
+                    self.wfile.write(body)
+                    return
+
+                if self.path.startswith("/assets/"):
+                    with server._lock:
+                        server.asset_requests += 1
+                        link = server.link
+                    name = self.path.removeprefix("/assets/")
+                    self.send_response(302)
+                    self.send_header("Location", f"/storage/{link}/{name}")
+                    self.send_header("Content-Length", "0")
+                    self.end_headers()
+                    return
+
+                parts = self.path.split("/")
+                if len(parts) != 4 or parts[1] != "storage":
+                    self.send_error(404)
+                    return
+                with server._lock:
+                    if "Authorization" in self.headers:
+                        server.authorized_storage_requests += 1
+                    expired = parts[2] != str(server.link)
+                if expired:
+                    self.send_error(403)
+                    return
+                path = server.directory / parts[3]
+                if not path.is_file():
+                    self.send_error(404)
+                    return
+                data = path.read_bytes()
+
+                match = _RANGE.match(self.headers.get("Range", ""))
+                if match and not server.ignore_range:
+                    start, end = int(match[1]), int(match[2])
+                    if start >= len(data) or end < start:
+                        self.send_error(416)
+                        return
+                    end = min(end, len(data) - 1)
+                    body = data[start : end + 1]
+                    self.send_response(206)
+                    self.send_header(
+                        "Content-Range", f"bytes {start}-{end}/{len(data)}"
+                    )
+                else:
+                    body = data
+                    self.send_response(200)
+                if server.corrupt and body:
+                    body = bytes([body[0] ^ 0xFF]) + body[1:]
+
+                self.send_header("Content-Type", "application/octet-stream")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                allowed = server._send_budget(len(body))
+                self.wfile.write(body[:allowed])
+                if allowed < len(body):
+                    # Cut the response short, as a dropped connection would
+                    self.close_connection = True
+
+        return Handler
+
+    def start(self) -> "LocalReleaseServer":
+        self._thread = threading.Thread(
+            target=self._httpd.serve_forever, name="local-release", daemon=True
+        )
+        self._thread.start()
+        return self
+
+    def stop(self) -> None:
+        self._httpd.shutdown()
+        self._httpd.server_close()
+
+    def __enter__(self) -> "LocalReleaseServer":
+        return self.start()
+
+    def __exit__(self, *exc_info) -> None:
+        self.stop()
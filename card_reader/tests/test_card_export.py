@@ -0,0 +1,51 @@
+import csv
+import io
+
+import pytest
+
+from utils.card_export import CSV_COLUMNS, iter_csv
+
+
+def export_rows(cards):
+    return list(csv.DictReader(io.StringIO("".join(iter_csv(cards)))))
+
+
+def test_phone_numbers_are_exported_unquoted():
+    cards = [
+        {"name": "Ada", "phone": "+1 (555) 010-2030"},
+        {"name": "Bob", "phone": "-42"},
+    ]
+
+    rows = export_rows(cards)
+
+    assert [row["phone"] for row in rows] == ["+1 (555) 010-2030", "-42"]
+
+
+def test_formula_in_any_value_is_quoted():
+    cards = [
+        {
+            "name": "=HYPERLINK(\"http://example.com\")",
+            "phone": ["555 0100", "+1 555 0101"],
+            "email": ["ada@example.com", "=cmd|' /C calc'!A0"],
+            "company": "@SUM(A1:A2)",
+        }
+    ]
+
+    (row,) = export_rows(cards)
+
+    assert list(row) == CSV_COLUMNS
+    assert row["name"] == "'=HYPERLINK(\"http://example.com\")"
+    assert row["phone"] == "555 0100; +1 555 0101"
+    assert row["email"] == "ada@example.com; '=cmd|' /C calc'!A0"
+    assert row["company"] == "'@SUM(A1:A2)"
+
+
+def test_cell_starting_with_several_phones_is_quoted():
+    (row,) = export_rows([{"phone": ["+1 555 0100", "+1 555 0101"]}])
+
+    # The joined cell is no longer a number, so it must not be evaluated
+    assert row["phone"] == "'+1 555 0100; +1 555 0101"
+
+
+if __name__ == "__main__":
+    raise SystemExit(pytest.main([__file__, "-q"]))
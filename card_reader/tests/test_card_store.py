@@ -0,0 +1,87 @@
+import json
+import multiprocessing
+import threading
+
+import pytest
+
+from utils.card_store import CardStore, import_results
+
+WRITERS = 4
+BATCHES = 25
+BATCH_ROWS = 4
+
+
+def make_store(root) -> CardStore:
+    # A low compaction threshold makes appends and compactions interleave
+    return CardStore(root=str(root), storage_options={}, compact_files=3)
+
+
+def cards(writer: int, batch: int):
+    return [
+        {
+            "name": f"Card {writer}-{batch}-{i}",
+            "company": "Acme",
+            "image_sha256": f"{writer:02d}{batch:03d}{i:02d}",
+            "timestamp": f"2026-01-0{1 + i % 2}T10:{batch % 60:02d}:{writer:02d}",
+        }
+        for i in range(BATCH_ROWS)
+    ]
+
+
+def append_batches(root, writer: int) -> None:
+    store = make_store(root)
+    for batch in range(BATCHES):
+        store.append(cards(writer, batch))
+
+
+def test_concurrent_appends_keep_every_card_once(tmp_path):
+    store = make_store(tmp_path)
+    errors = []
+
+    def writer(index):
+        try:
+            for batch in range(BATCHES):
+                store.append(cards(index, batch))
+        except Exception as e:
+            errors.append(e)
+
+    threads = [threading.Thread(target=writer, args=(i,)) for i in range(WRITERS)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert errors == []
+    assert store.dataset().count_rows() == WRITERS * BATCHES * BATCH_ROWS
+
+
+def test_appends_from_several_processes_keep_every_card_once(tmp_path):
+    context = multiprocessing.get_context("fork")
+    processes = [
+        context.Process(target=append_batches, args=(tmp_path, i))
+        for i in range(WRITERS)
+    ]
+    for process in processes:
+        process.start()
+    for process in processes:
+        process.join(60)
+
+    assert [process.exitcode for process in processes] == [0] * WRITERS
+    store = make_store(tmp_path)
+    assert store.dataset().count_rows() == WRITERS * BATCHES * BATCH_ROWS
+
+
+def test_import_skips_cards_already_stored(tmp_path):
+    results = tmp_path / "results.json"
+    saved = cards(0, 0) + cards(0, 1)
+    results.write_text(json.dumps(saved))
+    store = make_store(tmp_path / "db")
+    store.append(saved[:3])
+
+    assert import_results(results, store) == len(saved) - 3
+    assert import_results(results, store) == 0
+    assert store.dataset().count_rows() == len(saved)
+
+
+if __name__ == "__main__":
+    raise SystemExit(pytest.main([__file__, "-q"]))
@@ -0,0 +1,147 @@
+import hashlib
+import json
+import os
+
+import pytest
+import requests
+
+from local_http import LocalReleaseServer
+from utils import model_manager
+from utils.model_manager import ModelManager
+
+NAME = "best.pt"
+BLOCK = 64 * 1024
+
+
+@pytest.fixture
+def asset(tmp_path):
+    directory = tmp_path / "release"
+    directory.mkdir()
+    data = os.urandom(3 * BLOCK + 1000)
+    (directory / NAME).write_bytes(data)
+    return directory, data
+
+
+@pytest.fixture
+def manager(tmp_path, monkeypatch):
+    monkeypatch.setattr(model_manager, "MODEL_MANIFEST", tmp_path / "manifest.json")
+    manager = ModelManager(connections=1, block_size=BLOCK)
+    manager.cache_dir = tmp_path / "cache"
+    manager.cache_dir.mkdir()
+    return manager
+
+
+def use_server(monkeypatch, server, sha256=None):
+    monkeypatch.setattr(
+        model_manager,
+        "MODELS",
+        {NAME: {"source": "github", "api_url": server.release_url, "sha256": sha256}},
+    )
+
+
+def test_interrupted_download_resumes_from_finished_ranges(asset, manager, monkeypatch):
+    directory, data = asset
+    with LocalReleaseServer(directory, fail_after_bytes=BLOCK + 100) as server:
+        use_server(monkeypatch, server)
+        with pytest.raises(requests.RequestException):
+            manager.download_model(NAME)
+        model_path = manager.cache_dir / NAME
+        assert not model_path.exists()
+        state = json.loads((manager.cache_dir / f"{NAME}.part.json").read_text())
+        assert state["done"] == [0]
+
+        server.fail_after_bytes = None
+        server.bytes_sent = 0
+        assert manager.download_model(NAME).read_bytes() == data
+        # Only the ranges missing after the interruption were fetched again
+        assert server.bytes_sent == len(data) - BLOCK
+        assert not (manager.cache_dir / f"{NAME}.part.json").exists()
+
+
+def test_ranges_go_to_storage_after_one_api_request(asset, manager, monkeypatch):
+    directory, data = asset
+    manager.headers = {"Authorization": "token secret"}
+    with LocalReleaseServer(directory) as server:
+        use_server(monkeypatch, server)
+        assert manager.download_model(NAME).read_bytes() == data
+        assert server.asset_requests == 1
+        # The API token is not sent to the pre-signed storage URL
+        assert server.authorized_storage_requests == 0
+
+
+def test_expired_storage_url_is_resolved_again(asset, manager, monkeypatch):
+    directory, data = asset
+    with LocalReleaseServer(directory) as server:
+        use_server(monkeypatch, server)
+        fetch_block = manager._fetch_block
+
+        def expire_after_first(url, headers, part_path, index, size):
+            if index == 1 and server.link == 0:
+                server.expire_links()
+            fetch_block(url, headers, part_path, index, size)
+
+        monkeypatch.setattr(manager, "_fetch_block", expire_after_first)
+        assert manager.download_model(NAME).read_bytes() == data
+        assert server.asset_requests == 2
+
+
+def test_corrupted_download_is_rejected(asset, manager, monkeypatch):
+    directory, _ = asset
+    with LocalReleaseServer(directory, corrupt=True) as server:
+        use_server(monkeypatch, server)
+        with pytest.raises(RuntimeError, match="Checksum mismatch"):
+            manager.download_model(NAME)
+    assert not (manager.cache_dir / NAME).exists()
+    assert not (manager.cache_dir / f"{NAME}.part").exists()
+
+
+def test_corrupted_cache_is_downloaded_again(asset, manager, monkeypatch):
+    directory, data = asset
+    model_path = manager.cache_dir / NAME
+    model_path.write_bytes(bytes(len(data)))
+    with LocalReleaseServer(directory) as server:
+        use_server(monkeypatch, server)
+        assert manager.download_model(NAME).read_bytes() == data
+
+
+@pytest.mark.parametrize("ignore_range", [False, True])
+def test_unknown_checksum_verifies_size(asset, manager, monkeypatch, ignore_range):
+    directory, data = asset
+    model_path = manager.cache_dir / NAME
+    # A truncated file left at the final path by an older download
+    model_path.write_bytes(data[:BLOCK])
+    with LocalReleaseServer(
+        directory, publish_digest=False, ignore_range=ignore_range
+    ) as server:
+        use_server(monkeypatch, server)
+        assert manager.download_model(NAME).read_bytes() == data
+
+        entry = json.loads(model_manager.MODEL_MANIFEST.read_text())[NAME]
+        assert entry["size"] == len(data)
+        assert entry["sha256"] == hashlib.sha256(data).hexdigest()
+
+        # Verified once, trusted afterwards without asking the server
+        requests_before = server.requests
+        manager.download_model(NAME)
+        assert server.requests == requests_before
+
+
+def test_unverified_cache_of_the_right_size_is_kept(asset, manager, monkeypatch):
+    directory, data = asset
+    model_path = manager.cache_dir / NAME
+    model_path.write_bytes(data)
+    with LocalReleaseServer(directory, publish_digest=False) as server:
+        use_server(monkeypatch, server)
+        manager.download_model(NAME)
+        # Only the release listing was requested, not the asset
+        assert server.bytes_sent == 0
+
+
+def test_empty_asset_is_rejected(tmp_path, manager, monkeypatch):
+    directory = tmp_path / "empty"
+    directory.mkdir()
+    (directory / NAME).write_bytes(b"")
+    with LocalReleaseServer(directory) as server:
+        use_server(monkeypatch, server)
+        with pytest.raises(RuntimeError, match="empty"):
+            manager.download_model(NAME)
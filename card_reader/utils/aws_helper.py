@@ -1,58 +1,149 @@
 import io
+import time
+from typing import Dict, Iterable, Optional
 
 import boto3
 import boto3.session
+from boto3.s3.transfer import TransferConfig
 
-from utils.constants import AWS_BUCKET_NAME, AWS_CONFIG
+from utils.constants import (
+    AWS_BUCKET_NAME,
+    AWS_CONFIG,
+    PRESIGNED_URL_CACHE_ITEMS,
+    PRESIGNED_URL_REFRESH_FRACTION,
+    S3_BACKEND,
+    S3_LOCAL_ROOT,
+    S3_MAX_CONCURRENCY,
+    S3_MULTIPART_CHUNK_MB,
+    S3_MULTIPART_THRESHOLD_MB,
+)
+from utils.cache import LRUCache
+from utils.local_s3 import LocalS3Client
 from utils.logger import logThis
+from utils.tracing import current_span, traced
 from utils.messages import (
     S3_INVALID_PARAMETERS,
     S3_PRESIGNED_URL_FAILURE,
     S3_UPLOAD_FAILURE,
 )
 
-s3 = boto3.client(
-    "s3",
-    region_name=AWS_CONFIG["region"],
-    aws_access_key_id=AWS_CONFIG["access_key_id"],
-    aws_secret_access_key=AWS_CONFIG["secret_access_key"],
-    config=boto3.session.Config(signature_version="s3v4"),
+if S3_BACKEND == "local":
+    s3 = LocalS3Client(S3_LOCAL_ROOT)
+    logThis.info("Using local S3 stand-in at %s", S3_LOCAL_ROOT)
+else:
+    s3 = boto3.client(
+        "s3",
+        region_name=AWS_CONFIG["region"],
+        aws_access_key_id=AWS_CONFIG["access_key_id"],
+        aws_secret_access_key=AWS_CONFIG["secret_access_key"],
+        config=boto3.session.Config(
+            signature_version="s3v4",
+            # Enough connections for every part of every concurrent upload
+            max_pool_connections=max(10, S3_MAX_CONCURRENCY * 4),
+        ),
+    )
+
+MB = 1024 * 1024
+TRANSFER_CONFIG = TransferConfig(
+    multipart_threshold=S3_MULTIPART_THRESHOLD_MB * MB,
+    multipart_chunksize=S3_MULTIPART_CHUNK_MB * MB,
+    max_concurrency=S3_MAX_CONCURRENCY,
+    use_threads=S3_MAX_CONCURRENCY > 1,
 )
 
 
 # route_aws.py(helper fuctions)
 
 
+@traced("upload_file_to_s3")
 def upload_file_to_s3(file_obj, s3_key):
+    current_span().set_attribute("s3.key", s3_key)
     try:
         # If it's already a file-like object (Flask case)
         if hasattr(file_obj, "read"):
             file_obj.seek(0)
-            s3.upload_fileobj(file_obj, AWS_BUCKET_NAME, s3_key)
+            s3.upload_fileobj(
+                file_obj, AWS_BUCKET_NAME, s3_key, Config=TRANSFER_CONFIG
+            )
         # If it's bytes (FastAPI case)
         elif isinstance(file_obj, bytes):
             file_like = io.BytesIO(file_obj)
-            s3.upload_fileobj(file_like, AWS_BUCKET_NAME, s3_key)
+            s3.upload_fileobj(
+                file_like, AWS_BUCKET_NAME, s3_key, Config=TRANSFER_CONFIG
+            )
 
         return True
     except Exception as e:
-        logThis.error(f"{S3_UPLOAD_FAILURE}:{str(e)}")
+        logThis.error("%s:%s", S3_UPLOAD_FAILURE, e)
         return False
 
 
+# (object_key, expiration) -> (url, signed_at)
+presigned_url_cache = LRUCache(PRESIGNED_URL_CACHE_ITEMS)
+
+
+def _cached_presigned_url(object_key, expiration) -> Optional[str]:
+    """Cached URL for the key, unless it is past its refresh point."""
+    entry = presigned_url_cache.get((object_key, expiration))
+    if entry is None:
+        return None
+    url, signed_at = entry
+    if time.time() - signed_at >= expiration * PRESIGNED_URL_REFRESH_FRACTION:
+        return None
+    return url
+
+
 def generate_presigned_url(object_key, expiration=3600):
     """
     Generates a pre-signed URL for accessing an S3 object.
+
+    URLs are cached per key and expiration and re-signed once
+    PRESIGNED_URL_REFRESH_FRACTION of their lifetime has passed, so a cached
+    URL always has the rest of its lifetime left when it is handed out.
     """
 
     try:
         if not object_key:
             raise ValueError(S3_INVALID_PARAMETERS)
-        return s3.generate_presigned_url(
+        url = _cached_presigned_url(object_key, expiration)
+        if url is not None:
+            return url
+
+        signed_at = time.time()
+        url = s3.generate_presigned_url(
             "get_object",
             Params={"Bucket": AWS_CONFIG["bucket_name"], "Key": object_key},
             ExpiresIn=expiration,
         )
+        presigned_url_cache.put((object_key, expiration), (url, signed_at))
+        return url
     except Exception as e:
-        logThis.error(f"{S3_PRESIGNED_URL_FAILURE}: {e}")
+        logThis.error("%s: %s", S3_PRESIGNED_URL_FAILURE, e)
         return None
+
+
+def generate_presigned_urls(
+    object_keys: Iterable[str], expiration=3600
+) -> Dict[str, Optional[str]]:
+    """
+    Pre-signed URLs for a listing of keys, signing only the uncached ones.
+
+    Returns {object_key: url}; keys that could not be signed map to None.
+    """
+    urls = {}
+    missing = []
+    for object_key in object_keys:
+        if object_key in urls:
+            continue
+        urls[object_key] = _cached_presigned_url(object_key, expiration)
+        if urls[object_key] is None:
+            missing.append(object_key)
+
+    for object_key in missing:
+        urls[object_key] = generate_presigned_url(object_key, expiration)
+
+    if missing:
+        logThis.debug(
+            "Signed %d of %d presigned URLs, rest from cache", len(missing), len(urls)
+        )
+    return urls
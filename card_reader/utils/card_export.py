@@ -0,0 +1,315 @@
+"""Streaming Export of Stored Cards
+
+Exports the cards saved in RESULTS_FILE as vCard 4.0 or CSV without loading
+the file: `iter_cards` decodes the JSON array one object at a time with
+`JSONDecoder.raw_decode` over a fixed-size read buffer, and every stage after
+it is a generator. Memory stays constant however many cards are stored.
+
+`export_chunks` yields encoded chunks of about EXPORT_CHUNK_BYTES, ready to
+be streamed as an HTTP response body or written to a file:
+
+    cd card_reader
+    python -m utils.card_export vcf --company acme --output contacts.vcf
+"""
+
+import argparse
+import csv
+import io
+import json
+import re
+import sys
+from dataclasses import dataclass
+from datetime import date, datetime
+from pathlib import Path
+from typing import Callable, Dict, Iterable, Iterator, List, Optional, Tuple
+
+from utils.constants import RESULTS_FILE
+
+EXPORT_CHUNK_BYTES = 64 * 1024
+_READ_SIZE = 64 * 1024
+
+CSV_COLUMNS = [
+    "name",
+    "email",
+    "phone",
+    "company",
+    "address",
+    "job_title",
+    "website",
+    "timestamp",
+]
+# Separator of multi-valued fields (several emails or phones) in CSV cells
+CSV_MULTI_VALUE_SEPARATOR = "; "
+# Spreadsheets evaluate cells starting with these as formulas
+_FORMULA_PREFIXES = ("=", "+", "-", "@", "\t", "\r")
+# Numbers and phone numbers such as "+1 (555) 010-2030" are left as they are
+_NUMERIC_VALUE = re.compile(r"[+-]?[\d\s().-]+")
+
+
+def iter_cards(
+    path: Path = RESULTS_FILE, read_size: int = _READ_SIZE
+) -> Iterator[dict]:
+    """Yield the cards of a JSON array file one by one, in constant memory."""
+    decoder = json.JSONDecoder()
+    try:
+        f = open(path, "r", encoding="utf-8")
+    except FileNotFoundError:
+        return
+
+    with f:
+        buffer = ""
+        position = 0
+        eof = False
+        started = False
+
+        def fill() -> bool:
+            nonlocal buffer, position, eof
+            chunk = f.read(read_size)
+            if not chunk:
+                eof = True
+                return False
+            buffer = buffer[position:] + chunk
+            position = 0
+            return True
+
+        while True:
+            # Skip whitespace and the array punctuation between objects
+            while position < len(buffer) and buffer[position] in " \t\r\n,":
+                position += 1
+            if position == len(buffer):
+                if not fill():
+                    return
+                continue
+
+            if not started:
+                if buffer[position] != "[":
+                    raise ValueError(f"{path} does not hold a JSON array")
+                started = True
+                position += 1
+                continue
+            if buffer[position] == "]":
+                return
+
+            try:
+                card, end = decoder.raw_decode(buffer, position)
+            except json.JSONDecodeError:
+                # The object continues past the buffer: read more and retry
+                if eof or not fill():
+                    raise
+                continue
+            position = end
+            if isinstance(card, dict):
+                yield card
+
+
+def _values(card: dict, field: str) -> List[str]:
+    """Non-empty string values of a field that may hold a string or a list."""
+    value = card.get(field)
+    values = value if isinstance(value, list) else [value]
+    return [str(item).strip() for item in values if item not in (None, "")]
+
+
+def _card_date(card: dict) -> Optional[date]:
+    try:
+        return datetime.fromisoformat(str(card.get("timestamp"))).date()
+    except ValueError:
+        return None
+
+
+@dataclass
+class CardFilter:
+    """Which stored cards to export; unset criteria match every card."""
+
+    since: Optional[date] = None
+    until: Optional[date] = None
+    company: Optional[str] = None
+    include_errors: bool = False
+
+    def __call__(self, card: dict) -> bool:
+        if card.get("error") and not self.include_errors:
+            return False
+        if self.since or self.until:
+            card_date = _card_date(card)
+            if card_date is None:
+                return False
+            if self.since and card_date < self.since:
+                return False
+            if self.until and card_date > self.until:
+                return False
+        if self.company:
+            needle = self.company.casefold()
+            if not any(
+                needle in value.casefold() for value in _values(card, "company")
+            ):
+                return False
+        return True
+
+
+# --- vCard 4.0 (RFC 6350) ---
+
+
+def _escape(value: str) -> str:
+    return (
+        value.replace("\\", "\\\\")
+        .replace(",", "\\,")
+        .replace(";", "\\;")
+        .replace("\r\n", "\\n")
+        .replace("\n", "\\n")
+    )
+
+
+def _fold(line: str) -> str:
+    """Fold a content line at 75 octets without splitting UTF-8 characters."""
+    if line.isascii():
+        if len(line) <= 75:
+            return line + "\r\n"
+        # Continuation lines start with a space, which counts as an octet
+        parts = [line[:75]] + [line[i : i + 74] for i in range(75, len(line), 74)]
+        return "\r\n ".join(parts) + "\r\n"
+    if len(line.encode("utf-8")) <= 75:
+        return line + "\r\n"
+    parts = []
+    current, size, limit = [], 0, 75
+    for char in line:
+        width = len(char.encode("utf-8"))
+        if size + width > limit:
+            parts.append("".join(current))
+            # Continuation lines start with a space, which counts as an octet
+            current, size, limit = [], 0, 74
+        current.append(char)
+        size += width
+    parts.append("".join(current))
+    return "\r\n ".join(parts) + "\r\n"
+
+
+def card_to_vcard(card: dict) -> str:
+    """One vCard 4.0 entry for an extracted card."""
+    names = _values(card, "name")
+    companies = _values(card, "company")
+    emails = _values(card, "email")
+    # FN is the one mandatory property
+    full_name = (names or companies or emails or ["Unknown"])[0]
+
+    lines = ["BEGIN:VCARD", "VERSION:4.0", f"FN:{_escape(full_name)}"]
+    lines += [f"ORG:{_escape(company)}" for company in companies[:1]]
+    lines += [f"TITLE:{_escape(title)}" for title in _values(card, "job_title")]
+    lines += [f"EMAIL;TYPE=work:{_escape(email)}" for email in emails]
+    lines += [
+        f"TEL;VALUE=uri;TYPE=work:tel:{phone.replace(' ', '')}"
+        for phone in _values(card, "phone")
+    ]
+    # The whole address goes into the street component
+    lines += [
+        f"ADR;TYPE=work:;;{_escape(address)};;;;"
+        for address in _values(card, "address")
+    ]
+    lines += [f"URL:{_escape(url)}" for url in _values(card, "website")]
+    timestamp = card.get("timestamp")
+    if timestamp:
+        lines.append(f"NOTE:{_escape(f'Scanned {timestamp}')}")
+    lines.append("END:VCARD")
+    return "".join(_fold(line) for line in lines)
+
+
+def iter_vcards(cards: Iterable[dict]) -> Iterator[str]:
+    for card in cards:
+        yield card_to_vcard(card)
+
+
+# --- CSV ---
+
+
+def _csv_cell(value: str) -> str:
+    """Quote a value that a spreadsheet would run as a formula (CSV injection)."""
+    if value.startswith(_FORMULA_PREFIXES) and not _NUMERIC_VALUE.fullmatch(value):
+        return f"'{value}"
+    return value
+
+
+def _csv_field(values: List[str]) -> str:
+    """One cell of several values, each of them checked before joining."""
+    return _csv_cell(CSV_MULTI_VALUE_SEPARATOR.join(_csv_cell(v) for v in values))
+
+
+def iter_csv(cards: Iterable[dict]) -> Iterator[str]:
+    """
+    CSV text, the header first and then one row per card.
+
+    Card fields come from OCR of untrusted images, so values that start like a
+    formula (=, +, -, @) are prefixed with a quote and open as plain text.
+    Numbers and phone numbers are kept as they are.
+    """
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+
+    def flush() -> str:
+        text = buffer.getvalue()
+        buffer.seek(0)
+        buffer.truncate()
+        return text
+
+    writer.writerow(CSV_COLUMNS)
+    yield flush()
+    for card in cards:
+        writer.writerow([_csv_field(_values(card, column)) for column in CSV_COLUMNS])
+        yield flush()
+
+
+# Export format -> (writer, MIME type, file extension)
+EXPORT_FORMATS: Dict[
+    str, Tuple[Callable[[Iterable[dict]], Iterator[str]], str, str]
+] = {
+    "vcf": (iter_vcards, "text/vcard", "vcf"),
+    "csv": (iter_csv, "text/csv", "csv"),
+}
+
+
+def export_chunks(
+    export_format: str,
+    card_filter: Optional[CardFilter] = None,
+    path: Path = RESULTS_FILE,
+    chunk_bytes: int = EXPORT_CHUNK_BYTES,
+) -> Iterator[bytes]:
+    """Stored cards in `export_format` as UTF-8 chunks of about `chunk_bytes`."""
+    if export_format not in EXPORT_FORMATS:
+        raise ValueError(f"Unknown export format: {export_format}")
+    writer = EXPORT_FORMATS[export_format][0]
+    cards = filter(card_filter or CardFilter(), iter_cards(path))
+
+    pending: List[bytes] = []
+    size = 0
+    for text in writer(cards):
+        data = text.encode("utf-8")
+        pending.append(data)
+        size += len(data)
+        if size >= chunk_bytes:
+            yield b"".join(pending)
+            pending, size = [], 0
+    if pending:
+        yield b"".join(pending)
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description="Export stored cards as vCard or CSV.")
+    parser.add_argument("format", choices=sorted(EXPORT_FORMATS))
+    parser.add_argument("--since", type=date.fromisoformat)
+    parser.add_argument("--until", type=date.fromisoformat)
+    parser.add_argument("--company")
+    parser.add_argument("--include-errors", action="store_true")
+    parser.add_argument("--input", type=Path, default=RESULTS_FILE)
+    parser.add_argument("--output", type=Path, help="defaults to stdout")
+    args = parser.parse_args(argv)
+
+    card_filter = CardFilter(args.since, args.until, args.company, args.include_errors)
+    output = open(args.output, "wb") if args.output else sys.stdout.buffer
+    try:
+        for chunk in export_chunks(args.format, card_filter, args.input):
+            output.write(chunk)
+    finally:
+        if args.output:
+            output.close()
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -0,0 +1,370 @@
+"""Columnar Card Store
+
+Extracted cards as a Parquet dataset at `<DATABASE_PATH>/<CARD_TABLE_NAME>`,
+next to the JSON results file, for analytical queries and warehouse loads.
+DATABASE_PATH may be local or `s3://`; S3 uses STORAGE_OPTIONS credentials.
+
+- Schema: one column per extraction field. Multi-valued fields (name, email,
+  phone, website) are lists of strings, `timestamp` is a real timestamp.
+- Layout: hive-partitioned by scan date (`scan_date=YYYY-MM-DD/`), so date
+  filters skip whole directories and other predicates use Parquet row-group
+  statistics.
+- Append: `add()` buffers cards and writes one file per partition every
+  CARD_STORE_BATCH_ROWS cards or CARD_STORE_FLUSH_S seconds; `append()`
+  writes a batch at once.
+- Compaction: a partition that reaches CARD_STORE_COMPACT_FILES files is
+  rewritten as one. The new file is written before the old ones are deleted,
+  so a concurrent reader may see a partition twice for a moment but never
+  miss it.
+- Concurrency: appends and compactions of one store are serialized by a
+  lock, and across processes on this host by a lock file: appends share it,
+  a compaction holds it alone, so it never reads a file still being written
+  and deletes exactly the files it read.
+
+With CARD_STORE_ENABLED, `save_to_json` also adds every saved card here.
+Load the existing JSON results (cards already stored, by image hash and
+timestamp, are skipped) or compact by hand:
+
+    cd card_reader
+    python -m utils.card_store import
+    python -m utils.card_store compact
+"""
+
+import argparse
+import atexit
+import hashlib
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+from datetime import date, datetime
+from functools import lru_cache
+from pathlib import Path
+from typing import Dict, Iterable, Iterator, List, Optional, Sequence, Tuple
+
+try:
+    import fcntl
+except ImportError:  # Windows: only threads of one process are coordinated
+    fcntl = None
+
+import pyarrow as pa
+import pyarrow.dataset as ds
+import pyarrow.fs as pafs
+import pyarrow.parquet as pq
+
+from utils.card_export import iter_cards
+from utils.constants import (
+    CACHE_DIR,
+    CARD_STORE_BATCH_ROWS,
+    CARD_STORE_COMPACT_FILES,
+    CARD_STORE_FLUSH_S,
+    CARD_TABLE_NAME,
+    DATABASE_PATH,
+    RESULTS_FILE,
+    STORAGE_OPTIONS,
+)
+from utils.logger import logThis
+
+LIST_FIELDS = ("name", "email", "phone", "website")
+TEXT_FIELDS = ("company", "address", "job_title", "error", "image_sha256", "image_key")
+
+CARD_SCHEMA = pa.schema(
+    [(field, pa.list_(pa.string())) for field in LIST_FIELDS]
+    + [(field, pa.string()) for field in TEXT_FIELDS]
+    + [("timestamp", pa.timestamp("us")), ("scan_date", pa.string())]
+)
+PARTITIONING = ds.partitioning(pa.schema([("scan_date", pa.string())]), flavor="hive")
+
+
+def _filesystem(root: str, storage_options: Dict[str, str]):
+    """pyarrow filesystem and path for a local or s3:// root."""
+    if root.startswith("s3://"):
+        return (
+            pafs.S3FileSystem(
+                access_key=storage_options.get("aws_access_key_id") or None,
+                secret_key=storage_options.get("aws_secret_access_key") or None,
+                region=storage_options.get("aws_region") or None,
+            ),
+            root[len("s3://") :],
+        )
+    return pafs.LocalFileSystem(), str(Path(root).resolve())
+
+
+def _timestamp(value) -> Optional[datetime]:
+    try:
+        return datetime.fromisoformat(str(value)).replace(tzinfo=None)
+    except ValueError:
+        return None
+
+
+def _row(card: dict) -> dict:
+    """Coerce an extracted card to the schema; extractions vary in shape."""
+    row = {}
+    for field in LIST_FIELDS:
+        value = card.get(field)
+        values = value if isinstance(value, list) else [value]
+        row[field] = [str(item) for item in values if item not in (None, "")]
+    for field in TEXT_FIELDS:
+        value = card.get(field)
+        if isinstance(value, list):
+            value = "; ".join(str(item) for item in value if item)
+        row[field] = str(value) if value not in (None, "") else None
+    row["timestamp"] = _timestamp(card.get("timestamp"))
+    row["scan_date"] = (row["timestamp"] or datetime.now()).date().isoformat()
+    return row
+
+
+def _card_key(row: dict) -> Tuple[Optional[str], Optional[datetime]]:
+    """Identity of a stored card: its image hash and scan time."""
+    return row["image_sha256"], row["timestamp"]
+
+
+class CardStore:
+    """Append-only Parquet dataset of extracted cards."""
+
+    def __init__(
+        self,
+        root: str = str(DATABASE_PATH),
+        table_name: str = CARD_TABLE_NAME,
+        storage_options: Optional[Dict[str, str]] = None,
+        batch_rows: int = CARD_STORE_BATCH_ROWS,
+        flush_s: float = CARD_STORE_FLUSH_S,
+        compact_files: int = CARD_STORE_COMPACT_FILES,
+    ):
+        self.filesystem, root_path = _filesystem(
+            root, STORAGE_OPTIONS if storage_options is None else storage_options
+        )
+        self.path = f"{root_path.rstrip('/')}/{table_name}"
+        self.filesystem.create_dir(self.path, recursive=True)
+        self.batch_rows = batch_rows
+        self.flush_s = flush_s
+        self.compact_files = compact_files
+        self._pending: List[dict] = []
+        self._lock = threading.Lock()
+        self._timer: Optional[threading.Timer] = None
+        # Serializes appends and compactions of this store in the process
+        self._write_lock = threading.Lock()
+        # Coordinates processes of this host writing the same dataset
+        digest = hashlib.sha1(self.path.encode("utf-8")).hexdigest()[:16]
+        self._lock_path = Path(CACHE_DIR) / "locks" / f"card_store-{digest}.lock"
+        self._lock_path.parent.mkdir(parents=True, exist_ok=True)
+
+    @contextmanager
+    def _file_lock(self, exclusive: bool) -> Iterator[None]:
+        """Hold the dataset lock file, shared by appends or exclusively."""
+        if fcntl is None:
+            yield
+            return
+        with open(self._lock_path, "a") as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX if exclusive else fcntl.LOCK_SH)
+            try:
+                yield
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    # --- Writing ---
+
+    def append(self, cards: Iterable[dict]) -> int:
+        """Write `cards` now, as one new file per scan-date partition."""
+        rows = [_row(card) for card in cards]
+        if not rows:
+            return 0
+        table = pa.Table.from_pylist(rows, schema=CARD_SCHEMA)
+        touched = set()
+        with self._write_lock:
+            with self._file_lock(exclusive=False):
+                ds.write_dataset(
+                    table,
+                    self.path,
+                    format="parquet",
+                    partitioning=PARTITIONING,
+                    filesystem=self.filesystem,
+                    basename_template=f"part-{uuid.uuid4().hex}-{{i}}.parquet",
+                    existing_data_behavior="overwrite_or_ignore",
+                    file_visitor=lambda written: touched.add(
+                        written.path.rsplit("/", 1)[0]
+                    ),
+                )
+            for partition in touched:
+                if len(self._files(partition)) >= self.compact_files:
+                    with self._file_lock(exclusive=True):
+                        self._compact_partition(partition, self.compact_files)
+        return len(rows)
+
+    def add(self, card: dict) -> None:
+        """Buffer one card; it is written with the next batch."""
+        with self._lock:
+            self._pending.append(card)
+            full = len(self._pending) >= self.batch_rows
+            if not full and self._timer is None:
+                self._timer = threading.Timer(self.flush_s, self.flush)
+                self._timer.daemon = True
+                self._timer.start()
+        if full:
+            self.flush()
+
+    def flush(self) -> int:
+        """Write all buffered cards."""
+        with self._lock:
+            pending, self._pending = self._pending, []
+            if self._timer is not None:
+                self._timer.cancel()
+                self._timer = None
+        try:
+            return self.append(pending)
+        except Exception as e:
+            # Cards are also in the JSON results; `import` adds the missing ones
+            logThis.error(
+                "Could not write %d cards to the card store: %s", len(pending), e
+            )
+            return 0
+
+    # --- Reading ---
+
+    def dataset(self) -> ds.Dataset:
+        return ds.dataset(
+            self.path,
+            schema=CARD_SCHEMA,
+            format="parquet",
+            partitioning=PARTITIONING,
+            filesystem=self.filesystem,
+        )
+
+    def query(
+        self,
+        since: Optional[date] = None,
+        until: Optional[date] = None,
+        company: Optional[str] = None,
+        columns: Optional[Sequence[str]] = None,
+        where: Optional[ds.Expression] = None,
+    ) -> pa.Table:
+        """
+        Cards matching every given criterion, as an Arrow table.
+
+        The date range prunes partitions and `company` (exact match) and
+        `where` are pushed down to the Parquet row groups.
+        """
+        conditions = []
+        if since:
+            conditions.append(ds.field("scan_date") >= since.isoformat())
+        if until:
+            conditions.append(ds.field("scan_date") <= until.isoformat())
+        if company:
+            conditions.append(ds.field("company") == company)
+        if where is not None:
+            conditions.append(where)
+
+        expression = None
+        for condition in conditions:
+            expression = condition if expression is None else expression & condition
+        return self.dataset().to_table(
+            columns=list(columns) if columns else None, filter=expression
+        )
+
+    # --- Compaction ---
+
+    def _files(self, partition: str) -> List[str]:
+        selector = pafs.FileSelector(partition, allow_not_found=True)
+        return [
+            info.path
+            for info in self.filesystem.get_file_info(selector)
+            if info.type == pafs.FileType.File and info.path.endswith(".parquet")
+        ]
+
+    def _compact_partition(self, partition: str, min_files: int = 2) -> None:
+        """Rewrite a partition as one file; hold the lock file exclusively."""
+        # Listed under the lock: another process may have compacted already
+        files = self._files(partition)
+        if len(files) < max(min_files, 2):
+            return
+        start_time = time.perf_counter()
+        table = pq.read_table(files, filesystem=self.filesystem, schema=CARD_SCHEMA)
+        target = f"{partition}/compacted-{uuid.uuid4().hex}.parquet"
+        pq.write_table(
+            table.drop_columns(["scan_date"]), target, filesystem=self.filesystem
+        )
+        for path in files:
+            self.filesystem.delete_file(path)
+        logThis.info(
+            "Compacted %d files of %s (%d cards) in %.2fs",
+            len(files),
+            partition.rsplit("/", 1)[-1],
+            table.num_rows,
+            time.perf_counter() - start_time,
+        )
+
+    def compact(self) -> None:
+        """Rewrite every partition that holds more than one file."""
+        selector = pafs.FileSelector(self.path, allow_not_found=True)
+        with self._write_lock, self._file_lock(exclusive=True):
+            for info in self.filesystem.get_file_info(selector):
+                if info.type == pafs.FileType.Directory:
+                    self._compact_partition(info.path)
+
+    def card_keys(self) -> set:
+        """(image_sha256, timestamp) of every stored card."""
+        table = self.dataset().to_table(columns=["image_sha256", "timestamp"])
+        return set(
+            zip(
+                table.column("image_sha256").to_pylist(),
+                table.column("timestamp").to_pylist(),
+            )
+        )
+
+
+@lru_cache(maxsize=1)
+def get_card_store() -> CardStore:
+    """Shared store; buffered cards are flushed at exit."""
+    store = CardStore()
+    atexit.register(store.flush)
+    return store
+
+
+def import_results(
+    path: Path = RESULTS_FILE,
+    store: Optional[CardStore] = None,
+    batch_rows: int = 50000,
+) -> int:
+    """
+    Append the cards of the JSON results file not stored yet, in batches.
+
+    Cards are matched by image hash and timestamp, so running it again (for
+    instance after a failed flush) does not store a card twice.
+    """
+    store = store or get_card_store()
+    seen = store.card_keys()
+    total = 0
+    batch: List[dict] = []
+    for card in iter_cards(path):
+        key = _card_key(_row(card))
+        if key in seen:
+            continue
+        seen.add(key)
+        batch.append(card)
+        if len(batch) >= batch_rows:
+            total += store.append(batch)
+            batch = []
+    total += store.append(batch)
+    return total
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description="Maintain the columnar card store.")
+    parser.add_argument("command", choices=["import", "compact", "count"])
+    parser.add_argument("--input", type=Path, default=RESULTS_FILE)
+    args = parser.parse_args(argv)
+
+    store = get_card_store()
+    start_time = time.perf_counter()
+    if args.command == "import":
+        print(f"imported {import_results(args.input, store)} cards")
+    elif args.command == "compact":
+        store.compact()
+    else:
+        print(f"{store.dataset().count_rows()} cards")
+    print(f"{time.perf_counter() - start_time:.2f}s")
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
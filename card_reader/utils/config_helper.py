@@ -48,7 +48,7 @@ def safe_get(secret_path: str, env_key: str = "", default: str = "") -> str:
                 value = str(val)
                 source = "secrets"
         except Exception as e:
-            logThis.debug(f"Could not retrieve secret '{secret_path}': {e}")
+            logThis.debug("Could not retrieve secret '%s': %s", secret_path, e)
 
     # If secrets not used, fallback to env
     if source != "secrets" and env_key:
@@ -58,7 +58,9 @@ def safe_get(secret_path: str, env_key: str = "", default: str = "") -> str:
             source = "env"
 
     logThis.info(
-        f"Loaded config for '{env_key or secret_path}' from [{source}]",
+        "Loaded config for '%s' from [%s]",
+        env_key or secret_path,
+        source,
         extra={"color": "yellow"},
     )
     return value
@@ -157,9 +159,9 @@ def setup_development_config(project_root: Path, image_base: Path) -> Dict:
         ):
             try:
                 Path(path).mkdir(parents=True, exist_ok=True)
-                logThis.debug(f"Created: {path}")
+                logThis.debug("Created: %s", path)
             except Exception as e:
-                logThis.warning(f"Could not create {path}: {e}")
+                logThis.warning("Could not create %s: %s", path, e)
 
     log_config(
         "Development",
@@ -199,7 +201,7 @@ def validate_configuration(
 
     if issues:
         for issue in issues:
-            logThis.error(f"Configuration issue: {issue}", extra={"color": "yellow"})
+            logThis.error("Configuration issue: %s", issue, extra={"color": "yellow"})
         return False
 
     logThis.info("Configuration validation passed", extra={"color": "yellow"})
@@ -26,8 +26,27 @@ MODELS = {
     "best.pt": {
         "source": "github",
         "api_url": "https://api.github.com/repos/recursivezero/tz-script/releases/tags/v3.5.0",
+        # Expected SHA-256; when unset the digest published with the release
+        # asset is used
+        "sha256": None,
     },
 }
+# Verified downloads (name -> size, sha256), used to trust cached models
+MODEL_MANIFEST = CACHE_DIR / "models_manifest.json"
+# Parallel ranged requests per model download and the size of each range
+MODEL_DOWNLOAD_CONNECTIONS = int(
+    safe_get("models.MODEL_DOWNLOAD_CONNECTIONS", "MODEL_DOWNLOAD_CONNECTIONS", "4")
+)
+MODEL_DOWNLOAD_BLOCK_MB = int(
+    safe_get("models.MODEL_DOWNLOAD_BLOCK_MB", "MODEL_DOWNLOAD_BLOCK_MB", "8")
+)
+# OCR readers map one shared, read-only copy of their weights from this folder.
+# Off by default: shared readers skip dynamic quantization, which costs CPU time
+SHARED_OCR_WEIGHTS = (
+    safe_get("models.SHARED_OCR_WEIGHTS", "SHARED_OCR_WEIGHTS", "false").lower()
+    == "true"
+)
+SHARED_WEIGHTS_DIR = CACHE_DIR / "shared_weights"
 
 # === Basic Configs ===
 ENVIRONMENT = safe_get("env.ENVIRONMENT", "ENVIRONMENT", "development")
@@ -57,6 +76,43 @@ else:
         "Incomplete AWS configuration - some services may not work properly"
     )
 
+# === S3 Uploads ===
+# "aws" for the real bucket, "local" for a filesystem-backed stand-in
+S3_BACKEND = safe_get("aws.S3_BACKEND", "S3_BACKEND", "aws")
+S3_LOCAL_ROOT = Path(
+    safe_get("aws.S3_LOCAL_ROOT", "S3_LOCAL_ROOT", str(CACHE_DIR / "s3"))
+)
+S3_UPLOAD_WORKERS = int(safe_get("aws.S3_UPLOAD_WORKERS", "S3_UPLOAD_WORKERS", "4"))
+# Uploads waiting for a worker before submit() blocks the caller
+S3_UPLOAD_QUEUE_SIZE = int(
+    safe_get("aws.S3_UPLOAD_QUEUE_SIZE", "S3_UPLOAD_QUEUE_SIZE", "64")
+)
+S3_MULTIPART_THRESHOLD_MB = int(
+    safe_get("aws.S3_MULTIPART_THRESHOLD_MB", "S3_MULTIPART_THRESHOLD_MB", "8")
+)
+S3_MULTIPART_CHUNK_MB = int(
+    safe_get("aws.S3_MULTIPART_CHUNK_MB", "S3_MULTIPART_CHUNK_MB", "8")
+)
+# Parts of one multipart upload sent in parallel
+S3_MAX_CONCURRENCY = int(
+    safe_get("aws.S3_MAX_CONCURRENCY", "S3_MAX_CONCURRENCY", "4")
+)
+S3_UPLOAD_MAX_ATTEMPTS = int(
+    safe_get("aws.S3_UPLOAD_MAX_ATTEMPTS", "S3_UPLOAD_MAX_ATTEMPTS", "4")
+)
+S3_UPLOAD_BACKOFF_BASE_S = float(
+    safe_get("aws.S3_UPLOAD_BACKOFF_BASE_S", "S3_UPLOAD_BACKOFF_BASE_S", "0.5")
+)
+# Presigned URLs are reused until this fraction of their lifetime has passed
+PRESIGNED_URL_REFRESH_FRACTION = float(
+    safe_get(
+        "aws.PRESIGNED_URL_REFRESH_FRACTION", "PRESIGNED_URL_REFRESH_FRACTION", "0.5"
+    )
+)
+PRESIGNED_URL_CACHE_ITEMS = int(
+    safe_get("aws.PRESIGNED_URL_CACHE_ITEMS", "PRESIGNED_URL_CACHE_ITEMS", "4096")
+)
+
 # === Application Constants ===
 API_PREFIX = "/api/v1"
 ALLOWED_EXTENSIONS = {"jpg", "jpeg", "png", "webp", "avif", "bmp"}
@@ -66,6 +122,147 @@ GENERATED_IMAGE_EXTENSION = "webp"
 DEFAULT_LIMIT = 4
 IMAGES_PER_ROW = 4
 TABLE_NAME = "fabric_table"
+# Columnar (Parquet) store of extracted cards, under DATABASE_PATH
+CARD_TABLE_NAME = safe_get("storage.CARD_TABLE_NAME", "CARD_TABLE_NAME", "card_table")
+CARD_STORE_ENABLED = (
+    safe_get("storage.CARD_STORE_ENABLED", "CARD_STORE_ENABLED", "false").lower()
+    == "true"
+)
+# Buffered cards are written as one file per partition once this many are
+# pending or the oldest has waited CARD_STORE_FLUSH_S seconds
+CARD_STORE_BATCH_ROWS = int(
+    safe_get("storage.CARD_STORE_BATCH_ROWS", "CARD_STORE_BATCH_ROWS", "500")
+)
+CARD_STORE_FLUSH_S = float(
+    safe_get("storage.CARD_STORE_FLUSH_S", "CARD_STORE_FLUSH_S", "30")
+)
+# A daily partition holding this many files is compacted into one
+CARD_STORE_COMPACT_FILES = int(
+    safe_get("storage.CARD_STORE_COMPACT_FILES", "CARD_STORE_COMPACT_FILES", "32")
+)
+# Preprocessed images kept per Streamlit session (reused across reruns)
+PREPROCESS_CACHE_ITEMS = int(
+    safe_get("ui.PREPROCESS_CACHE_ITEMS", "PREPROCESS_CACHE_ITEMS", "4")
+)
+# Gallery thumbnails (longest side in pixels)
+THUMBNAIL_DIR = CACHE_DIR / "thumbnails"
+THUMBNAIL_MAX_DIM = int(safe_get("ui.THUMBNAIL_MAX_DIM", "THUMBNAIL_MAX_DIM", "400"))
+# Content hash -> stored object key of every saved card image
+IMAGE_INDEX_PATH = Path(
+    safe_get(
+        "storage.IMAGE_INDEX_PATH",
+        "IMAGE_INDEX_PATH",
+        str(CACHE_DIR / "image_index.sqlite3"),
+    )
+)
+# Path -> header metadata (size, format, EXIF ids, GPS) of indexed image folders
+METADATA_INDEX_PATH = Path(
+    safe_get(
+        "storage.METADATA_INDEX_PATH",
+        "METADATA_INDEX_PATH",
+        str(CACHE_DIR / "metadata_index.sqlite3"),
+    )
+)
+# Header reads running at once while indexing a folder
+METADATA_INDEX_WORKERS = int(
+    safe_get("storage.METADATA_INDEX_WORKERS", "METADATA_INDEX_WORKERS", "8")
+)
+# Saved cards are re-encoded to this format ("webp" or "avif"), longest side
+# capped, metadata stripped
+STORED_IMAGE_FORMAT = safe_get(
+    "storage.STORED_IMAGE_FORMAT", "STORED_IMAGE_FORMAT", GENERATED_IMAGE_EXTENSION
+)
+STORED_IMAGE_MAX_DIM = int(
+    safe_get("storage.STORED_IMAGE_MAX_DIM", "STORED_IMAGE_MAX_DIM", "1600")
+)
+STORED_IMAGE_QUALITY = int(
+    safe_get("storage.STORED_IMAGE_QUALITY", "STORED_IMAGE_QUALITY", "80")
+)
+# Also keep the original upload bytes under <UPLOAD_FOLDER_CARD>/originals/
+KEEP_ORIGINAL_IMAGES = (
+    safe_get("storage.KEEP_ORIGINAL_IMAGES", "KEEP_ORIGINAL_IMAGES", "false").lower()
+    == "true"
+)
+# Background extractions running at once in the Streamlit process
+UI_EXTRACTION_WORKERS = int(
+    safe_get("ui.UI_EXTRACTION_WORKERS", "UI_EXTRACTION_WORKERS", "2")
+)
+# Seconds between progress refreshes while extractions are running
+UI_POLL_INTERVAL_S = float(
+    safe_get("ui.UI_POLL_INTERVAL_S", "UI_POLL_INTERVAL_S", "1.0")
+)
+
+# === HTTP API ===
+API_HOST = safe_get("api.API_HOST", "API_HOST", "0.0.0.0")
+API_PORT = int(safe_get("api.API_PORT", "API_PORT", "8000"))
+# Warm EasyOCR readers shared by all API requests
+API_OCR_WORKERS = int(safe_get("api.API_OCR_WORKERS", "API_OCR_WORKERS", "2"))
+# Extraction requests in flight before the API answers 503
+API_MAX_INFLIGHT = int(safe_get("api.API_MAX_INFLIGHT", "API_MAX_INFLIGHT", "16"))
+API_MAX_UPLOAD_MB = int(safe_get("api.API_MAX_UPLOAD_MB", "API_MAX_UPLOAD_MB", "20"))
+API_MAX_BATCH = int(safe_get("api.API_MAX_BATCH", "API_MAX_BATCH", "25"))
+
+# === Job Queue ===
+JOBS_DB_PATH = Path(
+    safe_get("jobs.JOBS_DB_PATH", "JOBS_DB_PATH", str(CACHE_DIR / "jobs.sqlite3"))
+)
+JOB_WORKERS = int(safe_get("jobs.JOB_WORKERS", "JOB_WORKERS", "2"))
+# Seconds a claimed job stays leased to a worker without a heartbeat
+JOB_VISIBILITY_TIMEOUT_S = float(
+    safe_get("jobs.JOB_VISIBILITY_TIMEOUT_S", "JOB_VISIBILITY_TIMEOUT_S", "120")
+)
+JOB_MAX_ATTEMPTS = int(safe_get("jobs.JOB_MAX_ATTEMPTS", "JOB_MAX_ATTEMPTS", "3"))
+JOB_BACKOFF_BASE_S = float(
+    safe_get("jobs.JOB_BACKOFF_BASE_S", "JOB_BACKOFF_BASE_S", "5")
+)
+# Lease owner prefix, the hostname by default; must differ between hosts
+# sharing JOBS_DB_PATH (each process appends its PID)
+JOB_NODE_ID = safe_get("jobs.JOB_NODE_ID", "JOB_NODE_ID", "")
+
+# === Observability ===
+# Fraction of requests traced (0 disables tracing, 1 traces everything)
+TRACE_SAMPLE_RATE = float(
+    safe_get("tracing.TRACE_SAMPLE_RATE", "TRACE_SAMPLE_RATE", "0")
+)
+TRACE_FILE = Path(
+    safe_get("tracing.TRACE_FILE", "TRACE_FILE", str(CACHE_DIR / "traces.jsonl"))
+)
+# Per-stage tracemalloc/RSS accounting (adds tracemalloc overhead when on)
+MEMORY_PROFILING = (
+    safe_get("memory.MEMORY_PROFILING", "MEMORY_PROFILING", "false").lower() == "true"
+)
+# Projected peak memory allowed per image in MB (0 disables the guard)
+MEMORY_BUDGET_MB = int(safe_get("memory.MEMORY_BUDGET_MB", "MEMORY_BUDGET_MB", "0"))
+# "downscale" or "reject" images that exceed MEMORY_BUDGET_MB
+MEMORY_GUARD_MODE = safe_get(
+    "memory.MEMORY_GUARD_MODE", "MEMORY_GUARD_MODE", "downscale"
+).lower()
+# Sampling profiler for slow requests (0 disables profiling)
+PROFILE_SAMPLE_RATE = float(
+    safe_get("profiling.PROFILE_SAMPLE_RATE", "PROFILE_SAMPLE_RATE", "0")
+)
+PROFILE_LATENCY_THRESHOLD_S = float(
+    safe_get(
+        "profiling.PROFILE_LATENCY_THRESHOLD_S", "PROFILE_LATENCY_THRESHOLD_S", "10"
+    )
+)
+PROFILE_INTERVAL_MS = float(
+    safe_get("profiling.PROFILE_INTERVAL_MS", "PROFILE_INTERVAL_MS", "10")
+)
+PROFILE_MAX_FILES = int(
+    safe_get("profiling.PROFILE_MAX_FILES", "PROFILE_MAX_FILES", "50")
+)
+PROFILE_DIR = Path(
+    safe_get("profiling.PROFILE_DIR", "PROFILE_DIR", str(CACHE_DIR / "profiles"))
+)
+# Requests slower than this many seconds are recorded for replay (0 disables)
+RECORD_SLO_S = float(safe_get("replay.RECORD_SLO_S", "RECORD_SLO_S", "0"))
+RECORDINGS_MAX = int(safe_get("replay.RECORDINGS_MAX", "RECORDINGS_MAX", "200"))
+RECORDINGS_DIR = Path(
+    safe_get(
+        "replay.RECORDINGS_DIR", "RECORDINGS_DIR", str(CACHE_DIR / "recordings")
+    )
+)
 
 # === File Paths ===
 IMAGE_BASE = get_asset_path()
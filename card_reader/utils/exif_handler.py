@@ -1,6 +1,7 @@
 from PIL import Image
 from PIL.ExifTags import GPSTAGS, TAGS
 from utils.logger import logThis
+from utils.metadata_index import write_unique_id
 
 logger = logThis
 
@@ -10,6 +11,10 @@ class ExifHandler:
         pass
 
     def add_exif_data(self, image_path, unique_id):
+        # JPEGs get the tag spliced in without re-encoding
+        if write_unique_id(image_path, unique_id):
+            return
+
         image = Image.open(image_path)
         exif_data = image.getexif()
 
@@ -1,6 +1,8 @@
 import base64
+import time
+from functools import lru_cache
 from io import BytesIO
-from typing import Any, Tuple
+from typing import Any, List, Sequence, Tuple
 
 import numpy as np
 import skimage
@@ -45,124 +47,122 @@ pattern dimension consistency and spatial distribution.
 """
 
 
-def validate_fabric_dimensions(img_array: np.ndarray, model: Any) -> Tuple[bool, str]:
-    """
-    Validates fabric images based on pattern dimension consistency.
+# Detection confidence of the primary tier and of the low-coverage fallback
+_PRIMARY_CONF = 0.7
+_FALLBACK_CONF = 0.5
+# Images per detector call in the batch validators; bounds the letterboxed
+# input tensor and the results held at once for large folders
+_DETECT_BATCH = 16
 
-    Args:
-        img_array (np.ndarray): numpy array of the image
-        model: detection model to identify fabric patterns
 
-    Returns:
-        tuple: (is_valid, message) where is_valid is boolean and message is string
+def _detections(result: Any) -> Tuple[np.ndarray, np.ndarray]:
+    """Box tensor (N, 4) as center x, center y, width, height and confidences (N,)"""
+    boxes = result.boxes.cpu().numpy()
+    xywh = np.asarray(boxes.xywh, dtype=np.float64).reshape(-1, 4)
+    conf = np.asarray(boxes.conf, dtype=np.float64).reshape(-1)
+    return xywh, conf
+
+
+def _detect_batches(model: Any, img_arrays: Sequence[np.ndarray], **kwargs):
+    """Run the detector over fixed-size batches, yielding results in order."""
+    for start in range(0, len(img_arrays), _DETECT_BATCH):
+        yield from model(list(img_arrays[start : start + _DETECT_BATCH]), **kwargs)
+
+
+def _cv(values: np.ndarray) -> float:
+    """Coefficient of variation, 0 when the mean is not positive"""
+    mean = values.mean()
+    return float(values.std() / mean) if mean > 0 else 0.0
+
+
+def _dimension_verdict(
+    xywh: np.ndarray, conf: np.ndarray, image_shape: Tuple[int, ...]
+) -> Tuple[bool, str]:
+    """
+    Apply the fabric dimension rules to the boxes of one image.
+
+    `xywh` and `conf` hold every detection down to _FALLBACK_CONF; the
+    primary tier is the subset at or above _PRIMARY_CONF.
     """
-    # Run detection model with moderate confidence
-    result = model(img_array, conf=0.7)[0]
+    primary = xywh[conf >= _PRIMARY_CONF]
 
     # Reject if no patterns detected
-    if len(result.boxes) == 0:
+    if len(primary) == 0:
         return False, "No fabric patterns detected"
 
     # Extract box dimensions
-    box_widths = [box.xywh[0][2] for box in result.boxes]
-    box_heights = [box.xywh[0][3] for box in result.boxes]
-    box_areas = [w * h for w, h in zip(box_widths, box_heights)]
-    aspect_ratios = [w / h if h > 0 else 0 for w, h in zip(box_widths, box_heights)]
-
-    # Calculate variation metrics
-    width_cv = (
-        np.std(box_widths) / np.mean(box_widths) if np.mean(box_widths) > 0 else 0
-    )
-    height_cv = (
-        np.std(box_heights) / np.mean(box_heights) if np.mean(box_heights) > 0 else 0
-    )
-    area_cv = np.std(box_areas) / np.mean(box_areas) if np.mean(box_areas) > 0 else 0
-    aspect_cv = (
-        np.std(aspect_ratios) / np.mean(aspect_ratios)
-        if np.mean(aspect_ratios) > 0
-        else 0
+    widths, heights = primary[:, 2], primary[:, 3]
+    areas = widths * heights
+    aspect_ratios = np.divide(
+        widths, heights, out=np.zeros_like(widths), where=heights > 0
     )
 
     # Dimension consistency checks
-    if width_cv > 0.3:
+    if _cv(widths) > 0.3:
         return False, "Inconsistent pattern widths detected"
 
-    if height_cv > 0.3:
+    if _cv(heights) > 0.3:
         return False, "Inconsistent pattern heights detected"
 
-    if area_cv > 0.4:
+    if _cv(areas) > 0.4:
         return False, "Inconsistent pattern sizes detected"
 
-    if aspect_cv > 0.25:
+    if _cv(aspect_ratios) > 0.25:
         return False, "Inconsistent pattern shapes detected"
 
-    # Check for extreme aspect ratios
-    for aspect in aspect_ratios:
-        if aspect < 0.2 or aspect > 5:  # Very narrow or very wide patterns
-            return False, "Invalid fabric pattern shape detected"
-
-    # Calculate spatial distribution metrics
-    center_x = [box.xywh[0][0] for box in result.boxes]
-    center_y = [box.xywh[0][1] for box in result.boxes]
+    # Check for extreme aspect ratios (very narrow or very wide patterns)
+    if np.any((aspect_ratios < 0.2) | (aspect_ratios > 5)):
+        return False, "Invalid fabric pattern shape detected"
 
     # Check if patterns are well-distributed across the image
-    if len(center_x) > 1:
-        x_range = max(center_x) - min(center_x)
-        y_range = max(center_y) - min(center_y)
-        img_diag = np.sqrt(img_array.shape[0] ** 2 + img_array.shape[1] ** 2)
+    if len(primary) > 1:
+        x_range, y_range = np.ptp(primary[:, :2], axis=0)
+        img_diag = np.sqrt(image_shape[0] ** 2 + image_shape[1] ** 2)
         spread_ratio = max(x_range, y_range) / img_diag
 
         # If detections are too clustered, likely not a repeating fabric pattern
-        if spread_ratio < 0.2 and len(result.boxes) > 2:
+        if spread_ratio < 0.2 and len(primary) > 2:
             return False, "Pattern distribution not consistent with fabric"
 
     # Calculate coverage
-    img_area = img_array.shape[0] * img_array.shape[1]
-    coverage = sum(box_areas) / img_area
+    img_area = image_shape[0] * image_shape[1]
+    coverage = areas.sum() / img_area
 
     # Accept if good coverage and dimensions are consistent
     if coverage > 0.25:
         return True, "Valid fabric pattern detected"
 
-    # For low coverage, try with lower confidence threshold
-    if coverage < 0.25:
-        low_conf_result = model(img_array, conf=0.5)[0]
-        if len(low_conf_result.boxes) >= 3:
-            # Check dimensions consistency at lower confidence
-            low_conf_areas = [
-                box.xywh[0][2] * box.xywh[0][3] for box in low_conf_result.boxes
-            ]
-            low_conf_coverage = sum(low_conf_areas) / img_area
-
-            if low_conf_coverage > 0.3:
-                return True, "Valid fabric pattern detected"
+    # For low coverage, fall back to the lower confidence tier
+    if coverage < 0.25 and len(xywh) >= 3:
+        low_conf_coverage = (xywh[:, 2] * xywh[:, 3]).sum() / img_area
+        if low_conf_coverage > 0.3:
+            return True, "Valid fabric pattern detected"
 
     return False, "Insufficient fabric pattern coverage"
 
 
-def validate_fabric_count(
-    img_array: np.ndarray,
-    model: Any,
-    *,
-    max_fabrics: int,
-    mode: str,  # "single" or "group"
-) -> Tuple[bool, str]:
+def validate_fabric_dimensions(img_array: np.ndarray, model: Any) -> Tuple[bool, str]:
     """
-    Validates that the image contains the expected number of fabric patterns.
+    Validates fabric images based on pattern dimension consistency.
+
+    The model runs once at the fallback confidence; the primary tier is
+    derived by masking. NMS only lets a box suppress lower-scored ones, so
+    the boxes at or above _PRIMARY_CONF are the ones a run at that
+    threshold would return.
 
     Args:
-        img_array (np.ndarray): Image as a numpy array.
-        model (Any): Fabric detection model.
-        max_fabrics (int): Max fabrics allowed for single mode.
-        mode (str): Validation mode: "single" or "group".
+        img_array (np.ndarray): numpy array of the image
+        model: detection model to identify fabric patterns
 
     Returns:
-        tuple: (is_valid, message)
+        tuple: (is_valid, message) where is_valid is boolean and message is string
     """
-    result = model(img_array)[0]
+    result = model(img_array, conf=_FALLBACK_CONF)[0]
+    return _dimension_verdict(*_detections(result), img_array.shape)
 
-    fabric_count = len(result.boxes)
 
+def _count_verdict(fabric_count: int, max_fabrics: int, mode: str) -> Tuple[bool, str]:
+    """Apply the single/group fabric count rules to one image."""
     if mode == "single":
         if fabric_count >= max_fabrics:
             return (
@@ -183,7 +183,228 @@ def validate_fabric_count(
         return False, f"Unknown validation mode: {mode}"
 
 
-def get_dominant_color(image, k=5, central_weight=1.5):
+def validate_fabric_count(
+    img_array: np.ndarray,
+    model: Any,
+    *,
+    max_fabrics: int,
+    mode: str,  # "single" or "group"
+) -> Tuple[bool, str]:
+    """
+    Validates that the image contains the expected number of fabric patterns.
+
+    Args:
+        img_array (np.ndarray): Image as a numpy array.
+        model (Any): Fabric detection model.
+        max_fabrics (int): Max fabrics allowed for single mode.
+        mode (str): Validation mode: "single" or "group".
+
+    Returns:
+        tuple: (is_valid, message)
+    """
+    result = model(img_array)[0]
+    return _count_verdict(len(result.boxes), max_fabrics, mode)
+
+
+def validate_fabric_dimensions_batch(
+    img_arrays: Sequence[np.ndarray], model: Any
+) -> List[Tuple[bool, str]]:
+    """
+    Batch variant of `validate_fabric_dimensions`.
+
+    The detector runs over batches of _DETECT_BATCH images, which amortizes
+    its per-call overhead when validating whole upload folders while keeping
+    memory bounded.
+
+    Args:
+        img_arrays: numpy arrays of the images
+        model: detection model to identify fabric patterns
+
+    Returns:
+        list: (is_valid, message) for every image, in input order
+    """
+    results = _detect_batches(model, img_arrays, conf=_FALLBACK_CONF)
+    return [
+        _dimension_verdict(*_detections(result), img_array.shape)
+        for img_array, result in zip(img_arrays, results)
+    ]
+
+
+def validate_fabric_count_batch(
+    img_arrays: Sequence[np.ndarray],
+    model: Any,
+    *,
+    max_fabrics: int,
+    mode: str,  # "single" or "group"
+) -> List[Tuple[bool, str]]:
+    """
+    Batch variant of `validate_fabric_count`, one detector call per
+    _DETECT_BATCH images.
+
+    Returns:
+        list: (is_valid, message) for every image, in input order
+    """
+    results = _detect_batches(model, img_arrays)
+    return [_count_verdict(len(result.boxes), max_fabrics, mode) for result in results]
+
+
+def _to_rgb_image(image) -> Image.Image:
+    """Ensure the image is a PIL Image, then convert to RGB"""
+    if isinstance(image, str):
+        return Image.open(image).convert("RGB")
+    elif isinstance(image, np.ndarray):
+        return Image.fromarray(image).convert("RGB")
+    elif isinstance(image, Image.Image):
+        return image.convert("RGB")
+    raise ValueError("Unsupported image type passed to get_dominant_color")
+
+
+@lru_cache(maxsize=32)
+def _center_weights(height: int, width: int, central_weight: float) -> np.ndarray:
+    """Per-pixel weights falling from `central_weight` at the center to 1.0."""
+    y, x = np.ogrid[:height, :width]
+    center_y, center_x = height // 2, width // 2
+
+    # Calculate distance from center (normalized)
+    dist_from_center = np.sqrt((x - center_x) ** 2 + (y - center_y) ** 2)
+    max_dist = np.sqrt(center_x**2 + center_y**2) or 1.0
+    normalized_dist = dist_from_center / max_dist
+
+    weights = central_weight - normalized_dist * (central_weight - 1.0)
+    weights.flags.writeable = False
+    return weights
+
+
+# LAB histogram grid for the fast path: 16 L bins, 24 a bins and 24 b bins
+_HIST_BINS = np.array([16, 24, 24])
+_HIST_LOW = np.array([0.0, -128.0, -128.0])
+_HIST_HIGH = np.array([100.0, 128.0, 128.0])
+
+
+def _box_sum(grid: np.ndarray) -> np.ndarray:
+    """Sum over the 3x3x3 neighborhood of every cell of (N, L, A, B) grids."""
+    for axis in (1, 2, 3):
+        padding = [(0, 0)] * grid.ndim
+        padding[axis] = (1, 1)
+        padded = np.pad(grid, padding)
+        length = grid.shape[axis]
+
+        def shifted(offset):
+            index = [slice(None)] * grid.ndim
+            index[axis] = slice(offset, offset + length)
+            return padded[tuple(index)]
+
+        grid = shifted(0) + shifted(1) + shifted(2)
+    return grid
+
+
+# Crops processed per vectorized pass; bounds the (N, size * size, 3)
+# temporaries of the cluster means
+_COLOR_CHUNK = 64
+
+
+def get_dominant_colors(
+    images: Sequence, central_weight: float = 1.5, size: int = 100
+) -> List[Tuple[int, int, int]]:
+    """
+    Fast dominant colors of many crops, vectorized over chunks of crops.
+
+    Instead of k-means, every crop's center-weighted pixels are binned in a
+    LAB histogram. A cluster is a bin plus its direct neighbors, so a color
+    spread over adjacent bins counts once. The two strongest non-overlapping
+    clusters then go through the same brightness rule as
+    `get_dominant_color`, using the weighted mean color of their pixels.
+
+    This approximates the k-means result rather than reproducing it. On the
+    synthetic crops of `benchmark_dominant_color` the median CIEDE2000
+    difference is about 1.1, 92% of crops are within 5 and the 95th
+    percentile is about 9: where k-means splits one color into several
+    clusters the brightness rule can pick the other color. Use it where a
+    close color is good enough, and the k-means path where it must match.
+
+    Args:
+        images: PIL Images, numpy arrays or paths
+        central_weight: Weight multiplier for central pixels
+        size: Side crops are resampled to before binning
+
+    Returns:
+        list: (R, G, B) of the dominant color of every image
+    """
+    colors = []
+    for start in range(0, len(images), _COLOR_CHUNK):
+        rgb = np.stack(
+            [
+                np.asarray(
+                    _to_rgb_image(image).resize((size, size), Image.Resampling.LANCZOS)
+                )
+                for image in images[start : start + _COLOR_CHUNK]
+            ]
+        )
+        colors.extend(_dominant_colors_chunk(rgb, central_weight))
+    return colors
+
+
+def _dominant_colors_chunk(
+    rgb: np.ndarray, central_weight: float
+) -> List[Tuple[int, int, int]]:
+    """Dominant colors of a (N, size, size, 3) stack of resized crops."""
+    count, size = rgb.shape[:2]
+    pixels = skimage.color.rgb2lab(rgb).reshape(count, -1, 3)
+    weights = np.broadcast_to(
+        _center_weights(size, size, central_weight).ravel(), pixels.shape[:2]
+    )
+
+    # Bin every pixel; offset bin indices per image so one bincount covers all
+    bins = tuple(_HIST_BINS)
+    bins_per_image = int(np.prod(_HIST_BINS))
+    cells = (pixels - _HIST_LOW) / (_HIST_HIGH - _HIST_LOW) * _HIST_BINS
+    cells = np.clip(cells.astype(np.int64), 0, _HIST_BINS - 1)
+    flat_index = np.ravel_multi_index(
+        (cells[..., 0], cells[..., 1], cells[..., 2]), bins
+    ) + (np.arange(count) * bins_per_image)[:, None]
+    histogram = np.bincount(
+        flat_index.ravel(), weights.ravel(), bins_per_image * count
+    ).reshape(count, *bins)
+
+    cluster_counts = _box_sum(histogram).reshape(count, -1)
+    top1 = cluster_counts.argmax(axis=1)
+    top1_cell = np.stack(np.unravel_index(top1, bins), axis=1)
+
+    # Second peak: strongest cluster that does not overlap the first
+    axes = [np.arange(n) for n in bins]
+    near = [
+        np.abs(axes[d][None, :] - top1_cell[:, d : d + 1]) <= 2 for d in range(3)
+    ]
+    overlaps = (
+        near[0][:, :, None, None] & near[1][:, None, :, None] & near[2][:, None, None, :]
+    ).reshape(count, -1)
+    top2 = np.where(overlaps, -1.0, cluster_counts).argmax(axis=1)
+    top2_cell = np.stack(np.unravel_index(top2, bins), axis=1)
+
+    image_index = np.arange(count)
+    count1 = cluster_counts[image_index, top1]
+    count2 = np.where(
+        overlaps[image_index, top2], 0.0, cluster_counts[image_index, top2]
+    )
+
+    def cluster_color(cell):
+        # Weighted mean of the pixels falling in the cluster around `cell`
+        member = (np.abs(cells - cell[:, None, :]) <= 1).all(axis=-1) * weights
+        total = np.maximum(member.sum(axis=1), 1e-9)
+        return (pixels * member[..., None]).sum(axis=1) / total[:, None]
+
+    color1 = cluster_color(top1_cell)
+    color2 = cluster_color(top2_cell)
+
+    # Same rule as get_dominant_color: prefer a clearly brighter second
+    # cluster that is not too small
+    use_second = (color2[:, 0] > color1[:, 0] + 20) & (count2 > count1 * 0.4)
+    lab_colors = np.where(use_second[:, None], color2, color1)
+    rgb_colors = skimage.color.lab2rgb(lab_colors[None])[0]
+    return [tuple(map(int, color * 255)) for color in rgb_colors]
+
+
+def get_dominant_color(image, k=5, central_weight=1.5, fast=False):
     """
     Extracts the dominant color from an image using optimized K-Means clustering
     with improvements for bounding box crops.
@@ -192,19 +413,15 @@ def get_dominant_color(image, k=5, central_weight=1.5):
         image: PIL Image, numpy array, or path to image
         k: Number of clusters for k-means
         central_weight: Weight multiplier for central pixels
+        fast: Use the LAB histogram of `get_dominant_colors` instead of k-means
 
     Returns:
         tuple: (R, G, B) of the dominant color
     """
-    # Ensure the image is a PIL Image, then convert to RGB
-    if isinstance(image, str):
-        image = Image.open(image).convert("RGB")
-    elif isinstance(image, np.ndarray):
-        image = Image.fromarray(image).convert("RGB")
-    elif isinstance(image, Image.Image):
-        image = image.convert("RGB")
-    else:
-        raise ValueError("Unsupported image type passed to get_dominant_color")
+    if fast:
+        return get_dominant_colors([image], central_weight)[0]
+
+    image = _to_rgb_image(image)
 
     # Skip resizing for very small images (< 5000 pixels)
     width, height = image.size
@@ -218,16 +435,7 @@ def get_dominant_color(image, k=5, central_weight=1.5):
     lab_image = skimage.color.rgb2lab(rgb_image)
 
     # Create a weighting mask that emphasizes central pixels
-    y, x = np.ogrid[: lab_image.shape[0], : lab_image.shape[1]]
-    center_y, center_x = lab_image.shape[0] // 2, lab_image.shape[1] // 2
-
-    # Calculate distance from center (normalized)
-    dist_from_center = np.sqrt((x - center_x) ** 2 + (y - center_y) ** 2)
-    max_dist = np.sqrt(center_x**2 + center_y**2)
-    normalized_dist = dist_from_center / max_dist
-
-    # Create weight mask (higher weight for central pixels)
-    weights = central_weight - normalized_dist * (central_weight - 1.0)
+    weights = _center_weights(lab_image.shape[0], lab_image.shape[1], central_weight)
 
     # Flatten the image and weights
     pixels = lab_image.reshape(-1, 3)
@@ -246,10 +454,7 @@ def get_dominant_color(image, k=5, central_weight=1.5):
     labels = kmeans.labels_
 
     # Calculate weighted histogram
-    weighted_counts = np.zeros(k)
-    for i in range(k):
-        mask = labels == i
-        weighted_counts[i] = np.sum(flat_weights[mask])
+    weighted_counts = np.bincount(labels, weights=flat_weights, minlength=k)
 
     # Sort clusters by weighted frequency
     sorted_indices = np.argsort(-weighted_counts)
@@ -279,3 +484,50 @@ def get_dominant_color(image, k=5, central_weight=1.5):
 
     # Return as integer RGB tuple
     return tuple(map(int, rgb_color * 255))  # Convert to integer RGB values
+
+
+def benchmark_dominant_color(count: int = 200, seed: int = 0) -> dict:
+    """
+    Time k-means against the batched histogram on synthetic fabric crops and
+    report the CIEDE2000 difference between their colors.
+    """
+    rng = np.random.default_rng(seed)
+    crops = []
+    for _ in range(count):
+        height, width = rng.integers(60, 400, size=2)
+        background, pattern = rng.integers(0, 256, size=(2, 3))
+        crop = np.empty((height, width, 3), dtype=np.float64)
+        crop[:] = background
+        # Stripes of a second color covering a random share of the crop
+        period = int(rng.integers(6, 30))
+        stripe = int(rng.integers(1, period))
+        crop[:, (np.arange(width) % period) < stripe] = pattern
+        crop += rng.normal(0, 6, crop.shape)
+        crops.append(np.clip(crop, 0, 255).astype(np.uint8))
+
+    start_time = time.perf_counter()
+    kmeans_colors = [get_dominant_color(crop) for crop in crops]
+    kmeans_s = time.perf_counter() - start_time
+
+    start_time = time.perf_counter()
+    fast_colors = get_dominant_colors(crops)
+    fast_s = time.perf_counter() - start_time
+
+    delta_e = skimage.color.deltaE_ciede2000(
+        skimage.color.rgb2lab(np.array([kmeans_colors], dtype=np.uint8)),
+        skimage.color.rgb2lab(np.array([fast_colors], dtype=np.uint8)),
+    )[0]
+    return {
+        "crops": count,
+        "kmeans_ms_per_crop": kmeans_s / count * 1000,
+        "batch_ms_per_crop": fast_s / count * 1000,
+        "speedup": kmeans_s / fast_s,
+        "median_delta_e": float(np.median(delta_e)),
+        "p95_delta_e": float(np.percentile(delta_e, 95)),
+        "within_delta_e_5": float(np.mean(delta_e <= 5)),
+    }
+
+
+if __name__ == "__main__":
+    for name, value in benchmark_dominant_color().items():
+        print(f"{name:>20}: {value:.3f}" if isinstance(value, float) else f"{name:>20}: {value}")
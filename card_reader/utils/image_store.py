@@ -0,0 +1,325 @@
+"""Content-Addressed Image Store
+
+Saved card images are stored under a key derived from the SHA-256 of the
+uploaded bytes, `<UPLOAD_FOLDER_CARD>/<sha256>.<ext>`, so the same card
+uploaded ten times is stored once. In production the objects go to S3, in
+development to the local upload folder.
+
+A local SQLite index maps content hashes to stored keys. A hash missing from
+the index is checked with a HEAD request (or a file check) before any work is
+done, so duplicates stored by another process are skipped as well.
+
+Stored images are re-encoded to STORED_IMAGE_FORMAT with the longest side
+capped at STORED_IMAGE_MAX_DIM and all metadata stripped; OCR never needs more.
+The original bytes are kept only with KEEP_ORIGINAL_IMAGES. Encoding runs on
+a background thread, off the request path; uploads are handed on to the
+shared upload queue, so the encoder never waits for S3.
+"""
+
+import contextvars
+import hashlib
+import io
+import sqlite3
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Dict, Optional
+
+from botocore.exceptions import ClientError
+from PIL import Image, ImageOps, features
+
+from utils.aws_helper import s3
+from utils.constants import (
+    AWS_BUCKET_NAME,
+    ENVIRONMENT,
+    IMAGE_INDEX_PATH,
+    KEEP_ORIGINAL_IMAGES,
+    STORED_IMAGE_FORMAT,
+    STORED_IMAGE_MAX_DIM,
+    STORED_IMAGE_QUALITY,
+    UPLOAD_FOLDER_CARD,
+)
+from utils.logger import logThis
+from utils.upload_queue import upload_queue
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS images (
+    content_hash  TEXT PRIMARY KEY,
+    object_key    TEXT NOT NULL,
+    size          INTEGER NOT NULL,
+    original_name TEXT,
+    created_at    REAL NOT NULL
+);
+"""
+
+# PIL format name -> file extension, where they differ
+_EXTENSIONS = {"JPEG": "jpg", "MPO": "jpg"}
+_CONTENT_TYPES = {"webp": "image/webp", "avif": "image/avif"}
+
+
+def content_hash(image_bytes: bytes) -> str:
+    return hashlib.sha256(image_bytes).hexdigest()
+
+
+def image_extension(image_format: str) -> str:
+    """File extension of a PIL image format name."""
+    return _EXTENSIONS.get(image_format.upper(), image_format.lower())
+
+
+def _storage_format(requested: str) -> str:
+    if requested.lower() == "avif" and not features.check("avif"):
+        logThis.warning("Pillow was built without AVIF support, storing WebP")
+        return "webp"
+    return requested.lower()
+
+
+def encode_for_storage(
+    image_bytes: bytes,
+    image_format: str = STORED_IMAGE_FORMAT,
+    max_dim: int = STORED_IMAGE_MAX_DIM,
+    quality: int = STORED_IMAGE_QUALITY,
+) -> bytes:
+    """Re-encode an image with its longest side capped and no metadata."""
+    with Image.open(io.BytesIO(image_bytes)) as image:
+        # Let JPEG decode at a reduced scale before the exact downsize
+        image.draft(image.mode, (max_dim, max_dim))
+        # Orientation lives in EXIF, which is dropped: apply it to the pixels
+        image = ImageOps.exif_transpose(image)
+        # Palette and RGB images can carry transparency outside an alpha band
+        has_alpha = "A" in image.getbands() or "transparency" in image.info
+        image = image.convert("RGBA" if has_alpha else "RGB")
+        image.thumbnail((max_dim, max_dim), Image.Resampling.LANCZOS)
+
+        buffer = io.BytesIO()
+        # EXIF, XMP and ICC data are only written when passed explicitly
+        image.save(buffer, format=image_format.upper(), quality=quality)
+    return buffer.getvalue()
+
+
+@dataclass
+class StoredImage:
+    """Outcome of `ImageStore.store`."""
+
+    key: str
+    content_hash: str
+    # False when the image was already stored and no work was queued
+    created: bool
+    # Pending background encode and write/upload, resolving to True or False
+    pending: Optional[Future] = None
+
+
+class ImageStore:
+    """Store card images once per distinct content."""
+
+    def __init__(
+        self,
+        db_path: Path = IMAGE_INDEX_PATH,
+        folder: str = UPLOAD_FOLDER_CARD,
+        remote: bool = ENVIRONMENT.lower() == "production",
+        image_format: str = STORED_IMAGE_FORMAT,
+        keep_original: bool = KEEP_ORIGINAL_IMAGES,
+    ):
+        self.db_path = Path(db_path)
+        self.db_path.parent.mkdir(parents=True, exist_ok=True)
+        self.folder = str(folder).rstrip("/")
+        self.remote = remote
+        self.image_format = _storage_format(image_format)
+        self.keep_original = keep_original
+        self._local = threading.local()
+        self._pending: Dict[str, StoredImage] = {}
+        self._lock = threading.Lock()
+        self._encoder = ThreadPoolExecutor(
+            max_workers=1, thread_name_prefix="image-ingest"
+        )
+        self._connection().executescript(_SCHEMA)
+
+    def _connection(self) -> sqlite3.Connection:
+        """One connection per thread, in autocommit mode with WAL."""
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.db_path, timeout=30, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            self._local.conn = conn
+        return conn
+
+    def key_for(self, digest: str) -> str:
+        """Canonical object key of the image with this content hash."""
+        return f"{self.folder}/{digest}.{self.image_format}"
+
+    def original_key_for(self, digest: str, image_format: str) -> str:
+        return f"{self.folder}/originals/{digest}.{image_extension(image_format)}"
+
+    def lookup(self, digest: str) -> Optional[str]:
+        """Stored key of the image with this hash, if it is in the index."""
+        row = (
+            self._connection()
+            .execute("SELECT object_key FROM images WHERE content_hash = ?", (digest,))
+            .fetchone()
+        )
+        return row[0] if row else None
+
+    def pending(self, digest: str) -> Optional[StoredImage]:
+        """The store of this image still in progress, if any."""
+        with self._lock:
+            return self._pending.get(digest)
+
+    def _index(self, digest: str, key: str, size: int, original_name: str) -> None:
+        self._connection().execute(
+            "INSERT OR REPLACE INTO images VALUES (?, ?, ?, ?, ?)",
+            (digest, key, size, original_name, time.time()),
+        )
+
+    def _stored_size(self, key: str) -> Optional[int]:
+        """Size of the stored object, or None if it does not exist."""
+        if not self.remote:
+            path = Path(key)
+            return path.stat().st_size if path.is_file() else None
+        try:
+            return s3.head_object(Bucket=AWS_BUCKET_NAME, Key=key)["ContentLength"]
+        except ClientError as e:
+            if e.response.get("Error", {}).get("Code") in {"404", "NoSuchKey"}:
+                return None
+            raise
+
+    def _write(self, data: bytes, key: str, metadata: dict) -> Future:
+        """Write `data` to `key`; the future resolves to True or False."""
+        if self.remote:
+            extension = key.rsplit(".", 1)[-1]
+            extra_args = {"Metadata": metadata}
+            if extension in _CONTENT_TYPES:
+                extra_args["ContentType"] = _CONTENT_TYPES[extension]
+            return upload_queue.submit(data, key, extra_args)
+
+        path = Path(key)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        tmp_path = path.with_name(f".{path.name}.part")
+        tmp_path.write_bytes(data)
+        tmp_path.replace(path)
+        written: Future = Future()
+        written.set_result(True)
+        return written
+
+    def _ingest(
+        self,
+        image_bytes: bytes,
+        digest: str,
+        key: str,
+        original_name: str,
+        outcome: Future,
+    ) -> None:
+        """
+        Encode one image and hand it on for writing; runs on the ingest thread.
+
+        `outcome` is resolved by the last write or upload to finish, so the
+        encoder moves on to the next image without waiting for S3. It reports
+        the canonical image: once that is written it is indexed, even if
+        keeping the original failed, so no stored object is left unindexed.
+        """
+        start_time = time.perf_counter()
+        encoded = encode_for_storage(image_bytes, self.image_format)
+        metadata = {"sha256": digest, "original-name": original_name}
+
+        writes = [self._write(encoded, key, metadata)]
+        if self.keep_original:
+            try:
+                with Image.open(io.BytesIO(image_bytes)) as image:
+                    image_format = image.format or "bin"
+                original_key = self.original_key_for(digest, image_format)
+                writes.append(self._write(image_bytes, original_key, metadata))
+            except Exception as e:
+                logThis.error("Could not keep the original of %s: %s", original_name, e)
+
+        remaining = [len(writes)]
+        remaining_lock = threading.Lock()
+
+        def written(_: Future) -> None:
+            with remaining_lock:
+                remaining[0] -= 1
+                if remaining[0]:
+                    return
+            try:
+                canonical = writes[0]
+                stored = not canonical.exception() and canonical.result()
+                if not all(not w.exception() and w.result() for w in writes[1:]):
+                    logThis.error("Could not keep the original of %s", original_name)
+                if stored:
+                    self._index(digest, key, len(encoded), original_name)
+                    logThis.info(
+                        "Stored %s as %s: %.0f KB -> %.0f KB in %.2fs",
+                        original_name,
+                        key,
+                        len(image_bytes) / 1024,
+                        len(encoded) / 1024,
+                        time.perf_counter() - start_time,
+                    )
+                outcome.set_result(stored)
+            except Exception as e:
+                outcome.set_exception(e)
+
+        for write in writes:
+            write.add_done_callback(written)
+
+    def store(self, image_bytes: bytes, original_name: str = "") -> StoredImage:
+        """
+        Queue `image_bytes` for storage under its content-addressed key.
+
+        Returns at once; `pending` resolves once the re-encoded image is
+        written (or uploaded) and indexed.
+        """
+        digest = content_hash(image_bytes)
+
+        key = self.lookup(digest)
+        if key is not None and (self.remote or Path(key).is_file()):
+            return StoredImage(key, digest, created=False)
+
+        key = self.key_for(digest)
+        with self._lock:
+            pending = self._pending.get(digest)
+            if pending is not None:
+                return StoredImage(key, digest, created=False, pending=pending.pending)
+        # The HEAD request runs outside the lock, so other stores do not queue
+        # behind it; a store started meanwhile is picked up below
+        size = self._stored_size(key)
+        if size is not None:
+            self._index(digest, key, size, original_name)
+            logThis.info("%s is already stored as %s", original_name, key)
+            return StoredImage(key, digest, created=False)
+
+        with self._lock:
+            pending = self._pending.get(digest)
+            if pending is not None:
+                return StoredImage(key, digest, created=False, pending=pending.pending)
+            stored = StoredImage(key, digest, created=True, pending=Future())
+            encoding = self._encoder.submit(
+                contextvars.copy_context().run,
+                self._ingest,
+                image_bytes,
+                digest,
+                key,
+                original_name,
+                stored.pending,
+            )
+            self._pending[digest] = stored
+
+        def encoded(future: Future):
+            # An encode failure never reaches the writes: fail the outcome here
+            if future.exception() is not None:
+                stored.pending.set_exception(future.exception())
+
+        encoding.add_done_callback(encoded)
+
+        def finished(future: Future):
+            with self._lock:
+                self._pending.pop(digest, None)
+            if future.exception():
+                logThis.error(
+                    "Could not store %s: %s", original_name, future.exception()
+                )
+
+        stored.pending.add_done_callback(finished)
+        return stored
+
+
+image_store = ImageStore()
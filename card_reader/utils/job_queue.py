@@ -0,0 +1,473 @@
+"""Durable Job Queue
+
+SQLite-backed queue for asynchronous card extraction. Submitting an image
+returns a job ID immediately; worker threads claim jobs, run the extraction and
+store the result, and clients poll or subscribe for the status.
+
+- Idempotency: the SHA-256 of the image bytes is the idempotency key, so the
+  same card submitted twice maps to the same job.
+- Visibility timeout: a claimed job is leased to one worker. Workers renew the
+  lease while running; if a worker dies the lease expires and the job becomes
+  claimable again.
+- Retries: failed attempts are re-queued with exponential backoff until
+  JOB_MAX_ATTEMPTS is reached, then the job is marked failed.
+- Crash recovery: leases are owned by `<node>:<pid>:<start>:<worker>`, so
+  several processes on one host (gunicorn workers) never take each other's
+  jobs. On start-up a process re-queues the expired leases of its node and
+  those held by processes of this host that are no longer running, and
+  resumes that work at once; leases of live processes are left alone. The
+  process start time tells a live owner from a later process that reused its
+  PID (PID 1 in a restarted container).
+"""
+
+import hashlib
+import json
+import os
+import socket
+import sqlite3
+import threading
+import time
+import uuid
+from pathlib import Path
+from typing import Callable, Dict, Iterator, Optional, Tuple
+
+from utils.constants import (
+    JOB_BACKOFF_BASE_S,
+    JOB_MAX_ATTEMPTS,
+    JOB_NODE_ID,
+    JOB_VISIBILITY_TIMEOUT_S,
+    JOBS_DB_PATH,
+)
+from utils.logger import logThis
+
+QUEUED = "queued"
+RUNNING = "running"
+SUCCEEDED = "succeeded"
+FAILED = "failed"
+TERMINAL_STATUSES = {SUCCEEDED, FAILED}
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    id TEXT PRIMARY KEY,
+    idempotency_key TEXT NOT NULL UNIQUE,
+    status TEXT NOT NULL,
+    filename TEXT,
+    image BLOB,
+    attempts INTEGER NOT NULL DEFAULT 0,
+    max_attempts INTEGER NOT NULL,
+    available_at REAL NOT NULL,
+    lease_owner TEXT,
+    lease_expires_at REAL,
+    result TEXT,
+    extracted_text TEXT,
+    error TEXT,
+    created_at REAL NOT NULL,
+    updated_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS jobs_claimable ON jobs (status, available_at);
+"""
+
+_PUBLIC_COLUMNS = (
+    "id, idempotency_key, status, filename, attempts, max_attempts, "
+    "result, extracted_text, error, created_at, updated_at"
+)
+
+
+def _like_escape(value: str) -> str:
+    """Escape the LIKE wildcards of `value` for `LIKE ? ESCAPE '\\'`."""
+    return value.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_")
+
+
+def _process_start(pid: int) -> str:
+    """Start time of a process, or "" when it cannot be read."""
+    try:
+        stat = Path(f"/proc/{pid}/stat").read_text()
+        # Field 22, counted after the parenthesized command name
+        return stat.rsplit(")", 1)[1].split()[19]
+    except (OSError, IndexError):
+        pass
+    try:
+        import psutil
+
+        return str(int(psutil.Process(pid).create_time()))
+    except Exception:  # psutil is optional
+        return ""
+
+
+def _owner_alive(owner: str) -> bool:
+    """
+    Whether the `<pid>:<start>:<worker>` part of a lease owner is a live
+    process here, and the same one that took the lease.
+    """
+    parts = owner.split(":")
+    pid = parts[0]
+    if not pid.isdigit():
+        return False
+    try:
+        os.kill(int(pid), 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    started = parts[1] if len(parts) > 2 else ""
+    if started:
+        current = _process_start(int(pid))
+        if current and current != started:
+            return False
+    return True
+
+
+def image_hash(image_bytes: bytes) -> str:
+    """Content hash used as the idempotency key of a card image."""
+    return hashlib.sha256(image_bytes).hexdigest()
+
+
+class JobQueue:
+    """SQLite-backed job store shared by API handlers and workers."""
+
+    def __init__(
+        self,
+        db_path: Path = JOBS_DB_PATH,
+        visibility_timeout: float = JOB_VISIBILITY_TIMEOUT_S,
+        max_attempts: int = JOB_MAX_ATTEMPTS,
+    ):
+        self.db_path = Path(db_path)
+        self.db_path.parent.mkdir(parents=True, exist_ok=True)
+        self.visibility_timeout = visibility_timeout
+        self.max_attempts = max_attempts
+        self._local = threading.local()
+        self._connection().executescript(_SCHEMA)
+
+    def _connection(self) -> sqlite3.Connection:
+        """One connection per thread, in autocommit mode with WAL."""
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.db_path, timeout=30, isolation_level=None)
+            conn.row_factory = sqlite3.Row
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    def submit(self, image_bytes: bytes, filename: str = "") -> Tuple[str, bool]:
+        """
+        Queue an image for extraction.
+
+        Returns (job_id, created). A card already queued, running or done is
+        not queued again; a failed one is re-queued under the same job ID.
+        """
+        key = image_hash(image_bytes)
+        now = time.time()
+        conn = self._connection()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            row = conn.execute(
+                "SELECT id, status FROM jobs WHERE idempotency_key = ?", (key,)
+            ).fetchone()
+            if row is None:
+                job_id = uuid.uuid4().hex
+                conn.execute(
+                    "INSERT INTO jobs (id, idempotency_key, status, filename, image,"
+                    " max_attempts, available_at, created_at, updated_at)"
+                    " VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                    (
+                        job_id,
+                        key,
+                        QUEUED,
+                        filename,
+                        image_bytes,
+                        self.max_attempts,
+                        now,
+                        now,
+                        now,
+                    ),
+                )
+                created = True
+            elif row["status"] == FAILED:
+                job_id = row["id"]
+                conn.execute(
+                    "UPDATE jobs SET status = ?, image = ?, attempts = 0,"
+                    " error = NULL, available_at = ?, updated_at = ? WHERE id = ?",
+                    (QUEUED, image_bytes, now, now, job_id),
+                )
+                created = True
+            else:
+                job_id, created = row["id"], False
+            conn.execute("COMMIT")
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+        return job_id, created
+
+    def get(self, job_id: str) -> Optional[Dict]:
+        """Return the public fields of a job, or None if it does not exist."""
+        row = (
+            self._connection()
+            .execute(f"SELECT {_PUBLIC_COLUMNS} FROM jobs WHERE id = ?", (job_id,))
+            .fetchone()
+        )
+        if row is None:
+            return None
+        job = dict(row)
+        if job["result"]:
+            job["result"] = json.loads(job["result"])
+        return job
+
+    def claim(self, worker_id: str) -> Optional[Dict]:
+        """
+        Lease the oldest claimable job to `worker_id`.
+
+        Jobs whose lease expired are claimable again; if they already used all
+        attempts they are marked failed instead.
+        """
+        conn = self._connection()
+        while True:
+            now = time.time()
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                row = conn.execute(
+                    "SELECT id, status, attempts, max_attempts, filename, image"
+                    " FROM jobs WHERE (status = ? AND available_at <= ?)"
+                    " OR (status = ? AND lease_expires_at <= ?)"
+                    " ORDER BY created_at LIMIT 1",
+                    (QUEUED, now, RUNNING, now),
+                ).fetchone()
+                if row is None:
+                    conn.execute("COMMIT")
+                    return None
+
+                if row["attempts"] >= row["max_attempts"]:
+                    conn.execute(
+                        "UPDATE jobs SET status = ?, error = ?, image = NULL,"
+                        " lease_owner = NULL, updated_at = ? WHERE id = ?",
+                        (FAILED, "Visibility timeout exceeded", now, row["id"]),
+                    )
+                    conn.execute("COMMIT")
+                    continue
+
+                conn.execute(
+                    "UPDATE jobs SET status = ?, attempts = attempts + 1,"
+                    " lease_owner = ?, lease_expires_at = ?, updated_at = ?"
+                    " WHERE id = ?",
+                    (RUNNING, worker_id, now + self.visibility_timeout, now, row["id"]),
+                )
+                conn.execute("COMMIT")
+            except BaseException:
+                conn.execute("ROLLBACK")
+                raise
+            return dict(row, attempts=row["attempts"] + 1)
+
+    def heartbeat(self, job_id: str, worker_id: str) -> bool:
+        """Extend the lease of a running job; False if the lease was lost."""
+        now = time.time()
+        cursor = self._connection().execute(
+            "UPDATE jobs SET lease_expires_at = ?, updated_at = ?"
+            " WHERE id = ? AND status = ? AND lease_owner = ?",
+            (now + self.visibility_timeout, now, job_id, RUNNING, worker_id),
+        )
+        return cursor.rowcount == 1
+
+    def complete(
+        self, job_id: str, worker_id: str, result: Dict, extracted_text: str
+    ) -> bool:
+        """Store the result of a job still leased to `worker_id`."""
+        cursor = self._connection().execute(
+            "UPDATE jobs SET status = ?, result = ?, extracted_text = ?, error = NULL,"
+            " image = NULL, lease_owner = NULL, updated_at = ?"
+            " WHERE id = ? AND status = ? AND lease_owner = ?",
+            (
+                SUCCEEDED,
+                json.dumps(result),
+                extracted_text,
+                time.time(),
+                job_id,
+                RUNNING,
+                worker_id,
+            ),
+        )
+        return cursor.rowcount == 1
+
+    def fail(self, job_id: str, worker_id: str, error: str, retry: bool = True) -> str:
+        """
+        Record a failed attempt; re-queue with backoff or mark failed.
+
+        Returns the new status, or "" if the lease was lost meanwhile.
+        """
+        conn = self._connection()
+        row = conn.execute(
+            "SELECT attempts, max_attempts FROM jobs"
+            " WHERE id = ? AND status = ? AND lease_owner = ?",
+            (job_id, RUNNING, worker_id),
+        ).fetchone()
+        if row is None:
+            return ""
+
+        # The lease may expire and be claimed by another worker after the
+        # SELECT: only update the job while it is still leased to us
+        now = time.time()
+        if retry and row["attempts"] < row["max_attempts"]:
+            delay = JOB_BACKOFF_BASE_S * 2 ** (row["attempts"] - 1)
+            cursor = conn.execute(
+                "UPDATE jobs SET status = ?, error = ?, available_at = ?,"
+                " lease_owner = NULL, updated_at = ?"
+                " WHERE id = ? AND status = ? AND lease_owner = ?",
+                (QUEUED, error, now + delay, now, job_id, RUNNING, worker_id),
+            )
+            return QUEUED if cursor.rowcount == 1 else ""
+
+        cursor = conn.execute(
+            "UPDATE jobs SET status = ?, error = ?, image = NULL,"
+            " lease_owner = NULL, updated_at = ?"
+            " WHERE id = ? AND status = ? AND lease_owner = ?",
+            (FAILED, error, now, job_id, RUNNING, worker_id),
+        )
+        return FAILED if cursor.rowcount == 1 else ""
+
+    def release_stale_leases(self, node_id: str) -> int:
+        """
+        Re-queue running jobs of `node_id` whose lease expired or whose owner
+        process (`<node_id>:<pid>:<start>:<worker>`) is no longer running.
+        """
+        conn = self._connection()
+        pattern = _like_escape(node_id) + ":%"
+        rows = conn.execute(
+            "SELECT id, lease_owner, lease_expires_at FROM jobs"
+            " WHERE status = ? AND lease_owner LIKE ? ESCAPE '\\'",
+            (RUNNING, pattern),
+        ).fetchall()
+
+        now = time.time()
+        stale = [
+            (row["id"], row["lease_owner"])
+            for row in rows
+            if row["lease_expires_at"] <= now
+            or not _owner_alive(row["lease_owner"][len(node_id) + 1 :])
+        ]
+        released = 0
+        for job_id, owner in stale:
+            # The lease may have been renewed or taken over since the SELECT
+            cursor = conn.execute(
+                "UPDATE jobs SET status = ?, lease_owner = NULL, available_at = ?,"
+                " updated_at = ? WHERE id = ? AND status = ? AND lease_owner = ?",
+                (QUEUED, now, now, job_id, RUNNING, owner),
+            )
+            released += cursor.rowcount
+        if released:
+            logThis.warning("Recovered %d in-flight jobs from %s", released, node_id)
+        return released
+
+    def wait(self, job_id: str, timeout: float, poll_interval: float = 0.5):
+        """Long-poll until the job reaches a terminal status or `timeout`."""
+        deadline = time.monotonic() + timeout
+        job = self.get(job_id)
+        while job and job["status"] not in TERMINAL_STATUSES:
+            if time.monotonic() >= deadline:
+                break
+            time.sleep(poll_interval)
+            job = self.get(job_id)
+        return job
+
+    def subscribe(self, job_id: str, poll_interval: float = 0.5) -> Iterator[Dict]:
+        """Yield the job every time its status changes, until it finishes."""
+        last_state = None
+        while True:
+            job = self.get(job_id)
+            if job is None:
+                return
+            state = (job["status"], job["attempts"])
+            if state != last_state:
+                last_state = state
+                yield job
+            if job["status"] in TERMINAL_STATUSES:
+                return
+            time.sleep(poll_interval)
+
+
+class JobWorker(threading.Thread):
+    """
+    Worker thread that claims jobs and runs `extract_fn(image_bytes)`.
+
+    `extract_fn` returns the (json_result, extracted_text) pair of
+    `process_ocr_to_json`.
+    """
+
+    def __init__(
+        self,
+        job_queue: JobQueue,
+        extract_fn: Callable[[bytes], Tuple[str, str]],
+        worker_id: str,
+        poll_interval: float = 1.0,
+    ):
+        super().__init__(name=f"job-worker-{worker_id}", daemon=True)
+        self.job_queue = job_queue
+        self.extract_fn = extract_fn
+        self.worker_id = worker_id
+        self.poll_interval = poll_interval
+        self._stop_event = threading.Event()
+
+    def stop(self):
+        self._stop_event.set()
+
+    def _keep_lease(self, job_id: str, done: threading.Event):
+        interval = self.job_queue.visibility_timeout / 3
+        while not done.wait(interval):
+            if not self.job_queue.heartbeat(job_id, self.worker_id):
+                return
+
+    def run_job(self, job: Dict):
+        done = threading.Event()
+        threading.Thread(
+            target=self._keep_lease, args=(job["id"], done), daemon=True
+        ).start()
+        try:
+            json_result, extracted_text = self.extract_fn(job["image"])
+            result = json.loads(json_result)
+        except Exception as e:
+            status = self.job_queue.fail(job["id"], self.worker_id, str(e))
+            logThis.warning(
+                "Job %s attempt %s -> %s", job["id"], job["attempts"], status
+            )
+            return
+        finally:
+            done.set()
+
+        if result.get("error"):
+            # Unexpected errors carry an error_type and are worth retrying,
+            # validation errors (no text, bad key) will fail the same way again
+            status = self.job_queue.fail(
+                job["id"],
+                self.worker_id,
+                result["error"],
+                retry="error_type" in result,
+            )
+            logThis.warning(
+                "Job %s attempt %s -> %s", job["id"], job["attempts"], status
+            )
+        else:
+            self.job_queue.complete(job["id"], self.worker_id, result, extracted_text)
+            logThis.info("Job %s succeeded", job["id"])
+
+    def run(self):
+        while not self._stop_event.is_set():
+            job = self.job_queue.claim(self.worker_id)
+            if job is None:
+                self._stop_event.wait(self.poll_interval)
+                continue
+            self.run_job(job)
+
+
+def start_workers(
+    job_queue: JobQueue,
+    extract_fn: Callable[[bytes], Tuple[str, str]],
+    count: int,
+    node_id: str = "",
+):
+    """Recover this node's stale leases and start `count` workers."""
+    node_id = node_id or JOB_NODE_ID or socket.gethostname()
+    job_queue.release_stale_leases(node_id)
+    pid = os.getpid()
+    owner = f"{node_id}:{pid}:{_process_start(pid)}"
+    workers = [JobWorker(job_queue, extract_fn, f"{owner}:{n}") for n in range(count)]
+    for worker in workers:
+        worker.start()
+    return workers
@@ -0,0 +1,94 @@
+"""Filesystem-backed S3 Stand-in
+
+Implements the subset of the boto3 S3 client used by `aws_helper` on top of a
+local directory, so the storage paths can be exercised and benchmarked
+offline. Select it with S3_BACKEND = "local"; objects are stored as
+`S3_LOCAL_ROOT/<bucket>/<key>`.
+"""
+
+import hashlib
+import json
+import os
+import shutil
+import uuid
+from pathlib import Path
+
+from botocore.exceptions import ClientError
+
+
+def _not_found(operation: str, key: str) -> ClientError:
+    return ClientError(
+        {
+            "Error": {"Code": "404", "Message": f"Not Found: {key}"},
+            "ResponseMetadata": {"HTTPStatusCode": 404},
+        },
+        operation,
+    )
+
+
+class LocalS3Client:
+    """Minimal S3 client storing objects under a local root directory."""
+
+    def __init__(self, root: Path):
+        self.root = Path(root)
+
+    def _path(self, bucket: str, key: str) -> Path:
+        path = (self.root / bucket / key).resolve()
+        if self.root.resolve() not in path.parents:
+            raise ValueError(f"Invalid object key: {key}")
+        return path
+
+    def _meta_path(self, bucket: str, key: str) -> Path:
+        return self._path(bucket, ".meta/" + key).with_name(
+            Path(key).name + ".json"
+        )
+
+    def upload_fileobj(self, Fileobj, Bucket, Key, ExtraArgs=None, Config=None):
+        path = self._path(Bucket, Key)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        tmp_path = path.with_name(f".{path.name}.{uuid.uuid4().hex}.part")
+        md5 = hashlib.md5()
+        with open(tmp_path, "wb") as f:
+            for chunk in iter(lambda: Fileobj.read(1024 * 1024), b""):
+                md5.update(chunk)
+                f.write(chunk)
+
+        meta = {
+            "ETag": f'"{md5.hexdigest()}"',
+            "ContentType": (ExtraArgs or {}).get(
+                "ContentType", "binary/octet-stream"
+            ),
+            "Metadata": (ExtraArgs or {}).get("Metadata", {}),
+        }
+        meta_path = self._meta_path(Bucket, Key)
+        meta_path.parent.mkdir(parents=True, exist_ok=True)
+        with open(meta_path, "w", encoding="utf-8") as f:
+            json.dump(meta, f)
+        os.replace(tmp_path, path)
+
+    def head_object(self, Bucket, Key):
+        path = self._path(Bucket, Key)
+        if not path.is_file():
+            raise _not_found("HeadObject", Key)
+        try:
+            with open(self._meta_path(Bucket, Key), encoding="utf-8") as f:
+                meta = json.load(f)
+        except (OSError, json.JSONDecodeError):
+            meta = {"Metadata": {}}
+        return {"ContentLength": path.stat().st_size, **meta}
+
+    def download_fileobj(self, Bucket, Key, Fileobj, ExtraArgs=None, Config=None):
+        path = self._path(Bucket, Key)
+        if not path.is_file():
+            raise _not_found("GetObject", Key)
+        with open(path, "rb") as f:
+            shutil.copyfileobj(f, Fileobj)
+
+    def delete_object(self, Bucket, Key):
+        self._path(Bucket, Key).unlink(missing_ok=True)
+        self._meta_path(Bucket, Key).unlink(missing_ok=True)
+        return {}
+
+    def generate_presigned_url(self, ClientMethod, Params=None, ExpiresIn=3600):
+        """Local objects need no signature; return their file URL."""
+        return self._path(Params["Bucket"], Params["Key"]).as_uri()
@@ -1,4 +1,37 @@
+"""Application Logging
+
+Records are handed to a `QueueHandler` on the calling thread and written to
+stderr by a background `QueueListener`, so an OCR worker never waits on
+terminal or pipe I/O. The queue is bounded; when it is full records are
+dropped and counted rather than blocking the caller; the next record that
+gets through reports how many were lost.
+
+Output format, from the environment (read here, not from `utils.constants`,
+which itself logs while loading):
+
+- LOG_FORMAT: "json" (one object per line), "text", or "auto" (default):
+  JSON in production, text otherwise. Text is colored only on a TTY.
+- LOG_LEVEL: root level, INFO by default.
+- LOG_RATE_LIMIT / LOG_RATE_WINDOW_S: identical messages beyond the limit
+  within the window are suppressed; the next one that gets through reports
+  how many were dropped (default 20 per 60 s).
+
+Log with %-style arguments, `logThis.info("Loaded %s", name)`, so messages
+below the active level are never formatted.
+"""
+
+import atexit
+import copy
+import json
 import logging
+import os
+import queue
+import sys
+import threading
+import time
+from datetime import datetime, timezone
+from logging.handlers import QueueHandler, QueueListener
+from typing import Dict, Optional, Tuple
 
 # Define ANSI color codes
 COLOR_CODES = {
@@ -13,28 +46,206 @@ COLOR_CODES = {
     "default": "",  # No color
 }
 
+TEXT_FORMAT = "%(asctime)s - %(levelname)s: %(message)s"
+DATE_FORMAT = "%Y-%m-%d %H:%M:%S"
+QUEUE_SIZE = 10000
+
+# Attributes every LogRecord has; anything else came in through `extra`
+_RECORD_ATTRIBUTES = set(vars(logging.makeLogRecord({}))) | {"message", "asctime"}
+
 
 class CustomColorFormatter(logging.Formatter):
-    def format(self, record):
-        # Default to white or no color unless 'color' key is present in extra
-        color = COLOR_CODES.get(getattr(record, "color", "default"), "")
-        reset = COLOR_CODES["reset"]
+    """Text formatter; colors level and message when `use_color` is set."""
+
+    def __init__(self, *args, use_color: bool = True, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.use_color = use_color
 
-        record.levelname = f"{color}{record.levelname}{reset}"
-        record.msg = f"{color}{record.msg}{reset}"
+    def format(self, record):
+        suppressed = getattr(record, "suppressed", 0)
+        dropped = getattr(record, "dropped_records", 0)
+        if not self.use_color and not suppressed and not dropped:
+            return super().format(record)
 
+        # Decorate a copy; handlers and filters further on see the original
+        record = logging.makeLogRecord(record.__dict__)
+        record.msg = record.getMessage()
+        record.args = None
+        if suppressed:
+            record.msg += f" ({suppressed} similar messages suppressed)"
+        if dropped:
+            record.msg += f" ({dropped} earlier records dropped, log queue full)"
+        if self.use_color:
+            # Default to white or no color unless 'color' key is present in extra
+            color = COLOR_CODES.get(getattr(record, "color", "default"), "")
+            reset = COLOR_CODES["reset"]
+            record.levelname = f"{color}{record.levelname}{reset}"
+            record.msg = f"{color}{record.msg}{reset}"
         return super().format(record)
 
 
-# Configure logger
-formatter = CustomColorFormatter(
-    fmt="%(asctime)s - %(levelname)s: %(message)s", datefmt="%Y-%m-%d %H:%M:%S"
-)
+class JsonFormatter(logging.Formatter):
+    """One JSON object per record, with `extra` fields as top-level keys."""
+
+    def format(self, record):
+        entry = {
+            "timestamp": datetime.fromtimestamp(
+                record.created, timezone.utc
+            ).isoformat(),
+            "level": record.levelname,
+            "logger": record.name,
+            "message": record.getMessage(),
+            "thread": record.threadName,
+        }
+        for key, value in record.__dict__.items():
+            if key not in _RECORD_ATTRIBUTES and key != "color":
+                entry[key] = value
+        if record.exc_info and not record.exc_text:
+            record.exc_text = self.formatException(record.exc_info)
+        if record.exc_text:
+            entry["exception"] = record.exc_text
+        return json.dumps(entry, default=str, ensure_ascii=False)
+
+
+class RateLimitFilter(logging.Filter):
+    """
+    Let through at most `limit` records per `window_s` seconds for each call site.
+
+    Records are keyed on their unformatted message, so a template logged with
+    changing arguments counts as one message. Past `max_keys`, the keys whose
+    window started longest ago are forgotten first.
+    """
+
+    def __init__(self, limit: int, window_s: float, max_keys: int = 1024):
+        super().__init__()
+        self.limit = limit
+        self.window_s = window_s
+        self.max_keys = max_keys
+        self._lock = threading.Lock()
+        # (logger, level, format string) -> [window start, seen, suppressed],
+        # ordered by window start
+        self._windows: Dict[Tuple[str, int, str], list] = {}
+
+    def filter(self, record):
+        if self.limit <= 0:
+            return True
+        key = (record.name, record.levelno, str(record.msg))
+        now = time.monotonic()
+        with self._lock:
+            window = self._windows.get(key)
+            if window is None or now - window[0] >= self.window_s:
+                suppressed = self._windows.pop(key)[2] if window else 0
+                while len(self._windows) >= self.max_keys:
+                    del self._windows[next(iter(self._windows))]
+                self._windows[key] = [now, 1, 0]
+                if suppressed:
+                    record.suppressed = suppressed
+                return True
+            window[1] += 1
+            if window[1] > self.limit:
+                window[2] += 1
+                return False
+            return True
+
+
+class DroppingQueueHandler(QueueHandler):
+    """
+    QueueHandler that drops records instead of blocking when full.
+
+    `dropped` counts every record lost; the first record queued after a loss
+    carries the number lost since the last report as `dropped_records`.
+    """
+
+    def __init__(self, log_queue: queue.Queue):
+        super().__init__(log_queue)
+        self.dropped = 0
+        self._unreported = 0
+
+    def prepare(self, record):
+        """Merge args into the message here; keep the traceback apart for JSON."""
+        record = copy.copy(record)
+        record.msg = record.getMessage()
+        record.args = None
+        if record.exc_info:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+    def enqueue(self, record):
+        # Called under the handler lock, so the counters need no lock of their own
+        if self._unreported:
+            record.dropped_records = self._unreported
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+            self._unreported += 1
+        else:
+            self._unreported = 0
+
+
+def build_formatter(log_format: Optional[str] = None, stream=None) -> logging.Formatter:
+    """Formatter for `stream` according to LOG_FORMAT and ENVIRONMENT."""
+    log_format = (log_format or os.getenv("LOG_FORMAT", "auto")).lower()
+    if log_format == "auto":
+        production = os.getenv("ENVIRONMENT", "development").lower() == "production"
+        log_format = "json" if production else "text"
+    if log_format == "json":
+        return JsonFormatter()
+
+    stream = stream or sys.stderr
+    use_color = (
+        hasattr(stream, "isatty") and stream.isatty() and "NO_COLOR" not in os.environ
+    )
+    return CustomColorFormatter(
+        fmt=TEXT_FORMAT, datefmt=DATE_FORMAT, use_color=use_color
+    )
+
+
+_listener: Optional[QueueListener] = None
+
+
+def configure_logging(
+    log_format: Optional[str] = None, level: Optional[str] = None, stream=None
+) -> DroppingQueueHandler:
+    """(Re)install the queue handler on the root logger and start the listener."""
+    global _listener
+    if _listener is not None:
+        _listener.stop()
+
+    stream = stream or sys.stderr
+    output = logging.StreamHandler(stream)
+    output.setFormatter(build_formatter(log_format, stream))
+
+    queue_handler = DroppingQueueHandler(queue.Queue(QUEUE_SIZE))
+    queue_handler.addFilter(
+        RateLimitFilter(
+            limit=int(os.getenv("LOG_RATE_LIMIT", "20")),
+            window_s=float(os.getenv("LOG_RATE_WINDOW_S", "60")),
+        )
+    )
+
+    logging.root.handlers.clear()
+    logging.basicConfig(
+        level=(level or os.getenv("LOG_LEVEL", "INFO")).upper(),
+        handlers=[queue_handler],
+        force=True,
+    )
+
+    _listener = QueueListener(queue_handler.queue, output, respect_handler_level=True)
+    _listener.start()
+    return queue_handler
+
+
+def stop_logging() -> None:
+    """Flush queued records and stop the listener thread."""
+    global _listener
+    if _listener is not None:
+        _listener.stop()
+        _listener = None
 
-handler = logging.StreamHandler()
-handler.setFormatter(formatter)
 
-logging.root.handlers.clear()
-logging.basicConfig(level=logging.INFO, handlers=[handler], force=True)
+configure_logging()
+atexit.register(stop_logging)
 
 logThis = logging.getLogger(__name__)
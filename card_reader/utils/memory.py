@@ -0,0 +1,247 @@
+"""Memory Accounting Utility
+
+Optional per-stage memory accounting for the OCR pipeline and a guard that
+checks the projected peak memory of an input from its header dimensions before
+the pixels are decoded.
+
+Stage accounting is enabled with MEMORY_PROFILING. Each stage records its
+elapsed time, the process RSS before/after, and the peak of Python/NumPy
+allocations seen by tracemalloc while the stage ran. Results are logged, kept
+in `memory_data` and attached to the active trace span.
+"""
+
+import functools
+import os
+import time
+import tracemalloc
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Dict, List, Tuple
+
+import cv2
+import numpy as np
+
+from utils.constants import MEMORY_BUDGET_MB, MEMORY_GUARD_MODE, MEMORY_PROFILING
+from utils.logger import logThis
+from utils.tracing import current_span
+
+try:
+    import psutil
+
+    _process = psutil.Process()
+except ImportError:  # psutil is optional
+    _process = None
+
+MB = 1024 * 1024
+
+# Dictionary to store per-stage memory samples
+memory_data: Dict[str, List[dict]] = {}
+
+# Bytes per pixel held at the same time by preprocess_image: the decoded PIL
+# buffer, its NumPy copy, the BGR copy and the grayscale plane.
+_PEAK_COPIES_PER_BAND = 2
+_PEAK_EXTRA_BYTES_PER_PIXEL = 3 + 1
+
+_MODE_BANDS = {
+    "1": 1,
+    "L": 1,
+    "P": 1,
+    "LA": 2,
+    "RGB": 3,
+    "YCbCr": 3,
+    "RGBA": 4,
+    "CMYK": 4,
+}
+
+# Running tracemalloc peak of the enclosing stages
+_peak_stack: ContextVar[Tuple[list, ...]] = ContextVar("peak_stack", default=())
+
+
+class MemoryBudgetError(ValueError):
+    """Raised when an input image would exceed the configured memory budget."""
+
+    pass
+
+
+def current_rss_bytes() -> int:
+    """Return the resident set size of this process in bytes (0 if unknown)."""
+    if _process is not None:
+        return _process.memory_info().rss
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, IndexError):
+        return 0
+
+
+@contextmanager
+def measure_stage(name: str):
+    """Record time, RSS and tracemalloc peak for the enclosed stage."""
+    if not MEMORY_PROFILING:
+        yield
+        return
+
+    if not tracemalloc.is_tracing():
+        tracemalloc.start()
+
+    # Fold the peak reached so far into every enclosing stage before resetting
+    stack = _peak_stack.get()
+    peak_so_far = tracemalloc.get_traced_memory()[1]
+    for running_peak in stack:
+        running_peak[0] = max(running_peak[0], peak_so_far)
+    tracemalloc.reset_peak()
+
+    running_peak = [0]
+    token = _peak_stack.set(stack + (running_peak,))
+    rss_before = current_rss_bytes()
+    traced_before = tracemalloc.get_traced_memory()[0]
+    start_time = time.perf_counter()
+    try:
+        yield
+    finally:
+        elapsed = time.perf_counter() - start_time
+        peak = max(running_peak[0], tracemalloc.get_traced_memory()[1])
+        _peak_stack.reset(token)
+        for enclosing_peak in stack:
+            enclosing_peak[0] = max(enclosing_peak[0], peak)
+        rss_after = current_rss_bytes()
+
+        sample = {
+            "elapsed_s": round(elapsed, 4),
+            "rss_mb": round(rss_after / MB, 1),
+            "rss_delta_mb": round((rss_after - rss_before) / MB, 1),
+            "py_peak_mb": round(max(peak - traced_before, 0) / MB, 1),
+        }
+        memory_data.setdefault(name, []).append(sample)
+        current_span().set_attributes(
+            {f"memory.{key}": value for key, value in sample.items()}
+        )
+        logThis.info(
+            "%s took %.4f seconds, rss %s MB (%+.1f MB), python peak %s MB",
+            name,
+            sample["elapsed_s"],
+            sample["rss_mb"],
+            sample["rss_delta_mb"],
+            sample["py_peak_mb"],
+            extra={"color": "cyan"},
+        )
+
+
+def track_memory(name=None):
+    """Decorator form of `measure_stage`."""
+
+    def decorator(func):
+        stage_name = name or func.__name__
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            with measure_stage(stage_name):
+                return func(*args, **kwargs)
+
+        return wrapper
+
+    return decorator
+
+
+def projected_peak_bytes(width: int, height: int, bands: int = 3) -> int:
+    """Estimate the peak bytes preprocessing needs for an image of this size."""
+    pixels = width * height
+    return pixels * (bands * _PEAK_COPIES_PER_BAND + _PEAK_EXTRA_BYTES_PER_PIXEL)
+
+
+def budget_scale(width: int, height: int, bands: int = 3) -> int:
+    """
+    Return the integer downscale factor needed to fit the memory budget.
+
+    1 means the image fits as-is (or no budget is configured).
+    """
+    if MEMORY_BUDGET_MB <= 0:
+        return 1
+    budget = MEMORY_BUDGET_MB * MB
+    scale = 1
+    while projected_peak_bytes(width // scale, height // scale, bands) > budget:
+        scale *= 2
+    return scale
+
+
+def guard_dimensions(width: int, height: int, bands: int = 3) -> int:
+    """
+    Check header dimensions against the memory budget.
+
+    Returns the downscale factor to apply (1 when the image fits), or raises
+    MemoryBudgetError when MEMORY_GUARD_MODE is "reject".
+    """
+    scale = budget_scale(width, height, bands)
+    if scale == 1:
+        return 1
+
+    projected_mb = projected_peak_bytes(width, height, bands) / MB
+    if MEMORY_GUARD_MODE == "reject":
+        raise MemoryBudgetError(
+            f"Image {width}x{height} needs ~{projected_mb:.0f} MB, "
+            f"budget is {MEMORY_BUDGET_MB} MB"
+        )
+
+    logThis.warning(
+        "Image %dx%d needs ~%.0f MB, downscaling by %s to fit the %s MB budget",
+        width,
+        height,
+        projected_mb,
+        scale,
+        MEMORY_BUDGET_MB,
+    )
+    return scale
+
+
+def guard_decode(width: int, height: int, bands: int = 1) -> None:
+    """
+    Reject a decode whose output buffer alone would exceed the memory budget.
+
+    For decoders that cannot scale down (or not far enough) the image is
+    downscaled after decoding, so at least the decoded buffer has to fit.
+    """
+    if MEMORY_BUDGET_MB <= 0:
+        return
+    decoded_mb = width * height * bands / MB
+    if decoded_mb > MEMORY_BUDGET_MB:
+        raise MemoryBudgetError(
+            f"Decoding {width}x{height} needs ~{decoded_mb:.0f} MB, "
+            f"budget is {MEMORY_BUDGET_MB} MB"
+        )
+
+
+def guard_image(image):
+    """
+    Check a PIL image against the memory budget using its header dimensions.
+
+    Depending on MEMORY_GUARD_MODE the image is either downscaled (JPEG draft
+    mode when the pixels are not decoded yet, otherwise an integer reduce) or
+    rejected with MemoryBudgetError. An already decoded NumPy array is checked
+    by its shape and downscaled with an area resize.
+    """
+    if isinstance(image, np.ndarray):
+        height, width = image.shape[:2]
+        bands = image.shape[2] if image.ndim == 3 else 1
+        scale = guard_dimensions(width, height, bands)
+        if scale == 1:
+            return image
+        return cv2.resize(
+            image,
+            (max(1, width // scale), max(1, height // scale)),
+            interpolation=cv2.INTER_AREA,
+        )
+
+    width, height = image.size
+    bands = _MODE_BANDS.get(image.mode, 3)
+    scale = guard_dimensions(width, height, bands)
+    if scale == 1:
+        return image
+
+    target = (width // scale, height // scale)
+    if image.format == "JPEG" and getattr(image, "tile", None):
+        # Pixels not decoded yet: let libjpeg scale in the DCT domain
+        image.draft(image.mode, target)
+        scale = budget_scale(*image.size, bands)
+        if scale == 1:
+            return image
+    return image.reduce(scale)
@@ -0,0 +1,373 @@
+"""Header-Only Image Metadata Index
+
+Walks an image folder and records, per file, what its header and EXIF block
+say: format, dimensions, `ImageUniqueID`, orientation and GPS position.
+`Image.open` only parses headers and EXIF comes from the raw block in
+`image.info`, so no pixels are ever decoded.
+
+The index is a SQLite table keyed by path. A file is read again only when its
+mtime or size changed, so re-scanning a large, mostly unchanged folder costs
+little more than listing it. Rows of deleted files are dropped.
+
+`write_unique_id` sets the `ImageUniqueID` tag of a JPEG by splicing a new
+APP1 (EXIF) segment into the file; the compressed image data is copied byte
+for byte. Other formats have no such path and are left to
+`ExifHandler.add_exif_data`.
+
+Index a folder:
+
+    cd card_reader
+    python -m utils.metadata_index assets/images/uploaded
+"""
+
+import argparse
+import io
+import os
+import sqlite3
+import struct
+import time
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import astuple, dataclass, fields
+from pathlib import Path
+from typing import Dict, Iterator, List, Optional, Tuple
+
+from PIL import Image, UnidentifiedImageError
+
+from utils.constants import (
+    ALLOWED_EXTENSIONS,
+    METADATA_INDEX_PATH,
+    METADATA_INDEX_WORKERS,
+)
+from utils.logger import logThis
+
+# EXIF tags and IFDs
+_ORIENTATION = 0x0112
+_EXIF_IFD = 0x8769
+_GPS_IFD = 0x8825
+_IMAGE_UNIQUE_ID = 0xA420
+
+# JPEG markers
+_SOI = b"\xff\xd8"
+_APP1 = 0xE1
+_SOS = 0xDA
+_EXIF_HEADER = b"Exif\x00\x00"
+# A segment length field covers itself and at most 65533 payload bytes
+_MAX_SEGMENT_PAYLOAD = 0xFFFF - 2
+# Below this many changed files, starting worker processes costs more than it saves
+_PARALLEL_MIN_FILES = 256
+
+
+@dataclass
+class ImageMetadata:
+    """One row of the metadata index."""
+
+    path: str
+    mtime_ns: int
+    size: int
+    format: Optional[str] = None
+    width: Optional[int] = None
+    height: Optional[int] = None
+    orientation: Optional[int] = None
+    unique_id: Optional[str] = None
+    gps_latitude: Optional[float] = None
+    gps_longitude: Optional[float] = None
+    error: Optional[str] = None
+
+
+_COLUMNS = [f.name for f in fields(ImageMetadata)]
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS image_metadata (
+    path          TEXT PRIMARY KEY,
+    mtime_ns      INTEGER NOT NULL,
+    size          INTEGER NOT NULL,
+    format        TEXT,
+    width         INTEGER,
+    height        INTEGER,
+    orientation   INTEGER,
+    unique_id     TEXT,
+    gps_latitude  REAL,
+    gps_longitude REAL,
+    error         TEXT
+);
+CREATE INDEX IF NOT EXISTS image_metadata_unique_id
+    ON image_metadata (unique_id);
+"""
+
+
+def _header_exif(image: Image.Image) -> Image.Exif:
+    """EXIF of an opened image, parsed from its raw block only."""
+    exif = Image.Exif()
+    raw = image.info.get("exif")
+    if raw:
+        exif.load(raw)
+    elif image.format == "TIFF":
+        # TIFF tags are part of the header Pillow has already read
+        exif = image.getexif()
+    return exif
+
+
+def _gps_degrees(value, reference) -> Optional[float]:
+    """Decimal degrees of an EXIF (degrees, minutes, seconds) triple."""
+    try:
+        degrees, minutes, seconds = (float(part) for part in value)
+    except (TypeError, ValueError, ZeroDivisionError):
+        return None
+    decimal = degrees + minutes / 60 + seconds / 3600
+    return -decimal if reference in ("S", "W") else decimal
+
+
+def _text(value) -> Optional[str]:
+    if isinstance(value, bytes):
+        value = value.decode("ascii", "ignore")
+    if not isinstance(value, str):
+        return None
+    return value.strip("\x00 ") or None
+
+
+def read_metadata(path: Path, stat: Optional[os.stat_result] = None) -> ImageMetadata:
+    """Read header metadata of one image without decoding its pixels."""
+    stat = stat or path.stat()
+    metadata = ImageMetadata(str(path), stat.st_mtime_ns, stat.st_size)
+    try:
+        with Image.open(path) as image:
+            metadata.format = image.format
+            metadata.width, metadata.height = image.size
+            exif = _header_exif(image)
+    except (OSError, UnidentifiedImageError, SyntaxError, ValueError) as e:
+        metadata.error = f"{type(e).__name__}: {e}"
+        return metadata
+
+    metadata.orientation = exif.get(_ORIENTATION)
+    # add_exif_data writes the id into IFD0; cameras use the Exif IFD
+    metadata.unique_id = _text(
+        exif.get(_IMAGE_UNIQUE_ID) or exif.get_ifd(_EXIF_IFD).get(_IMAGE_UNIQUE_ID)
+    )
+    gps = exif.get_ifd(_GPS_IFD)
+    if 2 in gps and 4 in gps:
+        metadata.gps_latitude = _gps_degrees(gps[2], _text(gps.get(1)))
+        metadata.gps_longitude = _gps_degrees(gps[4], _text(gps.get(3)))
+    return metadata
+
+
+def _walk(folder: Path) -> Iterator[Tuple[str, os.stat_result]]:
+    """Path and stat of every image file under `folder`, using scandir."""
+    pending = [str(folder)]
+    while pending:
+        try:
+            with os.scandir(pending.pop()) as entries:
+                for entry in entries:
+                    if entry.is_dir(follow_symlinks=False):
+                        pending.append(entry.path)
+                    elif (
+                        entry.is_file()
+                        and entry.name.rsplit(".", 1)[-1].lower() in ALLOWED_EXTENSIONS
+                    ):
+                        yield entry.path, entry.stat()
+        except OSError as e:
+            logThis.warning("Cannot list %s: %s", e.filename, e)
+
+
+@dataclass
+class ScanResult:
+    """Counts of one `MetadataIndex.scan`."""
+
+    files: int
+    indexed: int
+    unchanged: int
+    removed: int
+    failed: int
+    seconds: float
+
+
+class MetadataIndex:
+    """Incremental SQLite index of image header metadata."""
+
+    def __init__(
+        self, db_path: Path = METADATA_INDEX_PATH, workers: int = METADATA_INDEX_WORKERS
+    ):
+        self.db_path = Path(db_path)
+        self.db_path.parent.mkdir(parents=True, exist_ok=True)
+        self.workers = workers
+        with self._connect() as conn:
+            conn.executescript(_SCHEMA)
+
+    def _connect(self) -> sqlite3.Connection:
+        conn = sqlite3.connect(self.db_path, timeout=30)
+        conn.execute("PRAGMA journal_mode=WAL")
+        return conn
+
+    def _read_all(
+        self, changed: List[Tuple[Path, os.stat_result]]
+    ) -> List[ImageMetadata]:
+        """Read headers of the changed files, in parallel when there are many."""
+        if len(changed) < _PARALLEL_MIN_FILES or self.workers <= 1:
+            return [read_metadata(path, stat) for path, stat in changed]
+
+        # Header parsing holds the GIL; processes scale where threads do not
+        paths, stats = zip(*changed)
+        chunksize = max(1, len(changed) // (self.workers * 8))
+        with ProcessPoolExecutor(max_workers=self.workers) as executor:
+            return list(executor.map(read_metadata, paths, stats, chunksize=chunksize))
+
+    def scan(self, folder: Path) -> ScanResult:
+        """Bring the index of `folder` up to date, reading only changed files."""
+        start_time = time.perf_counter()
+        folder = Path(folder).resolve()
+        prefix = str(folder) + os.sep
+
+        with self._connect() as conn:
+            known: Dict[str, Tuple[int, int]] = {
+                path: (mtime_ns, size)
+                for path, mtime_ns, size in conn.execute(
+                    "SELECT path, mtime_ns, size FROM image_metadata"
+                    " WHERE substr(path, 1, ?) = ?",
+                    (len(prefix), prefix),
+                )
+            }
+
+        changed: List[Tuple[Path, os.stat_result]] = []
+        seen = 0
+        for path, stat in _walk(folder):
+            seen += 1
+            if known.pop(path, None) != (stat.st_mtime_ns, stat.st_size):
+                changed.append((Path(path), stat))
+
+        rows = self._read_all(changed)
+
+        placeholders = ", ".join("?" * len(_COLUMNS))
+        with self._connect() as conn:
+            conn.executemany(
+                f"INSERT OR REPLACE INTO image_metadata ({', '.join(_COLUMNS)})"
+                f" VALUES ({placeholders})",
+                (astuple(row) for row in rows),
+            )
+            # Whatever is left in `known` no longer exists on disk
+            conn.executemany(
+                "DELETE FROM image_metadata WHERE path = ?",
+                ((path,) for path in known),
+            )
+
+        result = ScanResult(
+            files=seen,
+            indexed=len(rows),
+            unchanged=seen - len(rows),
+            removed=len(known),
+            failed=sum(row.error is not None for row in rows),
+            seconds=time.perf_counter() - start_time,
+        )
+        logThis.info(
+            "Indexed %s: %d files, %d read, %d unchanged, %d removed in %.2fs",
+            folder,
+            result.files,
+            result.indexed,
+            result.unchanged,
+            result.removed,
+            result.seconds,
+        )
+        return result
+
+    def get(self, path: Path) -> Optional[ImageMetadata]:
+        with self._connect() as conn:
+            row = conn.execute(
+                f"SELECT {', '.join(_COLUMNS)} FROM image_metadata WHERE path = ?",
+                (str(Path(path).resolve()),),
+            ).fetchone()
+        return ImageMetadata(*row) if row else None
+
+    def find_unique_id(self, unique_id: str) -> List[str]:
+        """Paths of indexed images carrying this ImageUniqueID."""
+        with self._connect() as conn:
+            return [
+                path
+                for (path,) in conn.execute(
+                    "SELECT path FROM image_metadata WHERE unique_id = ?",
+                    (unique_id,),
+                )
+            ]
+
+
+def _jpeg_segments(data: bytes) -> Iterator[Tuple[int, int, int]]:
+    """(marker, start, end) of each JPEG header segment up to start of scan."""
+    if not data.startswith(_SOI):
+        raise ValueError("Not a JPEG file")
+    offset = len(_SOI)
+    while offset + 4 <= len(data):
+        if data[offset] != 0xFF:
+            raise ValueError(f"Corrupt JPEG marker at byte {offset}")
+        marker = data[offset + 1]
+        if marker == 0xFF:
+            # Fill byte before a marker
+            offset += 1
+            continue
+        if marker == _SOS:
+            return
+        (length,) = struct.unpack(">H", data[offset + 2 : offset + 4])
+        yield marker, offset, offset + 2 + length
+        offset += 2 + length
+    raise ValueError("JPEG ends before the image data")
+
+
+def splice_jpeg_exif(data: bytes, exif: Image.Exif) -> bytes:
+    """Replace (or insert) the EXIF segment of JPEG `data`, keeping the rest."""
+    payload = exif.tobytes()
+    if not payload.startswith(_EXIF_HEADER):
+        payload = _EXIF_HEADER + payload
+    if len(payload) > _MAX_SEGMENT_PAYLOAD:
+        raise ValueError("EXIF block does not fit in one APP1 segment")
+    segment = b"\xff" + bytes([_APP1]) + struct.pack(">H", len(payload) + 2) + payload
+
+    insert_at = len(_SOI)
+    for marker, start, end in _jpeg_segments(data):
+        if marker == _APP1 and data[start + 4 : start + 10] == _EXIF_HEADER:
+            return data[:start] + segment + data[end:]
+        if marker == 0xE0:
+            # Keep JFIF (APP0) first, as readers expect
+            insert_at = end
+    return data[:insert_at] + segment + data[insert_at:]
+
+
+def write_unique_id(path: Path, unique_id: str) -> bool:
+    """
+    Set ImageUniqueID of a JPEG without re-encoding it.
+
+    Returns False when the format has no lossless path; the file is then
+    left untouched.
+    """
+    path = Path(path)
+    data = path.read_bytes()
+    with Image.open(io.BytesIO(data)) as image:
+        if image.format not in ("JPEG", "MPO"):
+            return False
+        exif = _header_exif(image)
+
+    exif[_IMAGE_UNIQUE_ID] = unique_id
+    spliced = splice_jpeg_exif(data, exif)
+
+    tmp_path = path.with_name(f".{path.name}.part")
+    tmp_path.write_bytes(spliced)
+    os.replace(tmp_path, path)
+    return True
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(
+        description="Index header metadata of every image under a folder."
+    )
+    parser.add_argument("folder", type=Path)
+    parser.add_argument("--workers", type=int, default=METADATA_INDEX_WORKERS)
+    parser.add_argument("--db", type=Path, default=METADATA_INDEX_PATH)
+    args = parser.parse_args(argv)
+
+    index = MetadataIndex(args.db, args.workers)
+    for label in ("first scan", "rescan"):
+        result = index.scan(args.folder)
+        print(
+            f"{label:<10} {result.files} files, {result.indexed} read,"
+            f" {result.unchanged} unchanged, {result.removed} removed,"
+            f" {result.failed} failed in {result.seconds:.2f}s"
+        )
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
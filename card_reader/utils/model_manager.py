@@ -2,21 +2,68 @@
 
 This module handles downloading and caching of model files from various sources including
 private GitHub repositories.
+
+GitHub assets are downloaded into `<name>.part` with parallel HTTP Range requests,
+verified against the expected SHA-256 and only then renamed into place, so a file at
+the final path is always complete. An interrupted download resumes from the ranges
+already on disk (tracked in `<name>.part.json`). The asset API redirect is resolved
+once per download and the ranges go straight to the storage URL, so a download costs
+one API request rather than one per range.
+
+A cached file is trusted when the manifest recorded it as verified and it has not
+changed since. Any other file at the final path (say, a truncated download from an
+older version) is checked against the size of the release asset, and its digest
+when one is known, before it is used.
 """
 
+import hashlib
+import json
+import math
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
+from typing import Callable, Optional, Set, Tuple
+from urllib.parse import urljoin
 
 from huggingface_hub import hf_hub_download
 import requests
 from utils.logger import logThis
-from utils.constants import CACHE_DIR, GITHUB_TOKEN, MODELS
+from utils.constants import (
+    CACHE_DIR,
+    GITHUB_TOKEN,
+    MODEL_DOWNLOAD_BLOCK_MB,
+    MODEL_DOWNLOAD_CONNECTIONS,
+    MODEL_MANIFEST,
+    MODELS,
+)
+
+MB = 1024 * 1024
+
+
+class RangeNotSupported(Exception):
+    """The server ignored a Range header and answered with the whole file."""
+
+
+def file_sha256(path: Path) -> str:
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(MB), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
 
 
 class ModelManager:
-    def __init__(self):
+    def __init__(
+        self,
+        connections: int = MODEL_DOWNLOAD_CONNECTIONS,
+        block_size: int = MODEL_DOWNLOAD_BLOCK_MB * MB,
+    ):
         """Initialize the model manager with cache directory setup."""
         self.cache_dir = CACHE_DIR
         self.cache_dir.mkdir(parents=True, exist_ok=True)
+        self.connections = connections
+        self.block_size = block_size
         self.headers = (
             {
                 "Authorization": f"token {GITHUB_TOKEN}",
@@ -25,6 +72,246 @@ class ModelManager:
             if GITHUB_TOKEN
             else {}
         )
+        self._manifest_lock = threading.Lock()
+
+    # --- Manifest of verified downloads ---
+
+    def _load_manifest(self) -> dict:
+        try:
+            with open(MODEL_MANIFEST, encoding="utf-8") as f:
+                return json.load(f)
+        except (OSError, json.JSONDecodeError):
+            return {}
+
+    def _record_verified(self, name: str, model_path: Path, sha256: str) -> None:
+        stat = model_path.stat()
+        with self._manifest_lock:
+            manifest = self._load_manifest()
+            manifest[name] = {
+                "size": stat.st_size,
+                "mtime_ns": stat.st_mtime_ns,
+                "sha256": sha256,
+            }
+            tmp_path = MODEL_MANIFEST.with_suffix(".tmp")
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                json.dump(manifest, f, indent=2)
+            os.replace(tmp_path, MODEL_MANIFEST)
+
+    def _is_cached(self, name: str, model_path: Path) -> bool:
+        """A cached file counts only if it matches its verified manifest entry."""
+        if not model_path.exists():
+            return False
+        stat = model_path.stat()
+        entry = self._load_manifest().get(name)
+        expected = MODELS[name].get("sha256")
+        return bool(
+            entry
+            and entry["size"] == stat.st_size
+            and entry.get("mtime_ns") == stat.st_mtime_ns
+            and (not expected or entry["sha256"] == expected)
+        )
+
+    def _verify_cached(
+        self, name: str, model_path: Path, size: int, sha256: Optional[str]
+    ) -> bool:
+        """
+        Check an unverified file at the final path against the release asset.
+
+        It is recorded as verified only if its size matches and, when a digest
+        is known, its SHA-256 too; otherwise it is deleted.
+        """
+        if not model_path.exists():
+            return False
+        actual_size = model_path.stat().st_size
+        if actual_size != size:
+            logThis.warning(
+                "Cached %s has %d bytes, the release asset %d; downloading it again",
+                name,
+                actual_size,
+                size,
+            )
+            model_path.unlink()
+            return False
+
+        logThis.info("Verifying cached %s...", name)
+        actual_sha256 = file_sha256(model_path)
+        if sha256 and actual_sha256 != sha256:
+            logThis.warning("Cached %s is corrupted, downloading it again", name)
+            model_path.unlink()
+            return False
+        if not sha256:
+            logThis.warning("No checksum published for %s, size matches", name)
+        self._record_verified(name, model_path, actual_sha256)
+        return True
+
+    # --- Ranged download into <name>.part ---
+
+    def _resolve(self, url, headers) -> Tuple[str, dict]:
+        """
+        Follow the asset URL's redirect once; (storage URL, headers) to use.
+
+        The storage URL is pre-signed, so the API token is not sent to it.
+        """
+        probe_headers = {**headers, "Range": "bytes=0-0"}
+        with requests.get(
+            url, headers=probe_headers, allow_redirects=False, stream=True, timeout=30
+        ) as r:
+            if r.is_redirect:
+                location = urljoin(url, r.headers["Location"])
+                storage_headers = {
+                    key: value
+                    for key, value in headers.items()
+                    if key.lower() != "authorization"
+                }
+                return location, storage_headers
+            r.raise_for_status()
+        return url, headers
+
+    def _fetch_block(self, url, headers, part_path: Path, index, size) -> None:
+        start = index * self.block_size
+        end = min(start + self.block_size, size) - 1
+        block_headers = {**headers, "Range": f"bytes={start}-{end}"}
+        with requests.get(
+            url, headers=block_headers, stream=True, timeout=60
+        ) as r, open(part_path, "r+b") as f:
+            r.raise_for_status()
+            if r.status_code != 206:
+                raise RangeNotSupported(url)
+            f.seek(start)
+            for chunk in r.iter_content(chunk_size=MB):
+                f.write(chunk)
+            offset = f.tell()
+            f.flush()
+            os.fsync(f.fileno())
+        if offset != end + 1:
+            raise requests.RequestException(
+                f"Range {start}-{end} ended early at byte {offset}"
+            )
+
+    def _download_ranges(
+        self,
+        url,
+        headers,
+        size,
+        part_path: Path,
+        refresh: Optional[Callable[[], Tuple[str, dict]]] = None,
+    ) -> None:
+        """
+        Fill `part_path` with parallel Range requests, resuming finished blocks.
+
+        When a range is refused with 401/403 (an expired pre-signed URL),
+        `refresh` resolves a new (url, headers) and the range is retried once.
+        """
+        state_path = part_path.with_name(part_path.name + ".json")
+        blocks = max(1, math.ceil(size / self.block_size))
+        done: Set[int] = set()
+        try:
+            with open(state_path, encoding="utf-8") as f:
+                state = json.load(f)
+            if (
+                state["size"] == size
+                and state["block_size"] == self.block_size
+                and part_path.exists()
+            ):
+                done = set(state["done"])
+        except (OSError, json.JSONDecodeError, KeyError):
+            pass
+
+        if done:
+            logThis.info(
+                "Resuming %s: %d of %d ranges on disk",
+                part_path.name,
+                len(done),
+                blocks,
+            )
+        else:
+            with open(part_path, "wb") as f:
+                f.truncate(size)
+
+        lock = threading.Lock()
+        target = [url, headers]
+
+        def save_state():
+            with open(state_path, "w", encoding="utf-8") as f:
+                json.dump(
+                    {"size": size, "block_size": self.block_size, "done": sorted(done)},
+                    f,
+                )
+
+        def fetch(index):
+            used = tuple(target)
+            try:
+                self._fetch_block(*used, part_path, index, size)
+            except requests.HTTPError as e:
+                status = e.response.status_code if e.response is not None else 0
+                if refresh is None or status not in (401, 403):
+                    raise
+                with lock:
+                    if tuple(target) == used:
+                        target[:] = refresh()
+                    retry = tuple(target)
+                self._fetch_block(*retry, part_path, index, size)
+            # Recorded only once the range is on disk
+            with lock:
+                done.add(index)
+                save_state()
+
+        todo = [i for i in range(blocks) if i not in done]
+        with ThreadPoolExecutor(max_workers=self.connections) as executor:
+            # list() re-raises the first failed range
+            list(executor.map(fetch, todo))
+        state_path.unlink(missing_ok=True)
+
+    def _download_stream(self, url, headers, part_path: Path) -> None:
+        """Single sequential download for servers without Range support."""
+        with requests.get(url, headers=headers, stream=True, timeout=60) as r:
+            r.raise_for_status()
+            with open(part_path, "wb") as f:
+                for chunk in r.iter_content(chunk_size=MB):
+                    f.write(chunk)
+                f.flush()
+                os.fsync(f.fileno())
+        part_path.with_name(part_path.name + ".json").unlink(missing_ok=True)
+
+    def fetch_file(
+        self, url: str, headers: dict, size: int, model_path: Path, sha256: Optional[str]
+    ) -> Path:
+        """Download `url` to `model_path` via a verified `.part` file."""
+        if size <= 0:
+            raise RuntimeError(f"Release asset {model_path.name} is empty")
+        part_path = model_path.with_name(model_path.name + ".part")
+        storage_url, storage_headers = self._resolve(url, headers)
+        try:
+            self._download_ranges(
+                storage_url,
+                storage_headers,
+                size,
+                part_path,
+                refresh=lambda: self._resolve(url, headers),
+            )
+        except RangeNotSupported:
+            logThis.warning("Server ignores Range requests, downloading in one stream")
+            self._download_stream(url, headers, part_path)
+
+        actual_size = part_path.stat().st_size
+        if actual_size != size or actual_size == 0:
+            part_path.unlink()
+            raise RuntimeError(
+                f"Downloaded {model_path.name} has {actual_size} bytes, expected {size}"
+            )
+        actual_sha256 = file_sha256(part_path)
+        if sha256 and actual_sha256 != sha256:
+            part_path.unlink()
+            raise RuntimeError(
+                f"Checksum mismatch for {model_path.name}: "
+                f"expected {sha256}, got {actual_sha256}"
+            )
+        if not sha256:
+            logThis.warning("No checksum published for %s", model_path.name)
+
+        os.replace(part_path, model_path)
+        self._record_verified(model_path.name, model_path, actual_sha256)
+        return model_path
 
     def download_model(self, name: str) -> Path:
         """Ensure the model file is available locally and return its path."""
@@ -35,7 +322,7 @@ class ModelManager:
 
         if model_info["source"] == "hf":
             logThis.info(
-                f"Fetching {name} from Hugging Face Hub ({model_info['repo']})…"
+                "Fetching %s from Hugging Face Hub (%s)…", name, model_info["repo"]
             )
             path = Path(
                 hf_hub_download(
@@ -43,20 +330,22 @@ class ModelManager:
                     filename=name,
                 )
             )
-            logThis.info(f"✔ {name} available at {path}")
+            logThis.info("✔ %s available at %s", name, path)
             return path
 
         elif model_info["source"] == "github":
             api_url = model_info["api_url"]
             filename = name
 
-            if not model_path.exists():
-                logThis.info(f"⬇ Downloading {filename} from GitHub release...")
+            if not self._is_cached(name, model_path):
+                logThis.info("⬇ Downloading %s from GitHub release...", filename)
 
                 try:
 
-                    logThis.info(f"Getting release info from API: {api_url}")
-                    api_response = requests.get(api_url, headers=self.headers)
+                    logThis.info("Getting release info from API: %s", api_url)
+                    api_response = requests.get(
+                        api_url, headers=self.headers, timeout=30
+                    )
                     api_response.raise_for_status()
                     release_data = api_response.json()
 
@@ -73,46 +362,52 @@ class ModelManager:
                         raise ValueError(f"Asset '{filename}' not found in release")
 
                     logThis.info(
-                        f"Found asset: {target_asset['name']} ({target_asset['size']} bytes)"
+                        "Found asset: %s (%s bytes)",
+                        target_asset["name"],
+                        target_asset["size"],
                     )
 
-                    # Step 2: Download the asset using asset API
+                    # Step 2: Expected checksum from the manifest, else the release
+                    sha256 = model_info.get("sha256")
+                    digest = target_asset.get("digest") or ""
+                    if not sha256 and digest.startswith("sha256:"):
+                        sha256 = digest.split(":", 1)[1]
+
+                    # Step 3: A file left at the final path must match the asset
+                    if self._verify_cached(
+                        name, model_path, target_asset["size"], sha256
+                    ):
+                        logThis.info("✔ %s already cached at %s", filename, model_path)
+                        return model_path
+
+                    # Step 4: Download the asset using asset API
                     download_headers = self.headers.copy()
                     download_headers["Accept"] = "application/octet-stream"
 
-                    logThis.info(f"Downloading from asset API: {target_asset['url']}")
-                    with requests.get(
+                    logThis.info("Downloading from asset API: %s", target_asset["url"])
+                    self.fetch_file(
                         target_asset["url"],
-                        headers=download_headers,
-                        stream=True,
-                        timeout=60,
-                    ) as r:
-                        r.raise_for_status()
-
-                        # Step 3: Write file in chunks
-                        with open(model_path, "wb") as f:
-                            for chunk in r.iter_content(chunk_size=8192):
-                                if chunk:
-                                    f.write(chunk)
-
-                    # Step 4: Verify file
-                    if model_path.stat().st_size == 0:
-                        model_path.unlink()
-                        raise RuntimeError(f"Downloaded file {filename} is empty")
+                        download_headers,
+                        target_asset["size"],
+                        model_path,
+                        sha256,
+                    )
 
                     logThis.info(
-                        f"✔ Download complete, cached at {model_path} ({model_path.stat().st_size} bytes)"
+                        "✔ Download complete, cached at %s (%d bytes)",
+                        model_path,
+                        model_path.stat().st_size,
                     )
 
                 except requests.HTTPError as e:
-                    logThis.error(f"❌ Failed to fetch {filename}: {e}")
+                    logThis.error("❌ Failed to fetch %s: %s", filename, e)
                     raise
                 except requests.RequestException as e:
-                    logThis.error(f"❌ Request failed for {filename}: {e}")
+                    logThis.error("❌ Request failed for %s: %s", filename, e)
                     raise
 
             else:
-                logThis.info(f"✔ {filename} already cached at {model_path}")
+                logThis.info("✔ %s already cached at %s", filename, model_path)
 
             return model_path
 
@@ -137,15 +432,18 @@ class ModelManager:
         return model_path
 
     def download_all(self):
-        """Download all known models."""
+        """Download all known models concurrently."""
 
-        for name in MODELS:
+        def fetch(name):
             try:
                 path = self.get_model_path(name)
-                logThis.info(f"✔ {name} available at {path}")
+                logThis.info("✔ %s available at %s", name, path)
             except Exception as e:
-                logThis.error(f"❌ Failed to download {name}: {e}")
+                logThis.error("❌ Failed to download %s: %s", name, e)
+
+        with ThreadPoolExecutor(max_workers=max(1, len(MODELS))) as executor:
+            list(executor.map(fetch, MODELS))
 
 
 if __name__ == "__main__":
-    ModelManager.download_all()
+    ModelManager().download_all()
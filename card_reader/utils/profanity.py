@@ -1,8 +1,16 @@
 # profanity_utils.py
 
+import argparse
+import random
+import time
+from collections import deque
+from dataclasses import dataclass, field
+from functools import lru_cache
+from typing import Dict, Iterable, List, Optional, Sequence, Set, Tuple
+
 import streamlit as st
 from better_profanity import profanity
-from profanity_hinglish import contains_hinglish_profanity
+from profanity_hinglish import contains_hinglish_profanity, load_hinglish_profanity
 
 
 class ProfanityError(ValueError):
@@ -54,3 +62,306 @@ def filter_profanity_from_query(query: str, mode: str = "ui") -> str:
             raise ProfanityError(message)
 
     return query  # return original unmodified query
+
+
+# --- Compiled screening of extracted card fields ---
+#
+# Both word lists are compiled into one Aho-Corasick automaton, so a field is
+# scanned once no matter how many words are listed. Matching follows
+# better_profanity:
+# - case-insensitive, on whole words only;
+# - separators inside a listed phrase are ignored, so "blow job", "blow-job"
+#   and "blowjob" are the same term;
+# - the leetspeak substitutions of `profanity.CHARS_MAPPING` are honoured
+#   ("sh1t", "@ss").
+# Hinglish words are matched as whole words too; a substring check flags
+# ordinary names and addresses.
+
+# Text fields screened by default; phone numbers are left out
+CARD_TEXT_FIELDS = ("name", "email", "company", "address", "job_title", "website")
+
+# Characters that belong to a word, as in better_profanity
+_WORD_SYMBOLS = frozenset("@$*'\"")
+# Separators a listed phrase may contain; terms with other symbols ("sh!+")
+# can never match a tokenized word and are skipped
+_TERM_SEPARATORS = frozenset(" -_.")
+
+
+def _is_word_char(char: str) -> bool:
+    return char.isalnum() or char in _WORD_SYMBOLS
+
+
+@dataclass
+class ProfanityMatch:
+    """One listed term found in a text field."""
+
+    term: str
+    source: str  # "english" or "hinglish"
+    start: int
+    end: int
+    text: str
+    field: str = ""
+
+
+@dataclass
+class CardScreening:
+    """Screening result of one card."""
+
+    index: int
+    matches: List[ProfanityMatch] = field(default_factory=list)
+
+    @property
+    def clean(self) -> bool:
+        return not self.matches
+
+
+class ProfanityScreen:
+    """Aho-Corasick automaton over the English and Hinglish word lists."""
+
+    def __init__(
+        self,
+        terms: Dict[str, str],
+        char_map: Optional[Dict[str, Sequence[str]]] = None,
+    ):
+        """
+        Args:
+            terms: Listed term -> source label
+            char_map: Letter -> characters that may stand in for it
+        """
+        # Text character -> pattern letters it may stand for
+        self._alternatives: Dict[str, Tuple[str, ...]] = {}
+        for letter, substitutes in (char_map or {}).items():
+            for substitute in substitutes:
+                self._alternatives.setdefault(substitute, {substitute: None})[
+                    letter
+                ] = None
+        self._alternatives = {
+            char: tuple(letters) for char, letters in self._alternatives.items()
+        }
+
+        self._goto: List[Dict[str, int]] = [{}]
+        self._output: List[Tuple[int, ...]] = [()]
+        self._terms: List[Tuple[str, str, int]] = []
+        for term, source in terms.items():
+            if not all(_is_word_char(c) or c in _TERM_SEPARATORS for c in term):
+                continue
+            key = "".join(char for char in term.lower() if _is_word_char(char))
+            if key:
+                self._add(key, (term, source, len(key)))
+        self._link()
+
+    def _add(self, key: str, term: Tuple[str, str, int]) -> None:
+        state = 0
+        for char in key:
+            next_state = self._goto[state].get(char)
+            if next_state is None:
+                next_state = len(self._goto)
+                self._goto[state][char] = next_state
+                self._goto.append({})
+                self._output.append(())
+            state = next_state
+        self._output[state] += (len(self._terms),)
+        self._terms.append(term)
+
+    def _link(self) -> None:
+        """Compute failure links breadth-first and merge their outputs."""
+        self._fail = [0] * len(self._goto)
+        queue = deque(self._goto[0].values())
+        while queue:
+            state = queue.popleft()
+            for char, next_state in self._goto[state].items():
+                fail = self._fail[state]
+                while fail and char not in self._goto[fail]:
+                    fail = self._fail[fail]
+                self._fail[next_state] = self._goto[fail].get(char, 0)
+                self._output[next_state] += self._output[self._fail[next_state]]
+                queue.append(next_state)
+        # Transitions are resolved through failure links lazily and cached
+        self._delta: List[Dict[str, int]] = [dict(edges) for edges in self._goto]
+
+    def _step(self, state: int, char: str) -> int:
+        delta = self._delta[state]
+        next_state = delta.get(char)
+        if next_state is None:
+            if state == 0:
+                next_state = 0
+            else:
+                next_state = self._step(self._fail[state], char)
+            delta[char] = next_state
+        return next_state
+
+    def scan(self, text: str, field_name: str = "") -> List[ProfanityMatch]:
+        """All listed terms in `text`, without side effects."""
+        if not text:
+            return []
+
+        lowered = text.lower()
+        # Word characters with separators squeezed out; a match must start at
+        # the first character of a word and end at the last one
+        positions: List[int] = []
+        word_starts: Set[int] = set()
+        word_ends: Set[int] = set()
+        previous_is_word = False
+        for index, char in enumerate(lowered):
+            if _is_word_char(char):
+                if not previous_is_word:
+                    word_starts.add(len(positions))
+                positions.append(index)
+                previous_is_word = True
+            else:
+                if previous_is_word:
+                    word_ends.add(len(positions) - 1)
+                previous_is_word = False
+        if previous_is_word:
+            word_ends.add(len(positions) - 1)
+
+        # Best term per matched span: the one spelled closest to the text
+        spans: Dict[Tuple[int, int], Tuple[str, str, int]] = {}
+        states = {0}
+        for offset, index in enumerate(positions):
+            char = lowered[index]
+            alternatives = self._alternatives.get(char, (char,))
+            states = {
+                self._step(state, letter)
+                for state in states
+                for letter in alternatives
+            }
+            if offset not in word_ends:
+                continue
+            for state in states:
+                for term_id in self._output[state]:
+                    term, source, length = self._terms[term_id]
+                    first = offset - length + 1
+                    if first not in word_starts:
+                        continue
+                    span = (positions[first], index + 1)
+                    rank = self._spelling_rank(term, lowered[span[0] : span[1]])
+                    if span not in spans or rank > spans[span][2]:
+                        spans[span] = (term, source, rank)
+
+        return [
+            ProfanityMatch(term, source, start, end, text[start:end], field_name)
+            for (start, end), (term, source, _) in sorted(spans.items())
+            # House numbers like "455" read as leetspeak; require a letter
+            if any(char.isalpha() for char in text[start:end])
+        ]
+
+    @staticmethod
+    def _spelling_rank(term: str, matched: str) -> int:
+        """2 if spelled exactly as matched, 1 if up to separators, else 0."""
+        term = term.lower()
+        if term == matched:
+            return 2
+
+        def squeeze(value):
+            return "".join(char for char in value if _is_word_char(char))
+
+        return int(squeeze(term) == squeeze(matched))
+
+    def contains_profanity(self, text: str) -> bool:
+        return bool(self.scan(text))
+
+    def screen_cards(
+        self,
+        cards: Iterable[dict],
+        fields: Sequence[str] = CARD_TEXT_FIELDS,
+    ) -> List[CardScreening]:
+        """
+        Screen the text fields of many extracted cards.
+
+        List fields (several emails or names) are screened item by item.
+        Cards are returned in input order, clean ones included.
+        """
+        results = []
+        for index, card in enumerate(cards):
+            screening = CardScreening(index)
+            for field_name in fields:
+                value = card.get(field_name)
+                values = value if isinstance(value, list) else [value]
+                for item in values:
+                    if isinstance(item, str):
+                        screening.matches.extend(self.scan(item, field_name))
+            results.append(screening)
+        return results
+
+
+@lru_cache(maxsize=1)
+def get_profanity_screen() -> ProfanityScreen:
+    """Shared screen compiled from the better_profanity and Hinglish lists."""
+    terms = {word: "hinglish" for word in load_hinglish_profanity()}
+    terms.update({str(word): "english" for word in profanity.CENSOR_WORDSET})
+    return ProfanityScreen(terms, profanity.CHARS_MAPPING)
+
+
+def screen_cards(
+    cards: Iterable[dict], fields: Sequence[str] = CARD_TEXT_FIELDS
+) -> List[CardScreening]:
+    """Screen extracted cards with the shared compiled screen."""
+    return get_profanity_screen().screen_cards(cards, fields)
+
+
+def _synthetic_cards(count: int, seed: int = 0) -> List[dict]:
+    rng = random.Random(seed)
+    first = ["Asha", "Ravi", "Maria", "John", "Wei", "Fatima", "Carlos", "Priya"]
+    last = ["Sharma", "Smith", "Garcia", "Chen", "Khan", "Iyer", "Brown", "Das"]
+    words = ["Global", "Textiles", "Solutions", "Labs", "Design", "Fabrics"]
+    titles = ["Sales Manager", "CTO", "Designer", "Founder", "Buyer"]
+    streets = ["MG Road", "Gandhi Nagar", "Main Street", "Park Avenue", "Lake View"]
+    cards = []
+    for i in range(count):
+        name = f"{rng.choice(first)} {rng.choice(last)}"
+        company = f"{rng.choice(words)} {rng.choice(words)}"
+        slug = company.lower().replace(" ", "")
+        cards.append(
+            {
+                "name": [name],
+                "email": [f"{name.split()[0].lower()}@{slug}.com"],
+                "company": company,
+                "address": f"{rng.randint(1, 999)} {rng.choice(streets)}, Bengaluru",
+                "job_title": rng.choice(titles),
+                "website": [f"https://www.{slug}.com"],
+            }
+        )
+    return cards
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(
+        description="Compare compiled and per-word profanity screening of cards."
+    )
+    parser.add_argument("--cards", type=int, default=10000)
+    parser.add_argument("--baseline-cards", type=int, default=200)
+    args = parser.parse_args(argv)
+
+    cards = _synthetic_cards(args.cards)
+
+    start_time = time.perf_counter()
+    get_profanity_screen()
+    print(f"compile:  {(time.perf_counter() - start_time) * 1000:.0f} ms")
+
+    start_time = time.perf_counter()
+    results = screen_cards(cards)
+    compiled = (time.perf_counter() - start_time) / len(cards)
+    flagged = sum(not result.clean for result in results)
+    print(f"compiled: {compiled * 1000:.3f} ms/card, {flagged}/{len(cards)} flagged")
+
+    hinglish_words = load_hinglish_profanity()
+    start_time = time.perf_counter()
+    for card in cards[: args.baseline_cards]:
+        for field_name in CARD_TEXT_FIELDS:
+            value = card.get(field_name)
+            for item in value if isinstance(value, list) else [value]:
+                text = item.lower()
+                profanity.contains_profanity(text) or any(
+                    word in text for word in hinglish_words
+                )
+    baseline = (time.perf_counter() - start_time) / args.baseline_cards
+    print(
+        f"per-word: {baseline * 1000:.3f} ms/card "
+        f"({baseline / compiled:.0f}x slower)"
+    )
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -0,0 +1,126 @@
+"""Slow Request Profiler
+
+Opt-in sampling profiler for the extraction pipeline. A sampled fraction of
+requests is watched by a background thread that snapshots the calling thread's
+stack every few milliseconds. When the request finishes above the latency
+threshold the samples are written as collapsed stacks (`frame;frame;frame N`),
+which flamegraph.pl, speedscope and inferno render directly. Faster requests
+discard their samples. Only the newest PROFILE_MAX_FILES profiles are kept.
+"""
+
+import functools
+import random
+import sys
+import threading
+import time
+from collections import Counter
+from datetime import datetime
+from pathlib import Path
+
+from utils.constants import (
+    PROFILE_DIR,
+    PROFILE_INTERVAL_MS,
+    PROFILE_LATENCY_THRESHOLD_S,
+    PROFILE_MAX_FILES,
+    PROFILE_SAMPLE_RATE,
+)
+from utils.logger import logThis
+from utils.tracing import current_trace_id
+
+
+class StackSampler:
+    """Sample the stack of one thread at a fixed interval."""
+
+    def __init__(self, thread_id: int, interval: float):
+        self.thread_id = thread_id
+        self.interval = interval
+        self.samples: Counter = Counter()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(
+            target=self._run, name="stack-sampler", daemon=True
+        )
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            if frame is None:
+                continue
+            stack = []
+            while frame is not None:
+                code = frame.f_code
+                stack.append(
+                    f"{code.co_name} ({Path(code.co_filename).name}:{frame.f_lineno})"
+                )
+                frame = frame.f_back
+            self.samples[";".join(reversed(stack))] += 1
+
+    def start(self):
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        self._thread.join()
+
+    def collapsed(self) -> str:
+        """Return the samples in collapsed-stack format."""
+        return "".join(f"{stack} {count}\n" for stack, count in self.samples.items())
+
+
+def _enforce_retention(profile_dir: Path, max_files: int) -> None:
+    """Delete the oldest profiles beyond the retention cap."""
+    profiles = sorted(profile_dir.glob("*.folded"), key=lambda p: p.stat().st_mtime)
+    for old_profile in profiles[: max(len(profiles) - max_files, 0)]:
+        try:
+            old_profile.unlink()
+        except OSError as e:
+            logThis.warning("Could not remove old profile %s: %s", old_profile, e)
+
+
+def write_profile(name: str, elapsed: float, sampler: StackSampler) -> Path:
+    """Write a collapsed-stack profile and apply the retention cap."""
+    PROFILE_DIR.mkdir(parents=True, exist_ok=True)
+    timestamp = datetime.now().strftime("%Y%m%d_%H%M%S_%f")
+    trace_id = current_trace_id()
+    suffix = f"_{trace_id[:8]}" if trace_id else ""
+    profile_path = PROFILE_DIR / f"{name}_{timestamp}_{elapsed:.1f}s{suffix}.folded"
+    profile_path.write_text(sampler.collapsed(), encoding="utf-8")
+    _enforce_retention(PROFILE_DIR, PROFILE_MAX_FILES)
+    return profile_path
+
+
+def profile_slow_requests(func):
+    """
+    Profile a sampled fraction of calls and keep the profile of slow ones.
+
+    Controlled by PROFILE_SAMPLE_RATE, PROFILE_LATENCY_THRESHOLD_S,
+    PROFILE_INTERVAL_MS and PROFILE_MAX_FILES.
+    """
+
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        if PROFILE_SAMPLE_RATE <= 0 or random.random() >= PROFILE_SAMPLE_RATE:
+            return func(*args, **kwargs)
+
+        sampler = StackSampler(threading.get_ident(), PROFILE_INTERVAL_MS / 1000)
+        start_time = time.perf_counter()
+        sampler.start()
+        try:
+            return func(*args, **kwargs)
+        finally:
+            sampler.stop()
+            elapsed = time.perf_counter() - start_time
+            if elapsed >= PROFILE_LATENCY_THRESHOLD_S and sampler.samples:
+                try:
+                    profile_path = write_profile(func.__name__, elapsed, sampler)
+                    logThis.warning(
+                        "%s took %.2f seconds, profile saved to %s",
+                        func.__name__,
+                        elapsed,
+                        profile_path,
+                    )
+                except OSError as e:
+                    logThis.error(
+                        "Could not write profile for %s: %s", func.__name__, e
+                    )
+
+    return wrapper
@@ -0,0 +1,241 @@
+"""Slow Request Recorder and Replay
+
+Requests to `process_ocr_to_json` that exceed RECORD_SLO_S are saved as
+replayable bundles under RECORDINGS_DIR. A bundle is a directory holding the
+original image bytes (`image.bin`) and a `bundle.json` with the preprocessing
+parameters, the OCR output, the exact LLM prompt and the raw LLM response, or
+the error Gemini raised instead. A missing response or a Gemini error is
+replayed as such, so the pipeline takes the same error path as recorded.
+
+The bundles can be pushed through the current pipeline with the LLM answered
+from the recording, which turns our own worst cases into a performance
+regression corpus:
+
+    cd card_reader
+    python -m utils.replay                 # every bundle in RECORDINGS_DIR
+    python -m utils.replay path/to/bundle  # selected bundles
+"""
+
+import argparse
+import functools
+import io
+import json
+import os
+import shutil
+import sys
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from datetime import datetime
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Tuple
+
+from utils.constants import RECORD_SLO_S, RECORDINGS_DIR, RECORDINGS_MAX
+from utils.logger import logThis
+from utils.tracing import current_trace_id
+
+# Bundle being filled by the current request (None: not recording)
+_recording: ContextVar[Optional[Dict[str, Any]]] = ContextVar(
+    "recording", default=None
+)
+# Recorded (response, error) served instead of calling Gemini during replay
+_replayed_llm: ContextVar[Optional[Tuple[Optional[str], Optional[str]]]] = ContextVar(
+    "replayed_llm", default=None
+)
+
+
+class ReplayedLLMError(RuntimeError):
+    """Raised during replay where Gemini raised when the bundle was recorded."""
+
+
+def record(key: str, value: Any) -> None:
+    """Attach a value to the bundle of the current request, if recording."""
+    bundle = _recording.get()
+    if bundle is not None:
+        bundle[key] = value
+
+
+def is_replaying() -> bool:
+    """True inside `replaying()`: LLM calls must not reach Gemini."""
+    return _replayed_llm.get() is not None
+
+
+def replayed_llm_response() -> Optional[str]:
+    """
+    Return the recorded LLM response when replaying (None if Gemini returned
+    no text), or raise ReplayedLLMError if Gemini failed when recorded.
+    """
+    replayed = _replayed_llm.get()
+    if replayed is None:
+        return None
+    llm_response, llm_error = replayed
+    if llm_error is not None:
+        raise ReplayedLLMError(llm_error)
+    return llm_response
+
+
+@contextmanager
+def replaying(llm_response: Optional[str], llm_error: Optional[str] = None):
+    """Answer LLM calls made inside the block with the recorded outcome."""
+    token = _replayed_llm.set((llm_response, llm_error))
+    try:
+        yield
+    finally:
+        _replayed_llm.reset(token)
+
+
+def _image_bytes(image) -> bytes:
+    """Return the original encoded bytes of an uploaded or PIL image."""
+    if isinstance(image, (bytes, bytearray)):
+        return bytes(image)
+    if hasattr(image, "image_bytes"):
+        return image.image_bytes
+    source = image if hasattr(image, "read") else getattr(image, "fp", None)
+    if source is not None and hasattr(source, "seek"):
+        source.seek(0)
+        data = source.read()
+        source.seek(0)
+        if data:
+            return data
+    # The source stream is gone: fall back to a lossless re-encode
+    buffer = io.BytesIO()
+    image.save(buffer, format="PNG")
+    return buffer.getvalue()
+
+
+def _enforce_retention(recordings_dir: Path, max_bundles: int) -> None:
+    """Delete the oldest bundles beyond the retention cap."""
+    bundles = sorted(
+        (p for p in recordings_dir.iterdir() if (p / "bundle.json").exists()),
+        key=lambda p: p.stat().st_mtime,
+    )
+    for old_bundle in bundles[: max(len(bundles) - max_bundles, 0)]:
+        shutil.rmtree(old_bundle, ignore_errors=True)
+
+
+def write_bundle(image, bundle: Dict[str, Any]) -> Path:
+    """Write a bundle directory and apply the retention cap."""
+    timestamp = datetime.now().strftime("%Y%m%d_%H%M%S_%f")
+    trace_id = current_trace_id() or os.urandom(4).hex()
+    bundle_dir = RECORDINGS_DIR / f"{timestamp}_{trace_id[:8]}"
+    bundle_dir.mkdir(parents=True, exist_ok=True)
+
+    (bundle_dir / "image.bin").write_bytes(_image_bytes(image))
+    # bundle.json is written last so only complete bundles are replayed
+    with open(bundle_dir / "bundle.json", "w", encoding="utf-8") as f:
+        json.dump(bundle, f, indent=2, default=str)
+
+    _enforce_retention(RECORDINGS_DIR, RECORDINGS_MAX)
+    return bundle_dir
+
+
+def record_slow_requests(func):
+    """
+    Record calls of `func(image, ...)` slower than RECORD_SLO_S as bundles.
+
+    Replayed calls are never recorded again.
+    """
+
+    @functools.wraps(func)
+    def wrapper(image, *args, **kwargs):
+        if RECORD_SLO_S <= 0 or is_replaying():
+            return func(image, *args, **kwargs)
+
+        bundle: Dict[str, Any] = {"recorded_at": datetime.now().isoformat()}
+        token = _recording.set(bundle)
+        start_time = time.perf_counter()
+        try:
+            result = func(image, *args, **kwargs)
+        finally:
+            _recording.reset(token)
+        elapsed = time.perf_counter() - start_time
+
+        if elapsed >= RECORD_SLO_S:
+            bundle["elapsed_s"] = round(elapsed, 4)
+            bundle["result"] = result
+            try:
+                bundle_dir = write_bundle(image, bundle)
+                logThis.warning(
+                    "%s took %.2f seconds, recorded replay bundle %s",
+                    func.__name__,
+                    elapsed,
+                    bundle_dir,
+                )
+            except Exception as e:
+                logThis.error("Could not record replay bundle: %s", e)
+        return result
+
+    return wrapper
+
+
+def load_bundle(bundle_dir: Path) -> Dict[str, Any]:
+    """Load a bundle directory into a dict with the image bytes attached."""
+    with open(bundle_dir / "bundle.json", encoding="utf-8") as f:
+        bundle = json.load(f)
+    bundle["image_bytes"] = (bundle_dir / "image.bin").read_bytes()
+    return bundle
+
+
+def replay_bundles(bundle_dirs: List[Path], reader) -> List[Dict[str, Any]]:
+    """Run bundles through the current pipeline and compare with the recording."""
+    from ocr_processor import PreprocessedImage, process_ocr_to_json
+
+    reports = []
+    for bundle_dir in bundle_dirs:
+        bundle = load_bundle(bundle_dir)
+        image = PreprocessedImage(bundle["image_bytes"])
+
+        with replaying(bundle.get("llm_response"), bundle.get("llm_error")):
+            start_time = time.perf_counter()
+            json_result, extracted_text = process_ocr_to_json(image, reader, "replay")
+            elapsed = time.perf_counter() - start_time
+
+        reports.append(
+            {
+                "bundle": bundle_dir.name,
+                "recorded_s": bundle.get("elapsed_s"),
+                "replayed_s": round(elapsed, 4),
+                "ocr_text_matches": extracted_text == bundle.get("ocr_text"),
+            }
+        )
+    return reports
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(
+        description="Replay recorded slow card extractions through the pipeline."
+    )
+    parser.add_argument(
+        "bundles",
+        nargs="*",
+        type=Path,
+        help=f"Bundle directories (default: every bundle in {RECORDINGS_DIR})",
+    )
+    args = parser.parse_args(argv)
+
+    bundle_dirs = args.bundles or sorted(
+        p for p in RECORDINGS_DIR.glob("*") if (p / "bundle.json").exists()
+    )
+    if not bundle_dirs:
+        print(f"No replay bundles found in {RECORDINGS_DIR}")
+        return 1
+
+    from ocr_processor import load_ocr_reader
+
+    reader = load_ocr_reader()
+    reports = replay_bundles(bundle_dirs, reader)
+
+    print(f"{'bundle':<36} {'recorded_s':>10} {'replayed_s':>10}  ocr_match")
+    for report in reports:
+        print(
+            f"{report['bundle']:<36} {report['recorded_s'] or 0:>10.3f} "
+            f"{report['replayed_s']:>10.3f}  {report['ocr_text_matches']}"
+        )
+    total_recorded = sum(r["recorded_s"] or 0 for r in reports)
+    total_replayed = sum(r["replayed_s"] for r in reports)
+    print(f"{'total':<36} {total_recorded:>10.3f} {total_replayed:>10.3f}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
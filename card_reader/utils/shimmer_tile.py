@@ -3,15 +3,21 @@ def get_image_aspect_ratio(image):
     Get the aspect ratio of an image.
 
     Args:
-        image: PIL Image or Streamlit uploaded file
+        image: PIL Image, Streamlit uploaded file or path on disk
 
     Returns:
         float: aspect ratio (width/height)
     """
+    from pathlib import Path
+
     from PIL import Image
 
     # Handle different input types
-    if hasattr(image, "name"):  # Streamlit uploaded file
+    if isinstance(image, (str, Path)):  # Path: use the thumbnail manifest
+        from utils.thumbnails import thumbnail_service
+
+        return thumbnail_service.aspect_ratio(image)
+    elif hasattr(image, "name"):  # Streamlit uploaded file
         img = Image.open(image)
     elif isinstance(image, Image.Image):  # PIL Image
         img = image
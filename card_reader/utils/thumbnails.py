@@ -0,0 +1,163 @@
+"""Thumbnail Cache
+
+Small WebP thumbnails for gallery views, generated once and stored on disk
+under THUMBNAIL_DIR. Thumbnails are keyed by source path, mtime and size, so an
+edited image gets a fresh thumbnail while unchanged ones are served from disk.
+
+A manifest next to the thumbnails keeps the original dimensions and aspect
+ratio of every source image, so layout code can size tiles without opening
+the image again. A thumbnail is deleted when its source changes; entries of
+deleted sources are pruned when the manifest is first loaded.
+
+Files are written under unique temporary names and renamed into place, so
+sessions or processes generating the same thumbnail never share a partial
+file.
+"""
+
+import hashlib
+import json
+import os
+import tempfile
+import threading
+from pathlib import Path
+from typing import Dict, Optional, Tuple
+
+from PIL import Image
+
+from utils.constants import THUMBNAIL_DIR, THUMBNAIL_MAX_DIM
+from utils.logger import logThis
+
+
+class ThumbnailService:
+    """Generate, store and look up thumbnails and image dimensions."""
+
+    def __init__(
+        self, thumbnail_dir: Path = THUMBNAIL_DIR, max_dim: int = THUMBNAIL_MAX_DIM
+    ):
+        self.thumbnail_dir = Path(thumbnail_dir)
+        self.max_dim = max_dim
+        self.manifest_path = self.thumbnail_dir / "manifest.json"
+        self._lock = threading.Lock()
+        self._manifest: Optional[Dict[str, dict]] = None
+
+    @property
+    def manifest(self) -> Dict[str, dict]:
+        if self._manifest is None:
+            with self._lock:
+                if self._manifest is None:
+                    try:
+                        with open(self.manifest_path, encoding="utf-8") as f:
+                            manifest = json.load(f)
+                    except (OSError, json.JSONDecodeError):
+                        manifest = {}
+                    self._manifest = manifest
+                    self._prune()
+        return self._manifest
+
+    def _write_atomic(self, path: Path, write) -> None:
+        """Write `path` through a uniquely named temporary file."""
+        self.thumbnail_dir.mkdir(parents=True, exist_ok=True)
+        with tempfile.NamedTemporaryFile(
+            dir=self.thumbnail_dir, suffix=".tmp", delete=False
+        ) as f:
+            tmp_path = Path(f.name)
+            try:
+                write(f)
+            except BaseException:
+                f.close()
+                tmp_path.unlink(missing_ok=True)
+                raise
+        os.replace(tmp_path, path)
+
+    def _save_manifest(self) -> None:
+        self._write_atomic(
+            self.manifest_path,
+            lambda f: f.write(json.dumps(self._manifest).encode("utf-8")),
+        )
+
+    def _prune(self) -> None:
+        """Drop entries of deleted sources and thumbnails nothing refers to."""
+        removed = [key for key in self._manifest if not os.path.exists(key)]
+        for key in removed:
+            del self._manifest[key]
+        referenced = {entry["thumbnail"] for entry in self._manifest.values()}
+        orphans = [
+            path
+            for path in self.thumbnail_dir.glob("*.webp")
+            if path.name not in referenced
+        ]
+        for path in orphans:
+            path.unlink(missing_ok=True)
+        if removed:
+            self._save_manifest()
+        if removed or orphans:
+            logThis.info(
+                "Pruned %d thumbnail entries and %d files", len(removed), len(orphans)
+            )
+
+    def _entry(self, source: Path) -> dict:
+        """Return the up-to-date manifest entry for `source`."""
+        stat = source.stat()
+        key = str(source.resolve())
+        entry = self.manifest.get(key)
+        if (
+            entry
+            and entry["mtime_ns"] == stat.st_mtime_ns
+            and entry["size"] == stat.st_size
+        ):
+            return entry
+
+        # Header read only, pixels are not decoded
+        with Image.open(source) as image:
+            width, height = image.size
+        digest = hashlib.sha1(
+            f"{key}|{stat.st_mtime_ns}|{stat.st_size}|{self.max_dim}".encode()
+        ).hexdigest()
+        entry = {
+            "mtime_ns": stat.st_mtime_ns,
+            "size": stat.st_size,
+            "width": width,
+            "height": height,
+            "aspect_ratio": width / height,
+            "thumbnail": f"{digest}.webp",
+        }
+        with self._lock:
+            previous = self._manifest.get(key)
+            self._manifest[key] = entry
+            self._save_manifest()
+        if previous and previous["thumbnail"] != entry["thumbnail"]:
+            # The source changed: its old thumbnail is never served again
+            (self.thumbnail_dir / previous["thumbnail"]).unlink(missing_ok=True)
+        return entry
+
+    def dimensions(self, source) -> Tuple[int, int]:
+        """Original (width, height) of `source`."""
+        entry = self._entry(Path(source))
+        return entry["width"], entry["height"]
+
+    def aspect_ratio(self, source) -> float:
+        """Original width / height of `source`."""
+        return self._entry(Path(source))["aspect_ratio"]
+
+    def thumbnail(self, source) -> Path:
+        """Path of the WebP thumbnail of `source`, generating it if needed."""
+        entry = self._entry(Path(source))
+        thumbnail_path = self.thumbnail_dir / entry["thumbnail"]
+        if thumbnail_path.exists():
+            return thumbnail_path
+
+        with Image.open(source) as image:
+            # Let JPEG decode at a reduced scale before the exact downsize
+            image.draft(image.mode, (self.max_dim, self.max_dim))
+            image = image.convert("RGBA" if "A" in image.getbands() else "RGB")
+            image.thumbnail((self.max_dim, self.max_dim), Image.Resampling.LANCZOS)
+            self._write_atomic(
+                thumbnail_path,
+                lambda f: image.save(f, format="WEBP", quality=80, method=4),
+            )
+
+        logThis.debug("Created thumbnail %s for %s", thumbnail_path, source)
+        return thumbnail_path
+
+
+thumbnail_service = ThumbnailService()
@@ -21,7 +21,10 @@ def time_function(func):
 
         # Log timing data
         logThis.info(
-            f"{function_name} took {elapsed_time:.4f} seconds", extra={"color": "cyan"}
+            "%s took %.4f seconds",
+            function_name,
+            elapsed_time,
+            extra={"color": "cyan"},
         )
 
         # Store timing data in global dictionary
@@ -66,12 +69,16 @@ def timing_decorator(func):
 
             # Log the execution time
             logThis.info(
-                f"Function {function_name} executed in {execution_time:.4f} seconds",
+                "Function %s executed in %.4f seconds",
+                function_name,
+                execution_time,
                 extra={"color": "cyan"},
             )
         else:
             logThis.info(
-                f"Function {func.__name__} executed in {execution_time:.4f} seconds",
+                "Function %s executed in %.4f seconds",
+                func.__name__,
+                execution_time,
                 extra={"color": "cyan"},
             )
 
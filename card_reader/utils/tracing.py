@@ -0,0 +1,242 @@
+"""Request Tracing Utility
+
+Lightweight span tracing for the card extraction pipeline. Every traced request
+gets a trace ID and nested spans (decode, preprocess, OCR, LLM, save, upload).
+Finished traces are appended to a local JSON Lines file, one OTLP/JSON
+`ExportTraceServiceRequest` per line, which the OpenTelemetry Collector's
+`otlpjsonfile` receiver can ingest as is.
+
+The active span lives in a context variable. Work handed to a thread pool
+must run in a copy of the caller's context to stay in the trace:
+`executor.submit(contextvars.copy_context().run, func, *args)`. A span that
+ends after its root was exported is exported on its own line.
+
+Tracing is sampled per root span; when a request is sampled out every span is a
+shared no-op object and the only cost is one context-variable lookup.
+"""
+
+import functools
+import json
+import os
+import random
+import threading
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from pathlib import Path
+from typing import Any, Dict, List, Optional
+
+from utils.constants import TRACE_FILE, TRACE_SAMPLE_RATE
+from utils.logger import logThis
+
+SERVICE_NAME = "card_reader"
+# OTLP span kind and status codes
+_SPAN_KIND_INTERNAL = 1
+_STATUS_CODES = {"UNSET": 0, "OK": 1, "ERROR": 2}
+
+
+def _otlp_value(value: Any) -> Dict[str, Any]:
+    """OTLP AnyValue; 64-bit integers are strings in OTLP/JSON."""
+    if isinstance(value, bool):
+        return {"boolValue": value}
+    if isinstance(value, int):
+        return {"intValue": str(value)}
+    if isinstance(value, float):
+        return {"doubleValue": value}
+    if isinstance(value, (list, tuple)):
+        return {"arrayValue": {"values": [_otlp_value(item) for item in value]}}
+    return {"stringValue": str(value)}
+
+
+def _otlp_attributes(attributes: Dict[str, Any]) -> List[Dict[str, Any]]:
+    return [
+        {"key": key, "value": _otlp_value(value)}
+        for key, value in attributes.items()
+        if value is not None
+    ]
+
+
+class _NoopSpan:
+    """Span returned when the current request is not being traced."""
+
+    trace_id = None
+    span_id = None
+
+    def set_attribute(self, key: str, value: Any) -> None:
+        pass
+
+    def set_attributes(self, attributes: Dict[str, Any]) -> None:
+        pass
+
+
+NOOP_SPAN = _NoopSpan()
+
+
+class Span:
+    """A single timed operation inside a trace."""
+
+    def __init__(self, trace: "Trace", name: str, parent_id: Optional[str]):
+        self.trace = trace
+        self.trace_id = trace.trace_id
+        self.span_id = os.urandom(8).hex()
+        self.parent_id = parent_id
+        self.name = name
+        self.attributes: Dict[str, Any] = {}
+        self.status = "OK"
+        self.start_ns = time.time_ns()
+        self.end_ns: Optional[int] = None
+
+    def set_attribute(self, key: str, value: Any) -> None:
+        self.attributes[key] = value
+
+    def set_attributes(self, attributes: Dict[str, Any]) -> None:
+        self.attributes.update(attributes)
+
+    def to_dict(self) -> Dict[str, Any]:
+        """The span as an OTLP/JSON `Span` message."""
+        return {
+            "traceId": self.trace_id,
+            "spanId": self.span_id,
+            "parentSpanId": self.parent_id or "",
+            "name": self.name,
+            "kind": _SPAN_KIND_INTERNAL,
+            "startTimeUnixNano": str(self.start_ns),
+            "endTimeUnixNano": str(self.end_ns),
+            "attributes": _otlp_attributes(self.attributes),
+            "status": {"code": _STATUS_CODES[self.status]},
+        }
+
+
+class Trace:
+    """Collects the spans of one request until the root span ends."""
+
+    def __init__(self):
+        self.trace_id = os.urandom(16).hex()
+        self.spans: List[Span] = []
+        self.exported = False
+        # Spans of one trace can end on several threads at once
+        self.lock = threading.Lock()
+
+    def finish(self, span: "Span", root: bool) -> None:
+        """Record an ended span; export the trace when the root ends."""
+        with self.lock:
+            if root:
+                self.spans.append(span)
+                self.exported = True
+                spans = self.spans
+            elif self.exported:
+                # Background work (an upload) outlived the request that started it
+                spans = [span]
+            else:
+                self.spans.append(span)
+                return
+        exporter.export(self.trace_id, spans)
+
+
+class JsonLinesExporter:
+    """Append finished traces to a JSON Lines file, one OTLP request per line."""
+
+    def __init__(self, path: Path):
+        self.path = Path(path)
+        self._lock = threading.Lock()
+
+    def export(self, trace_id: str, spans: List[Span]) -> None:
+        request = {
+            "resourceSpans": [
+                {
+                    "resource": {
+                        "attributes": _otlp_attributes({"service.name": SERVICE_NAME})
+                    },
+                    "scopeSpans": [
+                        {
+                            "scope": {"name": __name__},
+                            "spans": [span.to_dict() for span in spans],
+                        }
+                    ],
+                }
+            ]
+        }
+        line = json.dumps(request, default=str) + "\n"
+        try:
+            with self._lock:
+                self.path.parent.mkdir(parents=True, exist_ok=True)
+                with open(self.path, "a", encoding="utf-8") as f:
+                    f.write(line)
+        except OSError as e:
+            logThis.warning("Could not export trace %s: %s", trace_id, e)
+
+
+exporter = JsonLinesExporter(TRACE_FILE)
+
+# Currently active span (None: no trace, NOOP_SPAN: sampled out)
+_current_span: ContextVar[Any] = ContextVar("current_span", default=None)
+
+
+def current_span():
+    """Return the active span, or the no-op span when nothing is traced."""
+    span = _current_span.get()
+    return span if span is not None else NOOP_SPAN
+
+
+def current_trace_id() -> Optional[str]:
+    """Return the trace ID of the active request, if it is being traced."""
+    return current_span().trace_id
+
+
+@contextmanager
+def span(name: str, **attributes):
+    """
+    Open a span named `name` under the active span.
+
+    If no trace is active a new root span is started and the sampling decision
+    is made here; children inherit it.
+    """
+    parent = _current_span.get()
+
+    if parent is NOOP_SPAN:
+        yield NOOP_SPAN
+        return
+
+    if parent is None:
+        if TRACE_SAMPLE_RATE <= 0 or random.random() >= TRACE_SAMPLE_RATE:
+            token = _current_span.set(NOOP_SPAN)
+            try:
+                yield NOOP_SPAN
+            finally:
+                _current_span.reset(token)
+            return
+        trace = Trace()
+        parent_id = None
+    else:
+        trace = parent.trace
+        parent_id = parent.span_id
+
+    new_span = Span(trace, name, parent_id)
+    new_span.attributes.update(attributes)
+    token = _current_span.set(new_span)
+    try:
+        yield new_span
+    except BaseException as e:
+        new_span.status = "ERROR"
+        new_span.set_attribute("error.type", type(e).__name__)
+        raise
+    finally:
+        new_span.end_ns = time.time_ns()
+        _current_span.reset(token)
+        trace.finish(new_span, root=parent_id is None)
+
+
+def traced(name: Optional[str] = None):
+    """Decorator that wraps every call of the function in a span."""
+
+    def decorator(func):
+        span_name = name or func.__name__
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            with span(span_name):
+                return func(*args, **kwargs)
+
+        return wrapper
+
+    return decorator
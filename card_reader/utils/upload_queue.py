@@ -0,0 +1,225 @@
+"""Background S3 Upload Queue
+
+Uploads are handed to a bounded pool of worker threads so the request thread
+returns as soon as the bytes are queued. Each upload uses the tuned multipart
+settings of `aws_helper.TRANSFER_CONFIG` and is retried with exponential
+backoff on throttling, server and network errors.
+
+- Backpressure: at most S3_UPLOAD_WORKERS + S3_UPLOAD_QUEUE_SIZE uploads are
+  held in memory; further `submit()` calls block until a slot frees up.
+- Metrics: `upload_queue.metrics.snapshot()` reports counts, bytes, retries,
+  throughput and latency percentiles.
+
+Benchmark against the local stand-in (or the real bucket with S3_BACKEND=aws):
+
+    cd card_reader
+    S3_BACKEND=local python -m utils.upload_queue --count 20 --size-mb 12
+"""
+
+import argparse
+import contextvars
+import io
+import threading
+import time
+from collections import deque
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Dict, Optional
+
+from botocore.exceptions import BotoCoreError, ClientError
+
+from utils import aws_helper
+from utils.constants import (
+    AWS_BUCKET_NAME,
+    S3_UPLOAD_BACKOFF_BASE_S,
+    S3_UPLOAD_MAX_ATTEMPTS,
+    S3_UPLOAD_QUEUE_SIZE,
+    S3_UPLOAD_WORKERS,
+)
+from utils.logger import logThis
+from utils.messages import S3_UPLOAD_FAILURE
+from utils.tracing import current_span, span
+
+
+def is_retryable(error: Exception) -> bool:
+    """Throttling, 5xx and connection errors are retried; other 4xx are not."""
+    if isinstance(error, ClientError):
+        status = error.response.get("ResponseMetadata", {}).get("HTTPStatusCode", 0)
+        code = error.response.get("Error", {}).get("Code", "")
+        return status >= 500 or status == 429 or code in {"SlowDown", "RequestTimeout"}
+    return isinstance(error, (BotoCoreError, OSError))
+
+
+class UploadMetrics:
+    """Thread-safe counters and recent latencies of finished uploads."""
+
+    def __init__(self, window: int = 1000):
+        self._lock = threading.Lock()
+        self._durations: deque = deque(maxlen=window)
+        self.uploaded = 0
+        self.failed = 0
+        self.retries = 0
+        self.bytes = 0
+        self.busy_seconds = 0.0
+
+    def record(self, size: int, seconds: float, attempts: int, success: bool):
+        with self._lock:
+            self.retries += attempts - 1
+            self.busy_seconds += seconds
+            if success:
+                self.uploaded += 1
+                self.bytes += size
+                self._durations.append(seconds)
+            else:
+                self.failed += 1
+
+    def snapshot(self) -> Dict[str, float]:
+        with self._lock:
+            durations = sorted(self._durations)
+            snapshot = {
+                "uploaded": self.uploaded,
+                "failed": self.failed,
+                "retries": self.retries,
+                "bytes": self.bytes,
+                "mb_per_busy_s": (
+                    self.bytes / 1024 / 1024 / self.busy_seconds
+                    if self.busy_seconds
+                    else 0.0
+                ),
+            }
+        for name, fraction in (("p50_s", 0.5), ("p95_s", 0.95), ("max_s", 1.0)):
+            index = min(int(len(durations) * fraction), len(durations) - 1)
+            snapshot[name] = round(durations[index], 4) if durations else 0.0
+        return snapshot
+
+
+class UploadQueue:
+    """Bounded background uploader with retries and metrics."""
+
+    def __init__(
+        self,
+        workers: int = S3_UPLOAD_WORKERS,
+        queue_size: int = S3_UPLOAD_QUEUE_SIZE,
+        max_attempts: int = S3_UPLOAD_MAX_ATTEMPTS,
+        backoff_base_s: float = S3_UPLOAD_BACKOFF_BASE_S,
+    ):
+        self.max_attempts = max_attempts
+        self.backoff_base_s = backoff_base_s
+        self.metrics = UploadMetrics()
+        self._slots = threading.BoundedSemaphore(workers + queue_size)
+        self._executor = ThreadPoolExecutor(
+            max_workers=workers, thread_name_prefix="s3-upload"
+        )
+
+    def submit(
+        self, file_obj, s3_key: str, extra_args: Optional[dict] = None
+    ) -> Future:
+        """
+        Queue `file_obj` (bytes or a file-like object) for upload to `s3_key`.
+
+        File-like objects are read here, so the caller may close or reuse them
+        as soon as this returns. The future resolves to True or False.
+        """
+        if hasattr(file_obj, "read"):
+            if hasattr(file_obj, "seek"):
+                file_obj.seek(0)
+            data = file_obj.read()
+        else:
+            data = bytes(file_obj)
+
+        self._slots.acquire()
+        try:
+            future = self._executor.submit(
+                contextvars.copy_context().run,
+                self._upload,
+                data,
+                s3_key,
+                extra_args,
+            )
+        except Exception:
+            self._slots.release()
+            raise
+        future.add_done_callback(lambda _: self._slots.release())
+        return future
+
+    def _upload(self, data: bytes, s3_key: str, extra_args: Optional[dict]) -> bool:
+        start_time = time.perf_counter()
+        attempt = 0
+        with span("s3_upload", **{"s3.key": s3_key, "s3.bytes": len(data)}):
+            while True:
+                attempt += 1
+                try:
+                    aws_helper.s3.upload_fileobj(
+                        io.BytesIO(data),
+                        AWS_BUCKET_NAME,
+                        s3_key,
+                        ExtraArgs=extra_args,
+                        Config=aws_helper.TRANSFER_CONFIG,
+                    )
+                    success = True
+                    break
+                except Exception as e:
+                    if attempt >= self.max_attempts or not is_retryable(e):
+                        logThis.error(
+                            "%s:%s after %d attempts: %s",
+                            S3_UPLOAD_FAILURE,
+                            s3_key,
+                            attempt,
+                            e,
+                        )
+                        success = False
+                        break
+                    delay = self.backoff_base_s * 2 ** (attempt - 1)
+                    logThis.warning(
+                        "Upload of %s failed (%s), retrying in %.1fs", s3_key, e, delay
+                    )
+                    time.sleep(delay)
+            current_span().set_attribute("s3.attempts", attempt)
+
+        elapsed = time.perf_counter() - start_time
+        self.metrics.record(len(data), elapsed, attempt, success)
+        return success
+
+    def shutdown(self, wait: bool = True) -> None:
+        self._executor.shutdown(wait=wait)
+
+
+upload_queue = UploadQueue()
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(
+        description="Compare sequential and queued S3 uploads."
+    )
+    parser.add_argument("--count", type=int, default=20)
+    parser.add_argument("--size-mb", type=float, default=4)
+    parser.add_argument("--prefix", default="benchmark/")
+    args = parser.parse_args(argv)
+
+    payload = bytes(int(args.size_mb * 1024 * 1024))
+    total_mb = args.count * args.size_mb
+    print(f"backend={type(aws_helper.s3).__name__} {args.count} x {args.size_mb} MB")
+
+    start_time = time.perf_counter()
+    for i in range(args.count):
+        aws_helper.upload_file_to_s3(payload, f"{args.prefix}seq_{i}")
+    sequential = time.perf_counter() - start_time
+    print(f"sequential: {sequential:.2f}s ({total_mb / sequential:.1f} MB/s)")
+
+    start_time = time.perf_counter()
+    futures = [
+        upload_queue.submit(payload, f"{args.prefix}queued_{i}")
+        for i in range(args.count)
+    ]
+    submitted = time.perf_counter() - start_time
+    ok = sum(future.result() for future in futures)
+    queued = time.perf_counter() - start_time
+    print(
+        f"queued:     {queued:.2f}s ({total_mb / queued:.1f} MB/s), "
+        f"submit returned after {submitted * 1000:.0f} ms, {ok}/{args.count} ok"
+    )
+    print(upload_queue.metrics.snapshot())
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())